@@ -0,0 +1,273 @@
+"""
+Registry of the support inboxes served by one deployment.
+
+Each account has its own Gmail credentials, stored in ACCOUNTS_DIR/<account_id>/token.json,
+and its own knowledge base file and File Search store. The "default" account is the
+original single-inbox setup (GMAIL_TOKEN_PATH and nexa_learn.txt) and always exists.
+
+Per-account objects (RAG agents, inbox stores) are created on first use by a TenantPool,
+which keeps at most a fixed number alive and drops tenants that have been idle for a while,
+so memory and start-up time follow the number of active accounts rather than all of them.
+
+Accounts are managed from the command line:
+
+    python -m accounts add support-eu --email support-eu@example.com --knowledge-base kb/eu.txt --authorize
+    python -m accounts import-token support-eu path/to/token.json
+    python -m accounts list
+    python -m accounts remove support-eu
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from storage import data_path
+
+ACCOUNTS_DB_PATH = os.getenv("ACCOUNTS_DB_PATH") or data_path("accounts.db")
+ACCOUNTS_DIR = os.getenv("ACCOUNTS_DIR", "accounts")
+DEFAULT_ACCOUNT = "default"
+# Most per-account objects kept alive at once, and how long an unused one is kept.
+TENANT_POOL_SIZE = int(os.getenv("TENANT_POOL_SIZE", "16"))
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "1800"))
+
+_ACCOUNT_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+class AccountRegistry:
+    """
+    A SQLite table of accounts. Lookups are memoized, so resolving the account of a request
+    does not touch the database after the first time.
+    """
+
+    def __init__(self, path=None, accounts_dir=None):
+        self.path = path or ACCOUNTS_DB_PATH
+        self.accounts_dir = accounts_dir or ACCOUNTS_DIR
+        self._lock = threading.Lock()
+        self._memo = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id TEXT PRIMARY KEY,
+                email TEXT,
+                knowledge_base TEXT,
+                store_name TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def _to_dict(self, row):
+        account_id, email, knowledge_base, store_name, created_at = row
+        return {'account_id': account_id, 'email': email, 'knowledge_base': knowledge_base,
+                'store_name': store_name, 'created_at': created_at}
+
+    def add(self, account_id, email=None, knowledge_base=None, store_name=None):
+        """
+        Registers (or updates) an account and returns it.
+
+        Raises:
+            ValueError: If the account ID is not a lowercase slug or is the default account.
+        """
+        if not _ACCOUNT_ID.match(account_id) or account_id == DEFAULT_ACCOUNT:
+            raise ValueError(f"Invalid account ID: {account_id!r} (use lowercase letters, digits, '-' and '_')")
+        if knowledge_base is not None:
+            knowledge_base = os.path.abspath(knowledge_base)
+        row = (account_id, email, knowledge_base, store_name or f"{account_id}-knowledge-base", time.time())
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?)", row)
+            self._conn.commit()
+            self._memo.pop(account_id, None)
+        return self._to_dict(row)
+
+    def get(self, account_id):
+        """Returns an account, or None if it is not registered. The default account always exists."""
+        if account_id == DEFAULT_ACCOUNT:
+            return {'account_id': DEFAULT_ACCOUNT, 'email': None, 'knowledge_base': None,
+                    'store_name': None, 'created_at': None}
+        with self._lock:
+            if account_id not in self._memo:
+                row = self._conn.execute("SELECT * FROM accounts WHERE account_id = ?", (account_id,)).fetchone()
+                if row is None:
+                    # Misses are not memoized, so accounts added from the CLI are picked up.
+                    return None
+                self._memo[account_id] = self._to_dict(row)
+            return self._memo[account_id]
+
+    def find_by_email(self, email):
+        """Returns the account of a mailbox address, e.g. from a Gmail push notification, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM accounts WHERE lower(email) = lower(?)", (email,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM accounts ORDER BY account_id").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def remove(self, account_id):
+        """Unregisters an account and deletes its stored credentials."""
+        with self._lock:
+            self._conn.execute("DELETE FROM accounts WHERE account_id = ?", (account_id,))
+            self._conn.commit()
+            self._memo.pop(account_id, None)
+        token_path = self.token_path(account_id)
+        if os.path.exists(token_path):
+            os.remove(token_path)
+
+    def token_path(self, account_id):
+        """Path of the account's stored OAuth token (authorized-user JSON)."""
+        return os.path.join(self.accounts_dir, account_id, "token.json")
+
+    def has_credentials(self, account_id):
+        return os.path.exists(self.token_path(account_id))
+
+    def save_token(self, account_id, token_json):
+        """Stores an authorized-user token for the account, readable only by the current user."""
+        path = self.token_path(account_id)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as token:
+            token.write(token_json)
+
+class TenantPool:
+    """
+    Lazily created per-account objects with LRU eviction.
+
+    `factory(account_id)` builds the object the first time an account is used. Beyond
+    `max_size` objects the least recently used one is dropped, and objects unused for
+    `idle_seconds` are dropped on the next lookup. Objects for which `in_use(obj)` returns
+    True (e.g. a running background job) are never dropped; `on_evict(obj)` is called for
+    every dropped object so it can release threads or connections.
+
+    Args:
+        factory: Callable taking an account ID and returning the per-account object.
+        max_size: Most objects kept at once.
+        idle_seconds: Objects unused for longer than this are dropped.
+        in_use: Optional callable telling whether an object must be kept.
+        on_evict: Optional callable receiving each dropped object.
+    """
+
+    def __init__(self, factory, max_size=None, idle_seconds=None, in_use=None, on_evict=None):
+        self.factory = factory
+        self.max_size = max_size or TENANT_POOL_SIZE
+        self.idle_seconds = idle_seconds or TENANT_IDLE_SECONDS
+        self.in_use = in_use
+        self.on_evict = on_evict
+        self.created = 0
+        self.evicted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account_id):
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._entries.move_to_end(account_id)
+                return entry[0]
+
+        # Built outside the lock so a slow factory does not block other accounts.
+        obj = self.factory(account_id)
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry is not None:
+                # Another thread built it first; keep theirs.
+                dropped, obj = obj, entry[0]
+            else:
+                dropped = None
+                self._entries[account_id] = [obj, time.monotonic()]
+                self.created += 1
+            evicted = self._evict()
+        if dropped is not None:
+            evicted.append(dropped)
+        for old in evicted:
+            self._release(old)
+        return obj
+
+    def peek(self, account_id):
+        """Returns the object of an account if it is loaded, without creating or touching it."""
+        with self._lock:
+            entry = self._entries.get(account_id)
+            return entry[0] if entry else None
+
+    def clear(self):
+        """Drops every object, in use or not, e.g. on shutdown."""
+        with self._lock:
+            evicted = [obj for obj, _ in self._entries.values()]
+            self.evicted += len(evicted)
+            self._entries.clear()
+        for old in evicted:
+            self._release(old)
+
+    def _evict(self):
+        # Caller holds the lock.
+        now = time.monotonic()
+        evicted = []
+        for account_id, (obj, used_at) in list(self._entries.items()):
+            over_capacity = len(self._entries) > self.max_size
+            if not over_capacity and now - used_at <= self.idle_seconds:
+                # Entries are in LRU order, so the rest are newer.
+                break
+            if self.in_use is not None and self.in_use(obj):
+                continue
+            del self._entries[account_id]
+            self.evicted += 1
+            evicted.append(obj)
+        return evicted
+
+    def _release(self, obj):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(obj)
+        except Exception as e:
+            print(f"Failed to release tenant object: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {'loaded': list(self._entries), 'max_size': self.max_size,
+                    'idle_seconds': self.idle_seconds, 'created': self.created, 'evicted': self.evicted}
+
+account_registry = AccountRegistry()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manages the support inboxes served by this deployment.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help="Register or update an account")
+    add.add_argument('account_id')
+    add.add_argument('--email')
+    add.add_argument('--knowledge-base', help="Knowledge base file for this account")
+    add.add_argument('--store-name', help="File Search store display name (default: <account_id>-knowledge-base)")
+    add.add_argument('--authorize', action='store_true', help="Run the Gmail OAuth flow and store the token")
+    token = commands.add_parser('import-token', help="Store an existing authorized-user token.json")
+    token.add_argument('account_id')
+    token.add_argument('path')
+    commands.add_parser('list', help="List registered accounts")
+    remove = commands.add_parser('remove', help="Unregister an account and delete its token")
+    remove.add_argument('account_id')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        account = account_registry.add(args.account_id, email=args.email, knowledge_base=args.knowledge_base,
+                                       store_name=args.store_name)
+        print(f"Registered account {account['account_id']}")
+        if args.authorize:
+            from email_fetcher_tool import authorize_account
+            authorize_account(args.account_id)
+            print(f"Stored Gmail credentials in {account_registry.token_path(args.account_id)}")
+    elif args.command == 'import-token':
+        if account_registry.get(args.account_id) is None:
+            parser.error(f"Unknown account: {args.account_id}")
+        with open(args.path) as source:
+            account_registry.save_token(args.account_id, source.read())
+        print(f"Stored Gmail credentials in {account_registry.token_path(args.account_id)}")
+    elif args.command == 'list':
+        for account in account_registry.list():
+            credentials = "credentials stored" if account_registry.has_credentials(account['account_id']) else "no credentials"
+            print(f"{account['account_id']:<24} {account['email'] or '-':<32} {credentials}")
+    elif args.command == 'remove':
+        account_registry.remove(args.account_id)
+        print(f"Removed account {args.account_id}")
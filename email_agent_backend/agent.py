@@ -2,97 +2,522 @@ from google import genai
 from google.genai import types
 import time
 import os
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
 from dotenv import load_dotenv
+from retrieval import LocalRetriever
+from accounts import TenantPool, account_registry
+from shared_state import shared_state
+from llm_scheduler import FAST, INTERACTIVE, STRONG, ModelRouter, is_overload_error, llm_scheduler
+import metrics
 
 load_dotenv()
 
-class RAGAgent:
-    def __init__(self, file_path, store_name="NexaLearnStore", model_name=None):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            print("Warning: GEMINI_API_KEY not found in environment variables.")
-        
-        self.client = genai.Client(api_key=api_key)
-        self.file_path = file_path
-        self.store_name = store_name
-        self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-        print(f"RAGAgent initialized with model: {self.model_name}")
-        self.store = None
-        self._initialize_knowledge_base()
+logger = logging.getLogger(__name__)
 
-    def _initialize_knowledge_base(self):
-        print("Initializing RAG Knowledge Base...")
-        
-        # Create a new store
-        # Note: In a production environment, you might want to check if a store with this name already exists 
-        # and reuse it to avoid creating duplicates. For now, we create one per process.
-        self.store = self.client.file_search_stores.create(
-            config={'display_name': self.store_name}
-        )
-        
-        # Upload file
-        if not os.path.exists(self.file_path):
-            raise FileNotFoundError(f"Knowledge base file not found: {self.file_path}")
+# How long a call waits for background knowledge base initialization before failing.
+RAG_READY_TIMEOUT = float(os.getenv("RAG_READY_TIMEOUT", "120"))
 
-        # Explicitly upload the file first with mime_type
-        print(f"Uploading file: {self.file_path}")
-        file_upload = self.client.files.upload(
-            file=self.file_path,
-            config={
-                'mime_type': 'text/plain',
-                'display_name': os.path.basename(self.file_path)
-            }
+# Retrieval backend: "file_search" uses the Gemini File Search tool, "local" uses an
+# in-process BM25 index and injects the top passages into the prompt.
+RAG_RETRIEVAL = os.getenv("RAG_RETRIEVAL", "file_search")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+
+# The system prompt is sent as a Gemini context cache so the static prefix is not billed
+# and processed in full on every call. Models or prefixes the API refuses to cache (e.g.
+# below the minimum cacheable size) fall back to an inline system instruction.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# Context caches are recreated this many seconds before they expire server-side.
+CONTEXT_CACHE_MARGIN = 60
+
+class FileSearchStoreBackend(ABC):
+    """
+    Interface for the File Search store operations used by RAGAgent.
+
+    The Gemini implementation talks to the API; tests and benchmarks can supply a
+    local fake that implements the same three methods.
+    """
+
+    @abstractmethod
+    def find_store(self, display_name):
+        """Returns the name of a populated store with this display name, or None."""
+
+    @abstractmethod
+    def create_store(self, display_name):
+        """Creates an empty store and returns its name."""
+
+    @abstractmethod
+    def upload(self, store_name, file_path, display_name):
+        """Uploads a file into the store and blocks until it has been indexed."""
+
+class GeminiFileSearchBackend(FileSearchStoreBackend):
+    def __init__(self, client, poll_interval=2):
+        self.client = client
+        self.poll_interval = poll_interval
+
+    def find_store(self, display_name):
+        for store in self.client.file_search_stores.list():
+            if store.display_name != display_name:
+                continue
+            # A store left empty by an interrupted upload is not reusable.
+            if not getattr(store, 'active_documents_count', None):
+                continue
+            return store.name
+        return None
+
+    def create_store(self, display_name):
+        store = self.client.file_search_stores.create(
+            config={'display_name': display_name}
         )
+        return store.name
 
-        print(f"File uploaded: {file_upload.name}, adding to store...")      
+    def upload(self, store_name, file_path, display_name):
         operation = self.client.file_search_stores.upload_to_file_search_store(
-            file=self.file_path, 
-            file_search_store_name=self.store.name,
+            file=file_path,
+            file_search_store_name=store_name,
             config={
-                'display_name': os.path.basename(self.file_path),
+                'display_name': display_name,
                 'mime_type': 'text/plain'
             }
         )
-            
+
         # Wait for processing
         while not operation.done:
             print("Waiting for file processing...")
-            time.sleep(2)
+            time.sleep(self.poll_interval)
             operation = self.client.operations.get(operation=operation)
+
+def file_digest(file_path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RAGAgent:
+    def __init__(self, file_path, store_name="NexaLearnStore", model_name=None, backend=None, background=True,
+                 retrieval=None, client=None, scheduler=None, router=None):
+        if client is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                print("Warning: GEMINI_API_KEY not found in environment variables.")
+            client = genai.Client(api_key=api_key)
+
+        self.client = client
+        self.file_path = file_path
+        self.store_name = store_name
+        self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+        # Calls are queued and rate-adapted by the shared scheduler; simple inquiries may use a cheaper model.
+        self.scheduler = scheduler or llm_scheduler
+        self.router = router or ModelRouter(self.model_name)
+        print(f"RAGAgent initialized with model: {self.model_name}"
+              + (f" (fast tier: {self.router.fast_model})" if self.router.fast_model else ""))
+        self.backend = backend or GeminiFileSearchBackend(self.client)
+        self.retrieval = retrieval or RAG_RETRIEVAL
+        self.retriever = None
+        self.store = None
+        self.knowledge_digest = None
+        self._prefix_caches = {}
+        self._prefix_cache_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._init_error = None
+        self._init_thread = None
+        self._start_lock = threading.Lock()
+
+        # With background=True the store is initialized on a thread started by start() (the
+        # server's startup handler) or by the first call, so creating an agent does no I/O.
+        if not background:
+            self._initialize_knowledge_base()
+            self._ready.set()
+
+    def start(self):
+        """Starts initializing the knowledge base in the background, if not started yet."""
+        with self._start_lock:
+            if self._init_thread is None and not self._ready.is_set():
+                self._init_thread = threading.Thread(target=self._initialize_in_background, name="rag-init", daemon=True)
+                self._init_thread.start()
+
+    def _initialize_in_background(self):
+        try:
+            self._initialize_knowledge_base()
+        except Exception as e:
+            print(f"Failed to initialize RAG Knowledge Base: {e}")
+            self._init_error = e
+        finally:
+            self._ready.set()
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Blocks until the knowledge base is ready.
+
+        Raises:
+            RuntimeError: If initialization failed or did not finish within `timeout` seconds.
+        """
+        self.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("RAG Knowledge Base is still initializing, please retry shortly.")
+        if self._init_error is not None:
+            raise RuntimeError(f"RAG Knowledge Base failed to initialize: {self._init_error}")
+
+    def _initialize_knowledge_base(self):
+        print("Initializing RAG Knowledge Base...")
         
-        print(f"RAG Knowledge Base Ready: {self.store.name}")
+        if not os.path.exists(self.file_path):
+            raise FileNotFoundError(f"Knowledge base file not found: {self.file_path}")
 
-    def call(self, messages):
+        if self.retrieval == "local":
+            self.retriever = LocalRetriever([self.file_path])
+            self.knowledge_digest = self.retriever.version
+            print(f"Local RAG index ready: {len(self.retriever.passages)} passages")
+            return
+
+        # Stores are named after the knowledge base digest, so an unchanged file reuses the
+        # existing store across restarts and workers instead of uploading it again.
+        self.knowledge_digest = file_digest(self.file_path)
+        display_name = f"{self.store_name}-{self.knowledge_digest[:16]}"
+
+        # Workers starting together take turns, so only the first uploads and the others reuse its store.
+        with shared_state.lock(f"knowledge-base:{display_name}", ttl=600):
+            store_name = self.backend.find_store(display_name)
+            if store_name:
+                print(f"Reusing RAG Knowledge Base: {store_name}")
+            else:
+                store_name = self.backend.create_store(display_name)
+                print(f"Uploading file: {self.file_path} to store {store_name}")
+                self.backend.upload(store_name, self.file_path, os.path.basename(self.file_path))
+
+        self.store = store_name
+        print(f"RAG Knowledge Base Ready: {self.store}")
+
+    def call(self, messages, query=None, usage=None, priority=INTERACTIVE):
         """
         Generates a response using the RAG knowledge base.
         args:
-            messages: A list of dicts [{'role': 'user', 'content': '...'}, ...]
+            messages: A list of dicts [{'role': 'user', 'content': '...'}, ...]; 'system' messages
+                are sent as the (cached) system instruction
+            query: Optional retrieval query for the local backend (defaults to the prompt); it also
+                decides the model tier
+            usage: Optional dict that receives the token usage reported by the API and the model used
+            priority: Scheduling priority, llm_scheduler.INTERACTIVE or llm_scheduler.BULK
+        """
+        self.wait_until_ready(timeout=RAG_READY_TIMEOUT)
+
+        user_prompt = self._extract_prompt(messages)
+        system_prompt = self._extract_system(messages)
+        tier, model, request = self._route(user_prompt, query, system_prompt)
+        response = self.scheduler.run(
+            lambda: self._generate(model, request, user_prompt, query, system_prompt), priority)
+        escalated = False
+        if tier == FAST and self.retriever is None and not self._is_grounded(response):
+            # The cheap answer does not cite the knowledge base; ask the main model instead.
+            self._record_usage(None, response, model)
+            tier, model, request = self._escalate(user_prompt, query, system_prompt, 'ungrounded')
+            response = self.scheduler.run(
+                lambda: self._generate(model, request, user_prompt, query, system_prompt), priority)
+            escalated = True
+        self._record_usage(usage, response, model)
+        if usage is not None:
+            usage.update(model=model, tier=tier, escalated=escalated)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RAG Response received: %s", response.text[:100] if response.text else 'No response')
+        return response.text
+
+    def call_stream(self, messages, query=None, usage=None, priority=INTERACTIVE):
+        """
+        Generates a response using the RAG knowledge base, yielding text chunks as they are produced.
+        Time to first token and total generation time are logged separately.
+        args:
+            messages: A list of dicts [{'role': 'user', 'content': '...'}, ...]; 'system' messages
+                are sent as the (cached) system instruction
+            query: Optional retrieval query for the local backend (defaults to the prompt); it also
+                decides the model tier
+            usage: Optional dict that receives the token usage reported by the API and the model used
+                once the stream ends
+            priority: Scheduling priority, llm_scheduler.INTERACTIVE or llm_scheduler.BULK
+        """
+        self.wait_until_ready(timeout=RAG_READY_TIMEOUT)
+
+        user_prompt = self._extract_prompt(messages)
+        system_prompt = self._extract_system(messages)
+        tier, model, request = self._route(user_prompt, query, system_prompt)
+
+        escalated = False
+        if tier == FAST and self.retriever is None:
+            # A fast-tier answer is only released once it is known to cite the knowledge base,
+            # so it is collected first; simple inquiries get short answers, so little time is lost.
+            parts = []
+            stream = self._scheduled_stream(model, request, user_prompt, query, system_prompt, priority)
+            while True:
+                try:
+                    parts.append(next(stream))
+                except StopIteration as done:
+                    last_chunk, grounded = done.value
+                    break
+            if grounded:
+                yield from parts
+            else:
+                self._record_usage(None, last_chunk, model)
+                tier, model, request = self._escalate(user_prompt, query, system_prompt, 'ungrounded')
+                last_chunk, _ = yield from self._scheduled_stream(
+                    model, request, user_prompt, query, system_prompt, priority)
+                escalated = True
+        else:
+            last_chunk, _ = yield from self._scheduled_stream(model, request, user_prompt, query, system_prompt, priority)
+        self._record_usage(usage, last_chunk, model)
+        if usage is not None:
+            usage.update(model=model, tier=tier, escalated=escalated)
+
+    def _route(self, user_prompt, query, system_prompt):
+        """Picks the model tier of a call and prepares its request; returns (tier, model, request)."""
+        tier, reason = self.router.route(query or user_prompt)
+        model = self.router.model(tier)
+        contents, config, passages = self._prepare_request(user_prompt, query, system_prompt, model=model)
+        if tier == FAST and passages == 0:
+            # Local retrieval found nothing a cheap answer could be grounded in.
+            return self._escalate(user_prompt, query, system_prompt, 'no_passages')
+        metrics.llm_tiers.inc(tier=tier, reason=reason)
+        return tier, model, (contents, config)
+
+    def _escalate(self, user_prompt, query, system_prompt, reason):
+        model = self.router.strong_model
+        print(f"Escalating to {model} ({reason})")
+        metrics.llm_tiers.inc(tier=STRONG, reason=reason)
+        contents, config, _ = self._prepare_request(user_prompt, query, system_prompt, model=model)
+        return STRONG, model, (contents, config)
+
+    @staticmethod
+    def _is_grounded(response):
+        """True if a File Search response (or stream chunk) cites knowledge base chunks."""
+        for candidate in getattr(response, 'candidates', None) or ():
+            metadata = getattr(candidate, 'grounding_metadata', None)
+            if metadata is not None and getattr(metadata, 'grounding_chunks', None):
+                return True
+        return False
+
+    def _generate(self, model, request, user_prompt, query, system_prompt):
+        contents, config = request
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            with metrics.span("llm.generate", model=model, stream=False):
+                try:
+                    response = self.client.models.generate_content(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    )
+                except Exception as e:
+                    if not config.cached_content or is_overload_error(e):
+                        raise
+                    # The cache may have been evicted server-side; retry once with the prefix inline.
+                    print(f"Context cache {config.cached_content} failed ({e}), retrying without it")
+                    self._drop_prefix_cache(config.cached_content)
+                    contents, config, _ = self._prepare_request(user_prompt, query, system_prompt, model=model,
+                                                                use_cache=False)
+                    response = self.client.models.generate_content(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    )
+            status = 'ok'
+        finally:
+            metrics.llm_requests.inc(model=model, kind='call', status=status)
+            metrics.llm_latency.observe(time.perf_counter() - start, model=model, kind='call')
+        return response
+
+    def _scheduled_stream(self, model, request, user_prompt, query, system_prompt, priority):
         """
+        Runs _generate_stream in a scheduler slot. Quota and overload errors are retried with
+        backoff as long as no chunk has been yielded. Returns (last_chunk, grounded).
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            stream = self._generate_stream(model, request, user_prompt, query, system_prompt)
+            yielded = False
+            try:
+                with self.scheduler.slot(priority):
+                    while True:
+                        try:
+                            text = next(stream)
+                        except StopIteration as done:
+                            return done.value
+                        yielded = True
+                        yield text
+            except Exception as e:
+                delay = None if yielded else self.scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                print(f"LLM stream rejected ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+            finally:
+                stream.close()
+
+    def _generate_stream(self, model, request, user_prompt, query, system_prompt):
+        contents, config = request
+        start = time.perf_counter()
+        time_to_first_token = None
+        last_chunk = None
+        grounded = False
+        status = 'error'
+        try:
+            with metrics.span("llm.generate", model=model, stream=True):
+                try:
+                    for chunk in self.client.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    ):
+                        last_chunk = chunk
+                        grounded = grounded or self._is_grounded(chunk)
+                        if not chunk.text:
+                            continue
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - start
+                            metrics.llm_first_token.observe(time_to_first_token, model=model)
+                            print(f"RAG time to first token: {time_to_first_token:.3f}s")
+                        yield chunk.text
+                except Exception as e:
+                    if not config.cached_content or time_to_first_token is not None or is_overload_error(e):
+                        raise
+                    print(f"Context cache {config.cached_content} failed ({e}), retrying without it")
+                    self._drop_prefix_cache(config.cached_content)
+                    contents, config, _ = self._prepare_request(user_prompt, query, system_prompt, model=model,
+                                                                use_cache=False)
+                    for chunk in self.client.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    ):
+                        last_chunk = chunk
+                        grounded = grounded or self._is_grounded(chunk)
+                        if chunk.text:
+                            if time_to_first_token is None:
+                                time_to_first_token = time.perf_counter() - start
+                                metrics.llm_first_token.observe(time_to_first_token, model=model)
+                            yield chunk.text
+            status = 'ok'
+        except GeneratorExit:
+            # The client went away before the stream finished.
+            status = 'cancelled'
+            raise
+        finally:
+            metrics.llm_requests.inc(model=model, kind='stream', status=status)
+            metrics.llm_latency.observe(time.perf_counter() - start, model=model, kind='stream')
+        print(f"RAG stream complete: first token {time_to_first_token or 0:.3f}s, total {time.perf_counter() - start:.3f}s")
+        return last_chunk, grounded
+
+    def _extract_prompt(self, messages):
         # Extract the user prompt. 
         # If it's a list (as expected from main.py), take the last message content.
         if isinstance(messages, list):
-            user_prompt = messages[-1].get('content', '')
-        else:
-            user_prompt = str(messages)
+            return messages[-1].get('content', '')
+        return str(messages)
 
-        print(f"Calling RAG with file search store: {self.store.name}")
-        
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=user_prompt,
-            config=types.GenerateContentConfig(
-                tools=[
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=[self.store.name]
-                        )
+    def _extract_system(self, messages):
+        if not isinstance(messages, list):
+            return None
+        system = [m.get('content', '') for m in messages if m.get('role') == 'system']
+        return "\n\n".join(system) or None
+
+    def _record_usage(self, usage, response, model):
+        metadata = getattr(response, 'usage_metadata', None)
+        if metadata is None:
+            return
+        reported = {
+            'prompt_tokens': metadata.prompt_token_count or 0,
+            'cached_tokens': metadata.cached_content_token_count or 0,
+            'output_tokens': metadata.candidates_token_count or 0,
+            'total_tokens': metadata.total_token_count or 0,
+        }
+        print(f"RAG token usage: prompt {reported['prompt_tokens']} (cached {reported['cached_tokens']}), "
+              f"output {reported['output_tokens']}")
+        metrics.record_llm_usage(model, reported)
+        if usage is not None:
+            usage.update(reported)
+
+    def _prefix_cache(self, system_prompt, tools, model):
+        """
+        Returns the name of a context cache holding the system prompt (and tools), creating it
+        when missing or about to expire, or None if caching is disabled or unavailable.
+        """
+        if not GEMINI_CONTEXT_CACHE:
+            return None
+        key = hashlib.sha256(f"{model}\0{self.store}\0{system_prompt}".encode()).hexdigest()
+        with self._prefix_cache_lock:
+            entry = self._prefix_caches.get(key)
+            now = time.time()
+            if entry is not None and entry['expires_at'] > now:
+                return entry['name']
+            try:
+                cache = self.client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        display_name=f"{self.store_name}-prompt-{key[:12]}",
+                        system_instruction=system_prompt,
+                        tools=tools,
+                        ttl=f"{CONTEXT_CACHE_TTL}s",
                     )
-                ]
+                )
+                name = cache.name
+                print(f"Created context cache for the system prompt: {name}")
+            except Exception as e:
+                # Remember the failure for a TTL so every call does not retry the create.
+                print(f"Context caching unavailable, sending the system prompt inline: {e}")
+                name = None
+            self._prefix_caches[key] = {'name': name, 'expires_at': now + CONTEXT_CACHE_TTL - CONTEXT_CACHE_MARGIN}
+            return name
+
+    def _drop_prefix_cache(self, name):
+        with self._prefix_cache_lock:
+            for key, entry in list(self._prefix_caches.items()):
+                if entry['name'] == name:
+                    del self._prefix_caches[key]
+
+    def _build_config(self, system_prompt, tools, model, use_cache=True):
+        if system_prompt:
+            # Context caches belong to one model, so each tier has its own.
+            cache_name = self._prefix_cache(system_prompt, tools, model) if use_cache else None
+            if cache_name:
+                # Tools and the system instruction live in the cache and must not be repeated.
+                return types.GenerateContentConfig(cached_content=cache_name)
+        return types.GenerateContentConfig(system_instruction=system_prompt, tools=tools)
+
+    def _prepare_request(self, user_prompt, query=None, system_prompt=None, model=None, use_cache=True):
+        """
+        Returns the (contents, config) for generate_content, using either local retrieval
+        or the File Search tool, and the number of local passages found (None with File Search).
+        The system prompt goes first, as a context cache when possible.
+        """
+        model = model or self.model_name
+        if self.retriever is not None:
+            # Pick up edits to the knowledge base; only changed files are re-indexed.
+            if self.retriever.refresh():
+                self.knowledge_digest = self.retriever.version
+
+            passages = self.retriever.search(query or user_prompt, k=RAG_TOP_K)
+            print(f"Calling RAG with {len(passages)} local passages")
+            excerpts = "\n\n".join(f"[{i + 1}] {p['text']}" for i, p in enumerate(passages))
+            contents = (
+                "Company knowledge base excerpts (use these as the knowledge base):\n\n"
+                f"{excerpts}\n\n{user_prompt}"
             )
-        )
-        
-        print(f"RAG Response received: {response.text[:100] if response.text else 'No response'}")
-        return response.text
+            return contents, self._build_config(system_prompt, None, model, use_cache), len(passages)
+
+        print(f"Calling RAG with file search store: {self.store}")
+        tools = [
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[self.store]
+                )
+            )
+        ]
+        return user_prompt, self._build_config(system_prompt, tools, model, use_cache), None
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 nexa_file_path = os.path.join(current_dir, "nexa_learn.txt")
@@ -102,3 +527,15 @@ try:
 except Exception as e:
     print(f"Failed to initialize RAG Agent: {e}")
     rag_llm = None
+
+def _create_agent(account_id):
+    """Builds the agent of a registered account; its knowledge base loads in the background."""
+    account = account_registry.get(account_id)
+    if account is None:
+        raise LookupError(f"Unknown account: {account_id}")
+    agent = RAGAgent(file_path=account['knowledge_base'] or nexa_file_path, store_name=account['store_name'])
+    agent.start()
+    return agent
+
+# Agents of the other accounts are created on first use and dropped once idle.
+rag_agents = TenantPool(_create_agent)
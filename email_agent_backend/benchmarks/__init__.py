@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for the email agent backend.
+
+Run from the email_agent_backend directory, e.g.:
+    python -m benchmarks.bench_hydration
+"""
@@ -0,0 +1,312 @@
+"""
+End-to-end benchmark of the FastAPI app against an in-process fake Gmail and a fake LLM.
+
+Drives the real `main.app` through httpx's ASGI transport, with get_gmail_service replaced by
+a FakeGmailService holding a synthetic inbox of N threads x M messages and RAGAgent replaced
+by FakeLLM. Each scenario fires a number of requests at a fixed concurrency and reports
+throughput, p50/p95/p99 latency, the Gmail round trips and bytes and LLM calls it caused,
+and memory (peak RSS, plus the Python heap peak with --trace-memory).
+
+Scenarios:
+    fetch_cold  one GET /emails?refresh=true against an empty store (full sync)
+    fetch       GET /emails?refresh=true after one new message arrives (incremental sync)
+    summaries   GET /emails/stream?view=summary
+    read        GET /emails/{thread_id} with the listed historyId
+    generate    POST /generate_draft with a distinct thread per request
+    draft       POST /generate_drafts/batch with save=true (generate and create Gmail drafts)
+    send        POST /send_email, then the time for the send queue to deliver every job
+
+The batch draft and send rate limits are lifted unless BATCH_DRAFT_RATE_PER_MINUTE,
+SEND_RATE_PER_SECOND and SEND_RATE_BURST are set, so the numbers measure the service rather
+than the configured quotas.
+
+Results can be written as JSON and compared with a stored run; the comparison exits with
+status 1 when a latency, throughput or memory figure regresses by more than --tolerance:
+
+    python -m benchmarks.bench_e2e --output benchmarks/results/baseline.json
+    python -m benchmarks.bench_e2e --compare benchmarks/results/baseline.json
+
+Usage:
+    python -m benchmarks.bench_e2e [--threads 200] [--messages 3] [--requests 50] [--concurrency 8]
+        [--gmail-latency 0.02] [--llm-latency 0.5] [--scenarios fetch,read,...] [--trace-memory]
+        [--output results.json] [--compare baseline.json] [--tolerance 0.1]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Configuration read at import time by the modules under test.
+os.environ.setdefault("THREAD_CACHE_PATH", ":memory:")
+os.environ.setdefault("ACCOUNTS_DB_PATH", ":memory:")
+os.environ.setdefault("DRAFT_INDEX_PATH", ":memory:")
+os.environ.setdefault("SHARED_STATE_URL", "memory://")
+os.environ.setdefault("SEND_QUEUE_PATH", os.path.join(tempfile.mkdtemp(), "send_queue.db"))
+os.environ.setdefault("INGESTION_ENABLED", "false")
+os.environ.setdefault("BATCH_DRAFT_RATE_PER_MINUTE", "1000000")
+os.environ.setdefault("SEND_RATE_PER_SECOND", "1000000")
+os.environ.setdefault("SEND_RATE_BURST", "1000000")
+
+import httpx
+
+import main
+import draft_generator_tool
+import email_sender
+from inbox_sync import InboxSync
+from response_cache import ResponseCache
+from benchmarks.bench_load import percentile
+from benchmarks.fake_gmail import FakeGmailService
+from benchmarks.fake_llm import FakeLLM
+
+SCENARIOS = ('fetch_cold', 'fetch', 'summaries', 'read', 'generate', 'draft', 'send')
+# Figures compared against a baseline, and whether a higher value is better.
+COMPARED = (('throughput', True), ('p50_ms', False), ('p95_ms', False), ('p99_ms', False),
+            ('heap_peak_mb', False))
+
+
+def install_fakes(service, llm):
+    """Points every module that talks to Gmail or the LLM at the fakes."""
+    for module in (main, draft_generator_tool, email_sender):
+        module.get_gmail_service = lambda account_id=None: service
+    main.llm = llm
+    main.inbox_sync = InboxSync()
+    main.ingestion.inbox_sync = main.inbox_sync
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(latencies, errors, wall, extra):
+    result = {'requests': len(latencies) + errors, 'errors': errors, 'wall_seconds': round(wall, 4),
+              'throughput': round(len(latencies) / wall, 3) if wall else 0.0}
+    if latencies:
+        result.update({
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(max(latencies) * 1000, 3),
+        })
+    result.update(extra)
+    return result
+
+
+async def run_scenario(service, llm, request, count, concurrency, trace_memory):
+    """
+    Calls `request(i)` for i in range(count) with at most `concurrency` in flight and
+    summarizes the latencies together with the Gmail and LLM work they caused.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await request(i)
+                response.raise_for_status()
+            except Exception as e:
+                errors += 1
+                print(f"  request {i} failed: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    round_trips, bytes_returned, llm_calls = service.round_trips, service.bytes_returned, llm.calls
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    wall = time.perf_counter() - start
+
+    extra = {
+        'gmail_round_trips': service.round_trips - round_trips,
+        'gmail_bytes': service.bytes_returned - bytes_returned,
+        'llm_calls': llm.calls - llm_calls,
+        'rss_peak_mb': round(peak_rss_mb(), 1),
+    }
+    if trace_memory:
+        extra['heap_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    return summarize(latencies, errors, wall, extra)
+
+
+async def wait_for_send_queue(timeout=60):
+    """Waits until the send queue has no queued or in-progress jobs; returns the seconds waited."""
+    start = time.perf_counter()
+    while main.outbox.stats(recent=0)['depth'] and time.perf_counter() - start < timeout:
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - start
+
+
+async def run(args):
+    service = FakeGmailService.with_synthetic_inbox(
+        args.threads, messages_per_thread=args.messages, body_size=args.body_size, latency=args.gmail_latency)
+    llm = FakeLLM(latency=args.llm_latency)
+    install_fakes(service, llm)
+    if not args.cache:
+        # Synthetic threads share their wording, so near-duplicate matching would answer
+        # most drafts from the cache; disabling it makes every draft reach the (fake) LLM.
+        main.response_cache = ResponseCache(similarity_threshold=2.0)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    thread_ids = sorted(service.threads)
+    history_ids = {}
+    results = {}
+    selected = [name for name in SCENARIOS if name in args.scenarios.split(',')]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        def fetch(i):
+            service.add_message(thread_ids[i % len(thread_ids)], "Customer <c@example.com>",
+                                "Follow-up", f"Any update on my question? ({i})")
+            return client.get("/emails", params={"refresh": "true"})
+
+        def read(i):
+            thread_id = thread_ids[i % len(thread_ids)]
+            history_id = history_ids.get(thread_id)
+            return client.get(f"/emails/{thread_id}", params={"history_id": history_id} if history_id else None)
+
+        def generate(i):
+            return client.post("/generate_draft", json={
+                "thread_id": f"bench-{i}", "subject": f"Bench question {i}", "sender": "c@example.com",
+                "history": f"Hello, this is request {i}. Can I switch to the weekend batch?"})
+
+        def draft(i):
+            # Disjoint slices, so repeated batches do not hit the response cache.
+            start = i * args.batch_size
+            batch = [thread_ids[(start + k) % len(thread_ids)] for k in range(args.batch_size)]
+            return client.post("/generate_drafts/batch", json={"thread_ids": batch, "save": True, "stream": True})
+
+        def send(i):
+            return client.post("/send_email", json={
+                "thread_id": thread_ids[i % len(thread_ids)], "response": f"Thanks for your patience ({i})."})
+
+        requests = {
+            'fetch_cold': (lambda i: client.get("/emails", params={"refresh": "true"}), 1, 1),
+            'fetch': (fetch, args.requests, args.concurrency),
+            'summaries': (lambda i: client.get("/emails/stream", params={"view": "summary"}), args.requests, args.concurrency),
+            'read': (read, args.requests, args.concurrency),
+            'generate': (generate, args.requests, args.concurrency),
+            'draft': (draft, args.draft_batches, args.concurrency),
+            'send': (send, args.requests, args.concurrency),
+        }
+
+        if 'fetch_cold' not in selected:
+            # Later scenarios read from the store and the thread cache, so fill them first.
+            await client.get("/emails", params={"refresh": "true"})
+            history_ids = {t['thread_id']: t.get('history_id') for t in main.inbox_sync.snapshot()}
+        for name in selected:
+            request, count, concurrency = requests[name]
+            results[name] = await run_scenario(service, llm, request, count, concurrency, args.trace_memory)
+            if name == 'send':
+                drain = await wait_for_send_queue()
+                results[name]['queue_drain_seconds'] = round(drain, 4)
+                results[name]['delivered'] = len(service.sent)
+            if name in ('fetch_cold', 'fetch'):
+                history_ids = {t['thread_id']: t.get('history_id') for t in main.inbox_sync.snapshot()}
+
+    return {
+        'meta': {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {key: getattr(args, key) for key in (
+                'threads', 'messages', 'body_size', 'requests', 'concurrency', 'batch_size',
+                'draft_batches', 'gmail_latency', 'llm_latency', 'cache', 'trace_memory')},
+        },
+        'scenarios': results,
+        'memory': {'rss_peak_mb': round(peak_rss_mb(), 1)},
+    }
+
+
+def print_results(report):
+    print(f"{'scenario':>10} {'n':>5} {'err':>4} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'gmail rt':>9} {'gmail KB':>9} {'llm':>5} {'heap MB':>8}")
+    for name, r in report['scenarios'].items():
+        print(f"{name:>10} {r['requests']:>5} {r['errors']:>4} {r['throughput']:>9.2f} {r.get('p50_ms', 0):>9.1f} "
+              f"{r.get('p95_ms', 0):>9.1f} {r.get('p99_ms', 0):>9.1f} {r['gmail_round_trips']:>9} "
+              f"{r['gmail_bytes'] / 1024:>9.1f} {r['llm_calls']:>5} {r.get('heap_peak_mb', float('nan')):>8.2f}")
+        if 'queue_drain_seconds' in r:
+            print(f"{'':>10} send queue drained in {r['queue_drain_seconds']:.3f}s, {r['delivered']} delivered")
+    print(f"peak RSS: {report['memory']['rss_peak_mb']:.1f} MB")
+
+
+def compare(report, baseline, tolerance):
+    """Prints the change of each compared figure against the baseline; returns the regressions."""
+    if baseline['meta']['config'] != report['meta']['config']:
+        print("warning: the baseline was recorded with a different configuration:")
+        print(f"  baseline {baseline['meta']['config']}")
+        print(f"  current  {report['meta']['config']}")
+
+    regressions = []
+    print(f"\n{'scenario':>10} {'metric':>13} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in report['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            if metric not in current or not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, change))
+            print(f"{name:>10} {metric:>13} {previous[metric]:>10.2f} {current[metric]:>10.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=200, help="Threads in the synthetic inbox")
+    parser.add_argument('--messages', type=int, default=3, help="Messages per thread")
+    parser.add_argument('--body-size', type=int, default=400, help="Characters per message body")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=10, help="Threads per batch draft request")
+    parser.add_argument('--draft-batches', type=int, default=5, help="Batch draft requests")
+    parser.add_argument('--gmail-latency', type=float, default=0.02, help="Seconds per Gmail round trip")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds per LLM call")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS))
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache's near-duplicate matching enabled")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Track the Python heap peak per scenario (slows every allocation)")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare with results written by --output")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_results(report)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} figures regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,219 @@
+"""
+Benchmark of HTTP caching and compression: payload bytes and latency of the polled API
+routes and of the SPA, with and without compression and conditional requests.
+
+Drives the real `main.app` through httpx's ASGI transport against a FakeGmailService inbox
+(see bench_e2e) and a synthetic frontend build (an index.html and a 300 KB hashed bundle
+under /assets). Each route is requested the way a client without caching does (no
+Accept-Encoding, no validators: the behaviour before compression and ETags), with
+compression, and with compression plus If-None-Match from the previous response.
+
+Reported per route and mode: the HTTP status, bytes on the wire per response and p50/p95
+latency. Hashed assets are also listed with their Cache-Control; a browser holding them does
+not request them again at all.
+
+The NDJSON inbox stream the SPA reads (/emails/stream?view=summary) is driven through the
+ASGI interface directly, because httpx's ASGI transport only returns a body once it is
+complete; its rows report the time until the first line arrives next to the total time.
+It is measured hydrated from Gmail and served from the ingestion store (which also answers
+conditional requests).
+
+Usage:
+    python -m benchmarks.bench_http_cache [--threads 200] [--messages 3] [--body-size 400]
+        [--requests 50] [--gmail-latency 0.0]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+DIST_PATH = os.environ.setdefault("FRONTEND_DIST_PATH", tempfile.mkdtemp())
+os.environ.setdefault("DRAFT_INDEX_PATH", ":memory:")
+BUNDLE_KB = 300
+
+INDEX_HTML = """<!doctype html>
+<html lang="en">
+  <head>
+    <meta charset="UTF-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+    <title>Email Reply Agent</title>
+    <script type="module" crossorigin src="/assets/index-3f9a1c2b.js"></script>
+    <link rel="stylesheet" crossorigin href="/assets/index-8d41e7aa.css">
+  </head>
+  <body>
+    <div id="root"></div>
+  </body>
+</html>
+"""
+BUNDLE = "assets/index-3f9a1c2b.js"
+
+
+def write_frontend():
+    """Writes a synthetic Vite build into FRONTEND_DIST_PATH unless it already holds one."""
+    os.makedirs(os.path.join(DIST_PATH, "assets"), exist_ok=True)
+    index_path = os.path.join(DIST_PATH, "index.html")
+    if not os.path.exists(index_path):
+        with open(index_path, "w") as f:
+            f.write(INDEX_HTML)
+    bundle_path = os.path.join(DIST_PATH, BUNDLE)
+    if not os.path.exists(bundle_path):
+        line = "export function render(n){return document.createElement('div').appendChild(n)}\n"
+        with open(bundle_path, "w") as f:
+            f.write(line * (BUNDLE_KB * 1024 // len(line)))
+
+
+# The frontend build is read when main is imported, so it has to exist first.
+write_frontend()
+
+import httpx
+
+import main
+from benchmarks.bench_e2e import install_fakes
+from benchmarks.bench_load import percentile
+from benchmarks.fake_gmail import FakeGmailService
+from benchmarks.fake_llm import FakeLLM
+
+MODES = (
+    ('plain', {'Accept-Encoding': 'identity'}, False),
+    ('compressed', {}, False),
+    ('conditional', {}, True),
+)
+
+
+async def measure(client, path, params, headers, conditional, count):
+    """Requests `path` `count` times and summarizes statuses, wire bytes and latency."""
+    validator = {}
+    if conditional:
+        first = await client.get(path, params=params, headers=headers)
+        validator = {'If-None-Match': first.headers['etag']}
+    latencies = []
+    wire_bytes = 0
+    statuses = set()
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.get(path, params=params, headers={**headers, **validator})
+        latencies.append(time.perf_counter() - start)
+        wire_bytes += response.num_bytes_downloaded
+        statuses.add(response.status_code)
+    return {
+        'status': "/".join(str(s) for s in sorted(statuses)),
+        'bytes': wire_bytes // count,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'encoding': response.headers.get('content-encoding', '-'),
+    }
+
+
+async def stream(path, query, headers):
+    """
+    Requests an NDJSON stream from main.app and returns (status, encoding, bytes, seconds to
+    the first line, total seconds).
+    """
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+             'root_path': '', 'server': ('bench', 80), 'client': ('bench', 1234),
+             'headers': [(b'host', b'bench')] + [(k.lower().encode(), v.encode()) for k, v in headers.items()]}
+    result = {'status': None, 'encoding': '-', 'bytes': 0, 'first': None}
+    requested = False
+    done = asyncio.Event()
+    start = time.perf_counter()
+
+    async def receive():
+        # The request has no body; after it, the client stays connected until the response ends.
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            response_headers = dict(message['headers'])
+            result['encoding'] = response_headers.get(b'content-encoding', b'-').decode()
+            result['etag'] = response_headers.get(b'etag', b'').decode()
+        elif message.get('body'):
+            result['bytes'] += len(message['body'])
+            if result['first'] is None:
+                result['first'] = time.perf_counter() - start
+
+    await main.app(scope, receive, send)
+    result['total'] = time.perf_counter() - start
+    done.set()
+    return result
+
+
+async def measure_stream(path, query, headers, conditional, count):
+    """Requests a stream `count` times and summarizes it like measure()."""
+    validator = {}
+    if conditional:
+        validator = {'If-None-Match': (await stream(path, query, headers))['etag']}
+    runs = [await stream(path, query, {**headers, **validator}) for _ in range(count)]
+    firsts = [r['first'] for r in runs if r['first'] is not None]
+    return {
+        'status': "/".join(str(s) for s in sorted({r['status'] for r in runs})),
+        'bytes': sum(r['bytes'] for r in runs) // count,
+        'first_ms': percentile(firsts, 50) * 1000 if firsts else float('nan'),
+        'p50_ms': percentile([r['total'] for r in runs], 50) * 1000,
+        'encoding': runs[-1]['encoding'],
+    }
+
+
+async def run(args):
+    service = FakeGmailService.with_synthetic_inbox(
+        args.threads, messages_per_thread=args.messages, body_size=args.body_size, latency=args.gmail_latency)
+    install_fakes(service, FakeLLM(latency=0.0))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Full sync first, so every measured poll is an incremental sync of an unchanged inbox.
+        await client.get("/emails", params={"refresh": "true"})
+        thread = main.inbox_sync.snapshot()[0]
+        routes = [
+            ('/emails', "/emails", {"refresh": "true"}),
+            ('/emails/{id}', f"/emails/{thread['thread_id']}", {"history_id": thread['history_id']}),
+            ('index.html', "/", None),
+        ]
+
+        print(f"inbox: {args.threads} threads x {args.messages} messages, {args.requests} requests per row")
+        print(f"{'route':>14} {'mode':>12} {'status':>7} {'encoding':>9} {'bytes':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, path, params in routes:
+            for mode, headers, conditional in MODES:
+                r = await measure(client, path, params, headers, conditional, args.requests)
+                print(f"{name:>14} {mode:>12} {r['status']:>7} {r['encoding']:>9} {r['bytes']:>10} "
+                      f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+        print(f"\n{'stream':>14} {'mode':>12} {'status':>7} {'encoding':>9} {'bytes':>10} {'first ms':>8} {'p50 ms':>8}")
+        path, query = "/emails/stream", "view=summary"
+        for source in ('gmail', 'ingestion'):
+            if source == 'ingestion':
+                main.ingestion.start()
+                main.ingestion.wait_until_synced()
+            for mode, headers, conditional in MODES:
+                if conditional and source == 'gmail':
+                    continue  # a stream hydrated from Gmail carries no validator
+                r = await measure_stream(path, query, headers, conditional, args.requests)
+                print(f"{source:>14} {mode:>12} {r['status']:>7} {r['encoding']:>9} {r['bytes']:>10} "
+                      f"{r['first_ms']:>8.2f} {r['p50_ms']:>8.2f}")
+        main.ingestion.stop()
+
+        asset = await client.get(f"/{BUNDLE}")
+        print(f"\n/{BUNDLE}: {asset.status_code}, {asset.num_bytes_downloaded} bytes "
+              f"({asset.headers.get('content-encoding', 'identity')}), "
+              f"Cache-Control: {asset.headers.get('cache-control', '-')}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=200, help="Threads in the synthetic inbox")
+    parser.add_argument('--messages', type=int, default=3, help="Messages per thread")
+    parser.add_argument('--body-size', type=int, default=400, help="Characters per message body")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per route and mode")
+    parser.add_argument('--gmail-latency', type=float, default=0.0, help="Seconds per fake Gmail round trip")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,51 @@
+"""
+Benchmarks batched thread hydration (read_unread_threads) against the previous
+one-request-per-thread approach using the fake Gmail service.
+
+Usage:
+    python -m benchmarks.bench_hydration [--latency 0.05] [--counts 10,50,100,200,400]
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from benchmarks.fake_gmail import FakeGmailService
+from email_fetcher_tool import iter_unread_thread_pages, parse_thread, read_unread_threads
+
+
+def sequential_read(service):
+    """The original hydration strategy: one blocking threads().get per thread."""
+    data = []
+    for page in iter_unread_thread_pages(service):
+        for thread in page:
+            full_thread = service.users().threads().get(userId='me', id=thread['id']).execute()
+            data.append(parse_thread(thread['id'], full_thread))
+    return data
+
+
+def timed(fn, service):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = fn(service)
+    return time.perf_counter() - start, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per simulated round-trip")
+    parser.add_argument('--counts', default='10,50,100,200,400', help="Comma-separated thread counts")
+    parser.add_argument('--batch-size', type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"{'threads':>8} {'sequential (s)':>15} {'batched (s)':>12} {'speedup':>8}")
+    for count in (int(c) for c in args.counts.split(',')):
+        service = FakeGmailService.with_synthetic_inbox(count, latency=args.latency)
+        seq_time, seq_n = timed(sequential_read, service)
+        batch_time, batch_n = timed(lambda s: read_unread_threads(s, batch_size=args.batch_size), service)
+        assert seq_n == batch_n == count, (seq_n, batch_n)
+        print(f"{count:>8} {seq_time:>15.3f} {batch_time:>12.3f} {seq_time / batch_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark of the LLM scheduler and model tiering against a fake Gemini client.
+
+A real RAGAgent runs on top of FakeGenaiClient, whose quota rejects calls (429) beyond a
+fixed number at once. A burst of bulk draft calls is submitted, followed shortly by
+interactive ones; a share of the inquiries is short and simple and may use the fast tier,
+whose answers are not always grounded and then escalate to the main model.
+
+Reported per priority: calls, failures, p50/p95 latency; plus the scheduler's final limit,
+mean queue wait by priority and retries, the model tier split and escalations, and the
+calls, rejections and peak concurrency seen by the fake client.
+
+Compare with a fixed concurrency and no retries (the behaviour without the scheduler):
+
+    python -m benchmarks.bench_llm_scheduler
+    python -m benchmarks.bench_llm_scheduler --fixed 16
+
+Usage:
+    python -m benchmarks.bench_llm_scheduler [--interactive 40] [--bulk 120] [--quota 8]
+        [--strong-latency 0.4] [--fast-latency 0.1] [--fast-grounded 0.8] [--simple-share 0.6]
+        [--error-rate 0.0] [--quota-error-rate 0.0] [--fixed N]
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("SHARED_STATE_URL", "memory://")
+os.environ.setdefault("ACCOUNTS_DB_PATH", ":memory:")
+
+from agent import RAGAgent, nexa_file_path
+from llm_scheduler import BULK, INTERACTIVE, PRIORITY_NAMES, LLMScheduler, ModelRouter
+from benchmarks.fake_llm import FakeFileSearchBackend, FakeGenaiClient
+
+STRONG_MODEL = "strong-model"
+FAST_MODEL = "fast-model"
+
+SIMPLE_INQUIRY = "When does the weekend batch start?"
+COMPLEX_INQUIRY = ("I was charged twice for the placement program and I would like a refund for the duplicate "
+                   "payment. " + "I have attached the receipts and my enrollment details below. " * 20)
+
+
+def inquiry(i, simple_share):
+    # Deterministic mix: the first `simple_share` of every ten requests are simple.
+    return SIMPLE_INQUIRY if (i % 10) < simple_share * 10 else COMPLEX_INQUIRY
+
+
+def run(args):
+    client = FakeGenaiClient(
+        latency={STRONG_MODEL: args.strong_latency, FAST_MODEL: args.fast_latency},
+        error_rate=args.error_rate, quota_error_rate=args.quota_error_rate, quota_concurrency=args.quota,
+        grounded_rate={STRONG_MODEL: 1.0, FAST_MODEL: args.fast_grounded})
+    if args.fixed:
+        scheduler = LLMScheduler(max_concurrency=args.fixed, min_concurrency=args.fixed,
+                                 initial_concurrency=args.fixed, max_retries=0)
+    else:
+        scheduler = LLMScheduler(max_concurrency=args.max_concurrency, initial_concurrency=args.initial_concurrency,
+                                 backoff_base=args.backoff)
+    agent = RAGAgent(file_path=nexa_file_path, model_name=STRONG_MODEL, backend=FakeFileSearchBackend(),
+                     background=False, retrieval="file_search", client=client, scheduler=scheduler,
+                     router=ModelRouter(STRONG_MODEL, FAST_MODEL))
+
+    results = []
+    lock = threading.Lock()
+
+    def call(i, priority):
+        text = inquiry(i, args.simple_share)
+        messages = [{"role": "system", "content": "Answer from the knowledge base."}, {"role": "user", "content": text}]
+        usage = {}
+        start = time.perf_counter()
+        try:
+            agent.call(messages, query=text, usage=usage, priority=priority)
+            status = 'ok'
+        except Exception:
+            status = 'error'
+        with lock:
+            results.append({'priority': priority, 'status': status, 'latency': time.perf_counter() - start,
+                            'tier': usage.get('tier'), 'escalated': usage.get('escalated', False)})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.bulk + args.interactive) as pool:
+        for i in range(args.bulk):
+            pool.submit(call, i, BULK)
+        time.sleep(args.interactive_delay)
+        for i in range(args.interactive):
+            pool.submit(call, i, INTERACTIVE)
+    wall = time.perf_counter() - start
+
+    mode = f"fixed concurrency {args.fixed}, no retries" if args.fixed else "adaptive scheduler"
+    print(f"mode: {mode}, quota {args.quota} concurrent calls, wall time {wall:.2f}s")
+    print(f"{'priority':>12} {'n':>5} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for priority in (INTERACTIVE, BULK):
+        group = [r for r in results if r['priority'] == priority]
+        ok = [r['latency'] for r in group if r['status'] == 'ok']
+        errors = len(group) - len(ok)
+        p50 = statistics.median(ok) * 1000 if ok else float('nan')
+        p95 = (statistics.quantiles(ok, n=20)[-1] if len(ok) > 1 else ok[0]) * 1000 if ok else float('nan')
+        print(f"{PRIORITY_NAMES[priority]:>12} {len(group):>5} {errors:>7} {p50:>9.1f} {p95:>9.1f}")
+
+    stats = scheduler.stats()
+    waits = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in stats['mean_queue_wait'].items())
+    print(f"scheduler: final limit {stats['limit']}, {stats['decreases']} decreases, {stats['retried']} retries; "
+          f"mean queue wait: {waits}")
+    ok = [r for r in results if r['status'] == 'ok']
+    fast = sum(1 for r in ok if r['tier'] == 'fast')
+    escalated = sum(1 for r in ok if r['escalated'])
+    print(f"tiers: {fast} answered by the fast tier, {len(ok) - fast} by the main model ({escalated} escalated)")
+    print(f"client: calls {client.calls}, {client.rejected} rejected (429), {client.failed} failed, "
+          f"peak concurrency {client.peak_active}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interactive', type=int, default=40)
+    parser.add_argument('--bulk', type=int, default=120)
+    parser.add_argument('--interactive-delay', type=float, default=0.2,
+                        help="Seconds between submitting the bulk burst and the interactive calls")
+    parser.add_argument('--quota', type=int, default=8, help="Concurrent calls the fake API accepts")
+    parser.add_argument('--strong-latency', type=float, default=0.4)
+    parser.add_argument('--fast-latency', type=float, default=0.1)
+    parser.add_argument('--fast-grounded', type=float, default=0.8, help="Share of grounded fast-tier answers")
+    parser.add_argument('--simple-share', type=float, default=0.6)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--quota-error-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int, default=32)
+    parser.add_argument('--initial-concurrency', type=int, default=4)
+    parser.add_argument('--backoff', type=float, default=0.1, help="Retry backoff base in seconds")
+    parser.add_argument('--fixed', type=int, help="Use a fixed concurrency without retries instead")
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main_cli()
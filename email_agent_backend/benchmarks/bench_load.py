@@ -0,0 +1,91 @@
+"""
+Load test for the FastAPI app with a stubbed Gmail service and a stubbed LLM.
+
+Fires concurrent /generate_draft requests alongside /emails polls and reports p50/p99
+latency for each endpoint. Pass --inline to reproduce the previous behaviour, where
+blocking work ran directly on the event loop.
+
+Usage:
+    python -m benchmarks.bench_load [--drafts 32] [--polls 32] [--llm-latency 0.5] [--inline]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("THREAD_CACHE_PATH", ":memory:")
+os.environ.setdefault("ACCOUNTS_DB_PATH", ":memory:")
+os.environ.setdefault("DRAFT_INDEX_PATH", ":memory:")
+os.environ.setdefault("SHARED_STATE_URL", "memory://")
+
+import httpx
+
+import main
+from response_cache import ResponseCache
+from benchmarks.fake_gmail import FakeGmailService
+from benchmarks.fake_llm import FakeLLM
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def timed_request(client, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(args):
+    service = FakeGmailService.with_synthetic_inbox(args.threads, latency=args.gmail_latency)
+    main.get_gmail_service = lambda account_id=None: service
+    main.llm = FakeLLM(latency=args.llm_latency)
+    if not args.cache:
+        # Every request has a distinct prompt, and near-duplicate matching is disabled,
+        # so each draft reaches the (fake) LLM.
+        main.response_cache = ResponseCache(similarity_threshold=2.0)
+
+    if args.inline:
+        async def run_inline(endpoint, fn, *fn_args, **fn_kwargs):
+            return fn(*fn_args, **fn_kwargs)
+        main.run_blocking = run_inline
+
+    def email(i):
+        return {"thread_id": f"t{i:05d}", "subject": f"Question {i}", "sender": "c@example.com", "history": "Hello"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm the inbox store so /emails measures the steady-state path.
+        await client.get("/emails")
+
+        draft_tasks = [timed_request(client, "POST", "/generate_draft", json=email(i)) for i in range(args.drafts)]
+        poll_tasks = [timed_request(client, "GET", "/emails") for _ in range(args.polls)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*draft_tasks, *poll_tasks)
+        wall = time.perf_counter() - start
+
+    drafts, polls = results[:args.drafts], results[args.drafts:]
+    mode = "inline (blocking event loop)" if args.inline else "executor"
+    print(f"mode: {mode}, wall time {wall:.2f}s")
+    for name, samples in (("/generate_draft", drafts), ("/emails", polls)):
+        print(f"{name:>16}: p50 {statistics.median(samples) * 1000:8.1f} ms   "
+              f"p99 {percentile(samples, 99) * 1000:8.1f} ms   n={len(samples)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--drafts', type=int, default=32)
+    parser.add_argument('--polls', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--gmail-latency', type=float, default=0.02)
+    parser.add_argument('--inline', action='store_true', help="Run blocking work on the event loop (old behaviour)")
+    parser.add_argument('--cache', action='store_true', help="Keep the response cache's near-duplicate matching enabled")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,93 @@
+"""
+Throughput benchmark for message body extraction.
+
+The corpus of real-world MIME shapes (nested multiparts, HTML-only mail, attachments,
+Gmail / Outlook / Apple Mail quoting, signatures) lives in tests/test_mime_parser.py, which
+checks the expected output. Here the extractor is timed against the previous single-level
+implementation, over the whole corpus and over the plain-text messages only: the previous
+implementation returned nothing for HTML-only mail and kept quoted headers, so it does less
+work on the rest.
+
+Usage:
+    python -m benchmarks.bench_mime [--repeat 2000]
+"""
+import argparse
+import base64
+import time
+
+from mime_parser import extract_body, find_text_part, BodyMemo
+from tests.test_mime_parser import CORPUS
+
+
+def legacy_get_message_body(message_part):
+    """The previous implementation: one level of parts, text/plain only."""
+    body = None
+    if 'body' in message_part and 'data' in message_part['body']:
+        body = base64.urlsafe_b64decode(message_part['body']['data']).decode('utf-8')
+    if body is None and 'parts' in message_part:
+        for p in message_part['parts']:
+            if p['mimeType'] == 'text/plain':
+                body = base64.urlsafe_b64decode(p['body']['data']).decode('utf-8')
+                break
+    if body is None:
+        return None
+    cleaned_lines = []
+    skip_next_blank = False
+    for line in body.split('\n'):
+        trimmed = line.strip()
+        if trimmed.startswith('On ') and trimmed.endswith('wrote:'):
+            skip_next_blank = True
+            continue
+        if skip_next_blank and trimmed == '':
+            skip_next_blank = False
+            continue
+        skip_next_blank = False
+        if not trimmed.startswith('>'):
+            cleaned_lines.append(line)
+    return '\n'.join(cleaned_lines).strip()
+
+
+def bench(fn, payloads, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            try:
+                fn(payload)
+            except Exception:
+                pass
+    return (time.perf_counter() - start) / (repeat * len(payloads)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = [payload for _, payload, _ in CORPUS]
+    plain = [payload for payload in payloads if (find_text_part(payload) or ('',))[0] == 'text/plain']
+    legacy_us = bench(legacy_get_message_body, payloads, args.repeat)
+    new_us = bench(extract_body, payloads, args.repeat)
+    legacy_plain_us = bench(legacy_get_message_body, plain, args.repeat)
+    new_plain_us = bench(extract_body, plain, args.repeat)
+
+    memo = BodyMemo()
+    ids = [f"m{i}" for i in range(len(payloads))]
+
+    def memoized(index):
+        body = memo.get(ids[index])
+        if body is BodyMemo.MISSING:
+            body = extract_body(payloads[index])
+            memo.put(ids[index], body)
+        return body
+
+    memo_us = bench(memoized, list(range(len(payloads))), args.repeat)
+
+    print(f"Throughput (mean per message, {len(payloads)} messages, {len(plain)} of them plain text):")
+    print(f"  {'':<26} {'all':>8} {'plain':>8}")
+    print(f"  {'previous implementation':<26} {legacy_us:8.2f} {legacy_plain_us:8.2f} us")
+    print(f"  {'recursive walker':<26} {new_us:8.2f} {new_plain_us:8.2f} us")
+    print(f"  {'walker, memoized by id':<26} {memo_us:8.2f} {'':>8} us")
+
+
+if __name__ == '__main__':
+    main()
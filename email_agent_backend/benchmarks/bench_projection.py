@@ -0,0 +1,85 @@
+"""
+Measures bytes transferred and time per thread for the threads().get projections used by
+the inbox list, thread hydration and the draft path, against the previous full/unfiltered
+requests, using the fake Gmail service.
+
+The fake renders format=full like Gmail (transport headers, multipart/alternative parts),
+applies fields= masks, JSON-encodes every response and can throttle to a given bandwidth,
+so the time column covers transfer plus decoding.
+
+Usage:
+    python -m benchmarks.bench_projection [--threads 200] [--messages 3] [--bandwidth 2000000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault("THREAD_CACHE_PATH", ":memory:")
+
+from benchmarks.fake_gmail import FakeGmailService
+from email_fetcher_tool import (
+    THREAD_BODY_PROJECTION, THREAD_HEADERS_PROJECTION, THREAD_LABELS_PROJECTION, THREAD_SUMMARY_PROJECTION,
+    batch_get_threads, get_message_body, parse_thread_summary,
+)
+
+
+def parse_bodies(thread_id, thread):
+    # Decode every body without the memo so each variant pays the full parsing cost.
+    return [get_message_body(message['payload']) for message in thread['messages']]
+
+
+# (group, label, threads().get arguments, parser applied to each response)
+VARIANTS = [
+    ('inbox list', 'full threads (before)', {'format': 'full'}, parse_bodies),
+    ('inbox list', 'summary projection', THREAD_SUMMARY_PROJECTION, parse_thread_summary),
+    ('hydration', 'format=full (before)', {'format': 'full'}, parse_bodies),
+    ('hydration', 'format=full + fields', THREAD_BODY_PROJECTION, parse_bodies),
+    ('draft headers', 'metadata (before)', {'format': 'metadata', 'metadataHeaders': ['From', 'Subject']}, None),
+    ('draft headers', 'metadata + fields', THREAD_HEADERS_PROJECTION, None),
+    ('draft labels', 'minimal (before)', {'format': 'minimal'}, None),
+    ('draft labels', 'minimal + fields', THREAD_LABELS_PROJECTION, None),
+]
+
+
+def measure(args, get_kwargs, parse):
+    service = FakeGmailService.with_synthetic_inbox(
+        args.threads, messages_per_thread=args.messages, body_size=args.body_size,
+        latency=args.latency, bandwidth=args.bandwidth)
+    thread_ids = list(service.threads)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads_by_id = batch_get_threads(service, thread_ids, **get_kwargs)
+        if parse is not None:
+            for thread_id, thread in threads_by_id.items():
+                parse(thread_id, thread)
+    elapsed = time.perf_counter() - start
+
+    assert len(threads_by_id) == args.threads, len(threads_by_id)
+    return service.bytes_returned / args.threads, elapsed / args.threads * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=3, help="Messages per thread")
+    parser.add_argument('--body-size', type=int, default=400, help="Characters per message body")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per simulated round-trip")
+    parser.add_argument('--bandwidth', type=float, default=2_000_000, help="Simulated bytes per second (0 = unlimited)")
+    args = parser.parse_args()
+    args.bandwidth = args.bandwidth or None
+
+    print(f"{args.threads} threads x {args.messages} messages, {args.body_size} chars per body")
+    print(f"{'view':<14} {'request':<24} {'bytes/thread':>13} {'ms/thread':>10} {'bytes saved':>12}")
+    baseline = {}
+    for group, label, get_kwargs, parse in VARIANTS:
+        size, ms = measure(args, get_kwargs, parse)
+        saved = f"{1 - size / baseline[group]:.0%}" if group in baseline else '-'
+        baseline.setdefault(group, size)
+        print(f"{group:<14} {label:<24} {size:>13,.0f} {ms:>10.3f} {saved:>12}")
+
+
+if __name__ == '__main__':
+    main()
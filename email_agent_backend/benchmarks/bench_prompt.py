@@ -0,0 +1,55 @@
+"""
+Compares the estimated size of the previous unbounded draft prompt with the token-budgeted
+prompt for synthetic threads of growing length, where every reply quotes the message before it.
+
+Usage:
+    python -m benchmarks.bench_prompt [--budget 8000] [--lengths 2,5,10,20,40]
+"""
+import argparse
+import time
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+INSTRUCTION = "You are a professional customer service agent. " * 40
+QUESTION = ("I enrolled in the data science track last month and I would like to know whether the "
+            "placement support includes mock interviews, how long resume reviews take, and whether "
+            "I can switch to the weekend batch without losing my progress. ")
+
+
+def synthetic_history(length):
+    messages = []
+    for i in range(length):
+        body = f"Message {i}: " + QUESTION * 3
+        if messages:
+            # Clients that do not mark quotes leave the previous message inline.
+            body += "\n\n" + messages[-1].split("\n\n")[0]
+        messages.append(body)
+    return "\n---\n".join(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--budget', type=int, default=8000)
+    parser.add_argument('--lengths', default='2,5,10,20,40,80', help="Comma-separated messages per thread")
+    args = parser.parse_args()
+
+    builder = PromptBuilder(INSTRUCTION, budget=args.budget)
+    print(f"{'messages':>8} {'unbounded':>10} {'budgeted':>9} {'verbatim':>9} {'trimmed':>8} "
+          f"{'omitted':>8} {'dupes':>6} {'build (ms)':>11}")
+    for length in (int(n) for n in args.lengths.split(',')):
+        history = synthetic_history(length)
+        unbounded = estimate_tokens(INSTRUCTION) + estimate_tokens(history)
+
+        start = time.perf_counter()
+        prompt = builder.build("Question about placement support", "Customer <c@example.com>", history)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        usage = prompt['usage']
+        assert usage['estimated_prompt_tokens'] <= args.budget, usage
+        print(f"{length:>8} {unbounded:>10,} {usage['estimated_prompt_tokens']:>9,} {usage['verbatim_messages']:>9} "
+              f"{usage['trimmed_messages']:>8} {usage['omitted_messages']:>8} {usage['duplicate_paragraphs']:>6} "
+              f"{elapsed:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Retrieval latency benchmark for the local BM25 backend.
+
+Measures index build time, no-op refresh time, incremental re-index time after one
+file changes, and per-query latency, optionally over a corpus scaled up by copying
+the knowledge base file.
+
+Usage:
+    python -m benchmarks.bench_retrieval [--copies 1] [--queries 500]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from retrieval import LocalRetriever
+
+QUERIES = [
+    "Do you help with resume reviews and mock interviews?",
+    "What is the refund policy if I change my mind?",
+    "Can I pay the course fee in installments?",
+    "Is there placement support after the course?",
+    "Do I get a certificate when I finish?",
+    "Are the classes live or self-paced?",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--copies', type=int, default=1, help="Number of copies of the knowledge base to index")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=4)
+    args = parser.parse_args()
+
+    source = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nexa_learn.txt")
+    workdir = tempfile.mkdtemp()
+    paths = []
+    for i in range(args.copies):
+        path = os.path.join(workdir, f"kb_{i}.txt")
+        shutil.copy(source, path)
+        paths.append(path)
+
+    start = time.perf_counter()
+    retriever = LocalRetriever(paths)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    retriever.refresh()
+    noop_ms = (time.perf_counter() - start) * 1000
+
+    with open(paths[0], 'a', encoding='utf-8') as f:
+        f.write("\n\nQuestion: Is there a student discount?\nAnswer: Yes, 10% for enrolled university students.\n")
+    start = time.perf_counter()
+    changed = retriever.refresh()
+    reindex_ms = (time.perf_counter() - start) * 1000
+    assert changed == [paths[0]], changed
+
+    latencies = []
+    for i in range(args.queries):
+        start = time.perf_counter()
+        retriever.search(QUERIES[i % len(QUERIES)], k=args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    print(f"files: {len(paths)}, passages: {len(retriever.passages)}")
+    print(f"index build:         {build_ms:8.2f} ms")
+    print(f"refresh (no change): {noop_ms:8.3f} ms")
+    print(f"refresh (1 changed): {reindex_ms:8.2f} ms")
+    print(f"query p50:           {statistics.median(latencies):8.3f} ms")
+    print(f"query p99:           {latencies[int(len(latencies) * 0.99) - 1]:8.3f} ms")
+    shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Microbenchmark for get_gmail_service: compares the previous per-call behaviour
+(parse token.json and build the service every time) with the cached service factory.
+
+Uses a throwaway token file holding a non-expired access token, so no network or
+OAuth flow is involved.
+
+Usage:
+    python -m benchmarks.bench_service [--iterations 200]
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+
+def write_fake_token(path):
+    expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    with open(path, "w") as token:
+        json.dump({
+            "token": "fake-access-token",
+            "refresh_token": "fake-refresh-token",
+            "client_id": "fake-client-id.apps.googleusercontent.com",
+            "client_secret": "fake-secret",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }, token)
+
+
+def per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    token_path = os.path.join(tempfile.mkdtemp(), "token.json")
+    write_fake_token(token_path)
+    os.environ["GMAIL_TOKEN_PATH"] = token_path
+
+    # Imported after GMAIL_TOKEN_PATH is set so the module picks it up.
+    import email_fetcher_tool
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+    def legacy_get_service():
+        creds = Credentials.from_authorized_user_file(token_path, email_fetcher_tool.SCOPES)
+        return build("gmail", "v1", credentials=creds)
+
+    def cold_get_service():
+        email_fetcher_tool.reset_gmail_service()
+        return email_fetcher_tool.get_gmail_service()
+
+    legacy_ms = per_call(legacy_get_service, args.iterations)
+    cold_ms = per_call(cold_get_service, max(1, args.iterations // 10))
+    email_fetcher_tool.get_gmail_service()
+    warm_ms = per_call(email_fetcher_tool.get_gmail_service, args.iterations * 100)
+
+    print(f"legacy (parse token + build each call): {legacy_ms:9.3f} ms/call")
+    print(f"cached factory, cold start:             {cold_ms:9.3f} ms/call")
+    print(f"cached factory, warm:                   {warm_ms:9.4f} ms/call")
+    print(f"warm speedup vs legacy:                 {legacy_ms / warm_ms:9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,451 @@
+"""
+An in-process fake of the subset of the Gmail API used by the backend.
+
+The fake mimics the googleapiclient call chain (service.users().threads().get(...).execute())
+and batch requests (service.new_batch_http_request), with injectable per-call latency so
+benchmarks can measure round-trip savings without touching the network.
+"""
+import base64
+import json
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def _http_error(status, reason):
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    return HttpError(resp, reason.encode(), uri='fake://gmail')
+
+
+def _encode(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+
+
+def _transport_headers(message_id, sender):
+    # The headers a typical delivered message carries; format=full returns all of them.
+    domain = sender.rsplit('@', 1)[-1].rstrip('>')
+    return [
+        {'name': 'Delivered-To', 'value': 'support@example.com'},
+        {'name': 'Received', 'value': f"by 2002:a05:6a10:8e0c:b0:4e3:1b2c with SMTP id {message_id}; Mon, 6 Oct 2025 09:14:02 -0700 (PDT)"},
+        {'name': 'Received', 'value': f"from mail-sor-f41.{domain} (mail-sor-f41.{domain}. [209.85.220.41]) by mx.google.com with SMTPS id {message_id} for <support@example.com>; Mon, 6 Oct 2025 09:14:02 -0700 (PDT)"},
+        {'name': 'ARC-Seal', 'value': "i=1; a=rsa-sha256; t=1759767242; cv=none; d=google.com; s=arc-20240605; " + "b=" + "Xk3v9Qm2LrT8pW4z" * 16},
+        {'name': 'ARC-Message-Signature', 'value': "i=1; a=rsa-sha256; c=relaxed/relaxed; d=google.com; s=arc-20240605; h=to:subject:message-id:date:from:mime-version:dkim-signature; " + "bh=" + "q9Rt2Lm8Zx4Vb7Nc" * 3 + "; b=" + "Hy6Tg1Pk0Ws5Ej3D" * 16},
+        {'name': 'ARC-Authentication-Results', 'value': f"i=1; mx.google.com; dkim=pass header.i=@{domain}; spf=pass smtp.mailfrom={domain}; dmarc=pass (p=NONE sp=QUARANTINE dis=NONE) header.from={domain}"},
+        {'name': 'Return-Path', 'value': sender.split('<')[-1].rstrip('>')},
+        {'name': 'Received-SPF', 'value': f"pass (google.com: domain of {domain} designates 209.85.220.41 as permitted sender) client-ip=209.85.220.41;"},
+        {'name': 'Authentication-Results', 'value': f"mx.google.com; dkim=pass header.i=@{domain} header.s=20230601; spf=pass smtp.mailfrom={domain}; dmarc=pass header.from={domain}"},
+        {'name': 'DKIM-Signature', 'value': f"v=1; a=rsa-sha256; c=relaxed/relaxed; d={domain}; s=20230601; t=1759767242; x=1760372042; h=to:subject:message-id:date:from:mime-version:from:to:cc:subject:date:message-id:reply-to; " + "bh=" + "Zp5Qw8Er2Ty6Ui0O" * 3 + "; b=" + "Ka9Sd4Fg7Hj1Kl3Z" * 16},
+        {'name': 'X-Google-Smtp-Source', 'value': "AGHT+IF" + "x7Yc2Vb9Nm4Lk1Jh" * 5},
+        {'name': 'X-Received', 'value': f"by 2002:a17:907:3f8a:b0:b3d:5a1e with SMTP id {message_id}; Mon, 6 Oct 2025 09:14:02 -0700 (PDT)"},
+        {'name': 'MIME-Version', 'value': '1.0'},
+        {'name': 'Date', 'value': 'Mon, 6 Oct 2025 21:13:51 +0500'},
+        {'name': 'Message-ID', 'value': f"<CAF{message_id}@mail.{domain}>"},
+        {'name': 'To', 'value': 'support@example.com'},
+        {'name': 'Content-Type', 'value': 'multipart/alternative; boundary="000000000000a1b2c3d4e5f6"'},
+    ]
+
+
+def make_message(thread_id, index, sender, subject, body, labels=('INBOX', 'UNREAD'), history_id=1):
+    """
+    Builds a Gmail message resource shaped like a format=full response: transport headers
+    and a multipart/alternative payload with text/plain and text/html parts.
+    """
+    message_id = f"{thread_id}-m{index}"
+    markup = "<div dir=\"ltr\">" + body.replace("\n", "<br>") + "</div>"
+    return {
+        'id': message_id,
+        'threadId': thread_id,
+        'labelIds': list(labels),
+        'historyId': str(history_id),
+        'snippet': body[:100],
+        'sizeEstimate': 4096 + 2 * len(body),
+        'internalDate': '1759767231000',
+        'payload': {
+            'partId': '',
+            'mimeType': 'multipart/alternative',
+            'filename': '',
+            'headers': _transport_headers(message_id, sender) + [
+                {'name': 'From', 'value': sender},
+                {'name': 'Subject', 'value': subject},
+            ],
+            'body': {'size': 0},
+            'parts': [
+                {'partId': '0', 'mimeType': 'text/plain', 'filename': '',
+                 'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'},
+                             {'name': 'Content-Transfer-Encoding', 'value': 'quoted-printable'}],
+                 'body': {'size': len(body), 'data': _encode(body)}},
+                {'partId': '1', 'mimeType': 'text/html', 'filename': '',
+                 'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'},
+                             {'name': 'Content-Transfer-Encoding', 'value': 'quoted-printable'}],
+                 'body': {'size': len(markup), 'data': _encode(markup)}},
+            ],
+        },
+    }
+
+
+def _parse_fields(spec, i=0, nested=False):
+    """
+    Parses a partial-response mask ("a,b/c,d(e,f)") into a dict tree; None selects a whole value.
+    """
+    mask = {}
+    while i < len(spec):
+        start = i
+        while i < len(spec) and spec[i] not in ',()/':
+            i += 1
+        name = spec[start:i].strip()
+        sub = None
+        if i < len(spec) and spec[i] == '/':
+            sub, i = _parse_fields(spec, i + 1, nested=None)
+        elif i < len(spec) and spec[i] == '(':
+            sub, i = _parse_fields(spec, i + 1, nested=True)
+            i += 1  # closing parenthesis
+        mask[name] = _merge_fields(mask[name], sub) if name in mask else sub
+        if nested is None:
+            # A path segment ("a/b") selects exactly one field.
+            return mask, i
+        if i < len(spec) and spec[i] == ',':
+            i += 1
+        elif nested and i < len(spec) and spec[i] == ')':
+            return mask, i
+    return mask, i
+
+
+def _merge_fields(left, right):
+    if left is None or right is None:
+        return None
+    merged = dict(left)
+    for name, sub in right.items():
+        merged[name] = _merge_fields(merged[name], sub) if name in merged else sub
+    return merged
+
+
+def apply_fields(value, mask):
+    """Trims a response to a parsed fields mask, applying it to every element of lists."""
+    if mask is None:
+        return value
+    if isinstance(value, list):
+        return [apply_fields(item, mask) for item in value]
+    if isinstance(value, dict):
+        return {name: apply_fields(value[name], sub) for name, sub in mask.items() if name in value}
+    return value
+
+
+class FakeRequest:
+    """A deferred fake API call, executed on .execute() or as part of a batch."""
+
+    def __init__(self, service, method_id, fn, fields=None):
+        self.service = service
+        self.methodId = method_id
+        self._fn = fn
+        self._fields = fields
+
+    def run(self):
+        return self.service.respond(self._fn(), self._fields)
+
+    def execute(self, num_retries=0):
+        self.service._round_trip(self.methodId)
+        return self.run()
+
+
+class FakeBatch:
+    """Mimics googleapiclient.http.BatchHttpRequest: one round-trip for many sub-requests."""
+
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self._requests) >= 1000:
+            raise ValueError("Exceeded the maximum calls in a single batch request.")
+        request_id = request_id if request_id is not None else str(len(self._requests))
+        self._requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        self.service._round_trip('batch', sub_requests=len(self._requests))
+        for request_id, request, callback in self._requests:
+            self.service.calls[request.methodId] = self.service.calls.get(request.methodId, 0) + 1
+            try:
+                response, exception = request.run(), None
+            except HttpError as error:
+                response, exception = None, error
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Threads:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, q=None, maxResults=100, pageToken=None, fields=None, **kwargs):
+        def run():
+            ids = self.service.matching_thread_ids()
+            start = int(pageToken or 0)
+            page = ids[start:start + maxResults]
+            result = {'threads': [{'id': tid, 'historyId': self.service.thread_history_id(tid),
+                                   'snippet': self.service.threads[tid]['messages'][-1]['snippet']}
+                                  for tid in page],
+                      'resultSizeEstimate': len(ids)}
+            if start + maxResults < len(ids):
+                result['nextPageToken'] = str(start + maxResults)
+            return result
+        return FakeRequest(self.service, 'gmail.users.threads.list', run, fields=fields)
+
+    def get(self, userId, id, fields=None, **kwargs):
+        def run():
+            self.service.maybe_fail()
+            if id not in self.service.threads:
+                raise _http_error(404, 'Not Found')
+            return self.service.render_thread(id, **kwargs)
+        return FakeRequest(self.service, 'gmail.users.threads.get', run, fields=fields)
+
+    def modify(self, userId, id, body):
+        def run():
+            for message in self.service.threads[id]['messages']:
+                self.service.apply_labels(message, body)
+            return {'id': id}
+        return FakeRequest(self.service, 'gmail.users.threads.modify', run)
+
+
+class _Messages:
+    def __init__(self, service):
+        self.service = service
+
+    def send(self, userId, body):
+        def run():
+            self.service.sent.append(body)
+            return {'id': f"sent-{len(self.service.sent)}", 'threadId': body.get('threadId')}
+        return FakeRequest(self.service, 'gmail.users.messages.send', run)
+
+    def batchModify(self, userId, body):
+        def run():
+            ids = set(body['ids'])
+            if len(ids) > 1000:
+                raise _http_error(400, 'Too many ids')
+            for thread in self.service.threads.values():
+                for message in thread['messages']:
+                    if message['id'] in ids:
+                        self.service.apply_labels(message, body)
+            return ''
+        return FakeRequest(self.service, 'gmail.users.messages.batchModify', run)
+
+
+class _Drafts:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, userId, body):
+        def run():
+            draft_id = f"d{len(self.service.drafts) + 1:05d}"
+            message = {'id': f"{draft_id}-msg", 'threadId': body['message'].get('threadId')}
+            self.service.drafts[draft_id] = {'id': draft_id, 'message': message}
+            return {'id': draft_id, 'message': message}
+        return FakeRequest(self.service, 'gmail.users.drafts.create', run)
+
+    def list(self, userId, pageToken=None, maxResults=100, q=None, fields=None, **kwargs):
+        def run():
+            drafts = list(self.service.drafts.values())
+            offset = int(pageToken or 0)
+            result = {'drafts': [{'id': d['id'], 'message': dict(d['message'])} for d in drafts[offset:offset + maxResults]]}
+            if offset + maxResults < len(drafts):
+                result['nextPageToken'] = str(offset + maxResults)
+            return result
+        return FakeRequest(self.service, 'gmail.users.drafts.list', run, fields=fields)
+
+    def send(self, userId, body):
+        def run():
+            draft = self.service.drafts.pop(body['id'], None)
+            if draft is None:
+                raise _http_error(404, 'Not Found')
+            self.service.sent.append(draft)
+            return {'id': draft['message']['id'], 'threadId': draft['message']['threadId']}
+        return FakeRequest(self.service, 'gmail.users.drafts.send', run)
+
+
+class _History:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, maxResults=100, **kwargs):
+        def run():
+            start = int(startHistoryId)
+            if start < self.service.oldest_history_id:
+                raise _http_error(404, 'Not Found')
+            records = [r for r in self.service.history if int(r['id']) > start]
+            offset = int(pageToken or 0)
+            result = {'history': records[offset:offset + maxResults], 'historyId': str(self.service.history_id)}
+            if offset + maxResults < len(records):
+                result['nextPageToken'] = str(offset + maxResults)
+            return result
+        return FakeRequest(self.service, 'gmail.users.history.list', run)
+
+
+class _Users:
+    def __init__(self, service):
+        self.service = service
+
+    def threads(self):
+        return _Threads(self.service)
+
+    def history(self):
+        return _History(self.service)
+
+    def messages(self):
+        return _Messages(self.service)
+
+    def drafts(self):
+        return _Drafts(self.service)
+
+    def watch(self, userId, body):
+        def run():
+            self.service.watch_request = body
+            expiration = int((time.time() + 7 * 24 * 3600) * 1000)
+            return {'historyId': str(self.service.history_id), 'expiration': str(expiration)}
+        return FakeRequest(self.service, 'gmail.users.watch', run)
+
+    def getProfile(self, userId):
+        return FakeRequest(self.service, 'gmail.users.getProfile',
+                           lambda: {'emailAddress': 'support@example.com', 'historyId': str(self.service.history_id)})
+
+
+class FakeGmailService:
+    """
+    An in-memory Gmail service.
+
+    Args:
+        latency: Seconds slept per HTTP round-trip (a batch counts as one round-trip).
+        rate_limit_every: If set, every Nth thread fetch fails with a 429 to exercise backoff.
+        bandwidth: If set, bytes per second of simulated download; each response also sleeps
+            for its encoded size divided by the bandwidth.
+
+    Responses are JSON-encoded and decoded like real ones, and their sizes are summed in
+    `bytes_returned`.
+    """
+
+    def __init__(self, latency=0.0, rate_limit_every=None, bandwidth=None):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.bandwidth = bandwidth
+        self.bytes_returned = 0
+        self.threads = {}
+        self.history_id = 1
+        self.oldest_history_id = 1
+        self.history = []
+        self.drafts = {}
+        self.sent = []
+        self.watch_request = None
+        self.calls = {}
+        self.round_trips = 0
+        self._fetches = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def with_synthetic_inbox(cls, num_threads, messages_per_thread=3, body_size=400, **kwargs):
+        """
+        Creates a fake service holding `num_threads` unread threads of `messages_per_thread` messages.
+        """
+        service = cls(**kwargs)
+        filler = ("Hello, I would like to know more about your resume review and placement support. " * 20)[:body_size]
+        for t in range(num_threads):
+            thread_id = f"t{t:05d}"
+            messages = [
+                make_message(thread_id, m, f"Customer {t} <customer{t}@example.com>", f"Question {t}",
+                             f"{filler}\n(message {m})", history_id=service.history_id)
+                for m in range(messages_per_thread)
+            ]
+            service.threads[thread_id] = {'id': thread_id, 'messages': messages}
+        return service
+
+    # -- googleapiclient surface -------------------------------------------------
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback=callback)
+
+    # -- helpers used by the fake resources -------------------------------------
+
+    def _round_trip(self, method_id, sub_requests=0):
+        with self._lock:
+            self.round_trips += 1
+            if not sub_requests:
+                self.calls[method_id] = self.calls.get(method_id, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def respond(self, response, fields=None):
+        """Applies a fields mask and round-trips the response through JSON, counting its bytes."""
+        if fields:
+            response = apply_fields(response, _parse_fields(fields)[0])
+        encoded = json.dumps(response, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self.bytes_returned += len(encoded)
+        if self.bandwidth:
+            time.sleep(len(encoded) / self.bandwidth)
+        return json.loads(encoded)
+
+    def maybe_fail(self):
+        if not self.rate_limit_every:
+            return
+        with self._lock:
+            self._fetches += 1
+            fail = self._fetches % self.rate_limit_every == 0
+        if fail:
+            raise _http_error(429, 'Too Many Requests')
+
+    def matching_thread_ids(self):
+        return [tid for tid, thread in self.threads.items()
+                if any('UNREAD' in m['labelIds'] and 'INBOX' in m['labelIds'] for m in thread['messages'])]
+
+    def thread_history_id(self, thread_id):
+        return max(m['historyId'] for m in self.threads[thread_id]['messages'])
+
+    def render_thread(self, thread_id, format='full', metadataHeaders=None, **kwargs):
+        """Renders a thread the way threads().get does for the requested format."""
+        thread = self.threads[thread_id]
+        messages = []
+        for m in thread['messages']:
+            message = {'id': m['id'], 'threadId': m['threadId'], 'labelIds': list(m['labelIds']),
+                       'historyId': m['historyId'], 'snippet': m['snippet'],
+                       'sizeEstimate': m['sizeEstimate'], 'internalDate': m['internalDate']}
+            if format == 'metadata':
+                headers = m['payload']['headers']
+                if metadataHeaders:
+                    headers = [h for h in headers if h['name'] in metadataHeaders]
+                message['payload'] = {'mimeType': m['payload']['mimeType'], 'headers': headers}
+            elif format != 'minimal':
+                message['payload'] = m['payload']
+            messages.append(message)
+        return {'id': thread_id, 'historyId': self.thread_history_id(thread_id), 'messages': messages}
+
+    def _record(self, key, message, **extra):
+        self.history_id += 1
+        message['historyId'] = str(self.history_id)
+        change = {'message': {'id': message['id'], 'threadId': message['threadId']}, **extra}
+        self.history.append({'id': str(self.history_id), key: [change]})
+
+    def apply_labels(self, message, body):
+        removed = [l for l in body.get('removeLabelIds', []) if l in message['labelIds']]
+        added = [l for l in body.get('addLabelIds', []) if l not in message['labelIds']]
+        message['labelIds'] = [l for l in message['labelIds'] if l not in removed] + added
+        if removed:
+            self._record('labelsRemoved', message, labelIds=removed)
+        if added:
+            self._record('labelsAdded', message, labelIds=added)
+
+    def add_message(self, thread_id, sender, subject, body):
+        """Delivers a new unread message, creating the thread if needed, and records it in history."""
+        with self._lock:
+            thread = self.threads.setdefault(thread_id, {'id': thread_id, 'messages': []})
+            message = make_message(thread_id, len(thread['messages']), sender, subject, body)
+            thread['messages'].append(message)
+            self._record('messagesAdded', message)
+            return message
+
+    def expire_history(self):
+        """Simulates Gmail discarding old history so the next history().list returns 404."""
+        self.oldest_history_id = self.history_id + 1
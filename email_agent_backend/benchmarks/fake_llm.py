@@ -0,0 +1,179 @@
+"""
+Stand-ins for the LLM used by the offline benchmarks: FakeLLM replaces RAGAgent as a whole,
+FakeGenaiClient replaces the Gemini client underneath a real RAGAgent.
+"""
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+CANNED_REPLY = (
+    "Thank you for reaching out to Nexa Learn. Our placement support team reviews every resume "
+    "within two working days and schedules a mock interview once the review is complete. "
+    "Please reply to this email if you have any further questions."
+)
+
+
+class FakeLLM:
+    """
+    Mimics RAGAgent.call by sleeping for `latency` seconds and returning a canned reply.
+    """
+
+    def __init__(self, latency=0.5, reply=CANNED_REPLY):
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+
+    def call(self, messages, usage=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        self._record_usage(messages, usage)
+        return self.reply
+
+    def call_stream(self, messages, usage=None, **kwargs):
+        """Yields the reply word by word, spreading `latency` across the words."""
+        self.calls += 1
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+        self._record_usage(messages, usage)
+
+    def _record_usage(self, messages, usage):
+        # Fills in the same keys as RAGAgent, estimating four characters per token.
+        if usage is None:
+            return
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+        output_tokens = len(self.reply) // 4
+        usage.update(prompt_tokens=prompt_tokens, cached_tokens=0, output_tokens=output_tokens,
+                     total_tokens=prompt_tokens + output_tokens)
+
+
+class FakeFileSearchBackend:
+    """
+    An in-memory implementation of agent.FileSearchStoreBackend.
+
+    Records uploads so callers can check that an unchanged knowledge base is not re-uploaded.
+    """
+
+    def __init__(self, upload_latency=0.0):
+        self.upload_latency = upload_latency
+        self.stores = {}
+        self.uploads = []
+
+    def find_store(self, display_name):
+        for name, store in self.stores.items():
+            if store['display_name'] == display_name and store['documents']:
+                return name
+        return None
+
+    def create_store(self, display_name):
+        name = f"fileSearchStores/fake-{len(self.stores)}"
+        self.stores[name] = {'display_name': display_name, 'documents': []}
+        return name
+
+    def upload(self, store_name, file_path, display_name):
+        time.sleep(self.upload_latency)
+        self.uploads.append((store_name, file_path))
+        self.stores[store_name]['documents'].append(display_name)
+
+
+class FakeAPIError(Exception):
+    """An API error carrying `code` and `status` like google.genai.errors.APIError."""
+
+    def __init__(self, code, status, message):
+        super().__init__(f"{code} {status}. {message}")
+        self.code = code
+        self.status = status
+
+
+class FakeGenaiClient:
+    """
+    Mimics the parts of google.genai.Client used by RAGAgent: models.generate_content,
+    models.generate_content_stream and caches.create.
+
+    Args:
+        latency: Seconds per call, or a dict mapping model names to seconds.
+        error_rate: Share of calls failing with a 500.
+        quota_error_rate: Share of calls rejected with a 429.
+        quota_concurrency: Calls beyond this many at once are rejected with a 429, like a
+            quota hit by a burst; None means unlimited.
+        grounded_rate: Share of responses citing knowledge base chunks, or a dict per model.
+        seed: Seed of the error and grounding draws.
+    """
+
+    def __init__(self, latency=0.5, error_rate=0.0, quota_error_rate=0.0, quota_concurrency=None,
+                 grounded_rate=1.0, reply=CANNED_REPLY, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.quota_concurrency = quota_concurrency
+        self.grounded_rate = grounded_rate
+        self.reply = reply
+        self.calls = {}
+        self.rejected = 0
+        self.failed = 0
+        self.active = 0
+        self.peak_active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = SimpleNamespace(generate_content=self._generate_content,
+                                      generate_content_stream=self._generate_content_stream)
+        self.caches = SimpleNamespace(create=self._create_cache)
+
+    def _per_model(self, value, model):
+        return value.get(model, 0.0) if isinstance(value, dict) else value
+
+    def _start(self, model):
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+            draw = self._random.random()
+            if self.quota_concurrency is not None and self.active >= self.quota_concurrency:
+                self.rejected += 1
+                raise FakeAPIError(429, 'RESOURCE_EXHAUSTED', "Quota exceeded (concurrency)")
+            if draw < self.quota_error_rate:
+                self.rejected += 1
+                raise FakeAPIError(429, 'RESOURCE_EXHAUSTED', "Quota exceeded")
+            if draw < self.quota_error_rate + self.error_rate:
+                self.failed += 1
+                raise FakeAPIError(500, 'INTERNAL', "Internal error")
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            grounded = self._random.random() < self._per_model(self.grounded_rate, model)
+        return grounded
+
+    def _finish(self):
+        with self._lock:
+            self.active -= 1
+
+    def _response(self, text, contents, grounded, final=True):
+        usage = None
+        if final:
+            prompt_tokens = len(str(contents)) // 4
+            usage = SimpleNamespace(prompt_token_count=prompt_tokens, cached_content_token_count=0,
+                                    candidates_token_count=len(self.reply) // 4,
+                                    total_token_count=prompt_tokens + len(self.reply) // 4)
+        chunks = [SimpleNamespace(chunk_id="kb-1")] if grounded and final else None
+        return SimpleNamespace(text=text, usage_metadata=usage,
+                               candidates=[SimpleNamespace(grounding_metadata=SimpleNamespace(grounding_chunks=chunks))])
+
+    def _generate_content(self, model, contents, config=None):
+        grounded = self._start(model)
+        try:
+            time.sleep(self._per_model(self.latency, model))
+            return self._response(self.reply, contents, grounded)
+        finally:
+            self._finish()
+
+    def _generate_content_stream(self, model, contents, config=None):
+        grounded = self._start(model)
+        try:
+            words = self.reply.split(" ")
+            for i, word in enumerate(words):
+                time.sleep(self._per_model(self.latency, model) / len(words))
+                yield self._response(word if i == 0 else " " + word, contents, grounded, final=i == len(words) - 1)
+        finally:
+            self._finish()
+
+    def _create_cache(self, model, config=None):
+        return SimpleNamespace(name=f"cachedContents/fake-{model}")
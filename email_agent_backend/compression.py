@@ -0,0 +1,143 @@
+"""
+Response compression that leaves streams alone.
+
+Only responses with a known length (a Content-Length header: JSON bodies, index.html,
+static files) are compressed, in one piece. Streaming responses (the NDJSON inbox and draft
+streams, server-sent events) carry no Content-Length and pass through untouched, so every
+line reaches the client as soon as it is written. Starlette's GZipMiddleware buffers
+streamed chunks in some versions, which holds a whole stream back until it ends.
+
+Brotli is used when the `brotli` package is installed and the client accepts it, gzip
+otherwise. Accept-Encoding q-values are honoured: the encoding with the highest q is
+chosen, brotli winning ties, and q=0 refuses an encoding.
+"""
+import gzip
+
+import anyio
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing; images, fonts and archives are already compressed.
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+# Bodies at least this large are compressed on a worker thread rather than the event loop.
+THREAD_MINIMUM_SIZE = 256 * 1024
+
+def _accepted_qualities(accept_encoding):
+    """Parses an Accept-Encoding header value into {coding: q}."""
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    return qualities
+
+def choose_encoding(accept_encoding):
+    """
+    Returns 'br', 'gzip' or None for an Accept-Encoding header value: the supported
+    encoding with the highest q-value (brotli on a tie), where q=0 means refused and `*`
+    covers encodings not listed.
+    """
+    qualities = _accepted_qualities(accept_encoding)
+    wildcard = qualities.get('*', 0.0)
+    supported = (['br'] if brotli is not None else []) + ['gzip']
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = qualities.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing complete responses of at least `minimum_size` bytes.
+
+    Streaming responses are deliberately never compressed. Their chunks are single NDJSON
+    lines or SSE events that must reach the client the moment they are written, and a
+    compressed stream can be held back by proxies and client decoders that buffer it
+    before decoding, however often the encoder flushes. Their lines are small, so
+    compressing them each would save little.
+
+    Args:
+        minimum_size: Smallest body (in bytes) that is compressed.
+        compresslevel: gzip level (1-9); brotli uses a comparable quality of 5.
+    """
+
+    def __init__(self, app, minimum_size=1024, compresslevel=6):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('method') == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                if self._compressible(message):
+                    start = message
+                else:
+                    await send(message)
+                return
+            if start is None or message['type'] != 'http.response.body':
+                await send(message)
+                return
+            # A response of known length: collect it and send it compressed in one piece.
+            chunks.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+            await self._send_body(send, start, b''.join(chunks), encoding)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compressible(self, start):
+        headers = {name.lower(): value for name, value in start.get('headers', [])}
+        if b'content-encoding' in headers:
+            return False
+        length = headers.get(b'content-length')
+        if length is None or int(length) < self.minimum_size:
+            return False
+        content_type = headers.get(b'content-type', b'').decode('latin-1').lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def _send_body(self, send, start, body, encoding):
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            compressed = await anyio.to_thread.run_sync(self._compress, body, encoding)
+        else:
+            compressed = self._compress(body, encoding)
+        headers = [(name, value) for name, value in start.get('headers', [])
+                   if name.lower() not in (b'content-length', b'vary')]
+        vary = [value for name, value in start.get('headers', []) if name.lower() == b'vary']
+        headers += [
+            (b'content-encoding', encoding.encode()),
+            (b'content-length', str(len(compressed)).encode()),
+            (b'vary', b', '.join(vary + [b'Accept-Encoding'])),
+        ]
+        await send({**start, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': compressed})
+
+    def _compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=5)
+        return gzip.compress(body, compresslevel=self.compresslevel, mtime=0)
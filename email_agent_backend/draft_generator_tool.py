@@ -1,84 +1,187 @@
 from email.message import EmailMessage
 from typing import List, Dict
 import base64
+import os
+import time
 from googleapiclient.errors import HttpError
-from email_fetcher_tool import get_gmail_service
+from accounts import DEFAULT_ACCOUNT
+from email_fetcher_tool import (get_gmail_service, execute_batch, is_rate_limit_error, THREAD_HEADERS_PROJECTION,
+                                THREAD_LABELS_PROJECTION)
+from thread_cache import thread_cache
+from draft_index import draft_index
+from inbox_sync import threads_read
+import metrics
 
-def create_drafts_from_responses(thread_responses: List[Dict[str, str]]) -> str:
+# Number of drafts().create calls sent per batch request.
+DRAFT_CREATE_BATCH_SIZE = int(os.getenv("DRAFT_CREATE_BATCH_SIZE", "20"))
+# messages().batchModify accepts at most 1000 message IDs per call.
+BATCH_MODIFY_LIMIT = 1000
+
+def _thread_headers(full_thread):
+    """Returns (from_address, subject) of the first message of a thread resource."""
+    to_address = 'unknown'
+    subject = 'No Subject'
+    for header in full_thread['messages'][0]['payload'].get('headers', []):
+        if header['name'] == 'From':
+            to_address = header['value']
+        elif header['name'] == 'Subject':
+            subject = header['value']
+    return to_address, subject
+
+def _build_draft_body(thread_id, to_address, subject, response_content):
+    message = EmailMessage()
+    message.set_content(response_content)
+    message["To"] = to_address
+    message["Subject"] = f"Re: {subject}"
+
+    encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+    return {
+        "message": {
+            "raw": encoded_message,
+            "threadId": thread_id
+        }
+    }
+
+def create_drafts_batch(thread_responses: List[Dict[str, str]], service=None,
+                        account_id: str = DEFAULT_ACCOUNT) -> List[Dict]:
+    """
+    Creates draft replies for many Gmail threads with batched API calls and marks the
+    original threads as read.
+
+    All threads are looked up in a single batch request: cached threads only need their
+    current message labels (format=minimal), the rest also need their From and Subject
+    headers (format=metadata); fields masks trim both responses to what is read. Drafts are created in batch requests of DRAFT_CREATE_BATCH_SIZE,
+    and UNREAD is cleared on the unread messages of every processed thread with
+    messages().batchModify. Every created draft is recorded in the draft index, so it can
+    later be sent by thread ID without searching the account's drafts.
+
+    Args:
+        thread_responses: List of dictionaries with 'thread_id' and 'response' keys
+        service: Optional Gmail API service instance
+        account_id: The account whose mailbox holds the threads
+
+    Returns:
+        One result per input entry, in order, with 'thread_id', 'status' ('created' or 'failed'),
+        'draft_id', 'marked_read' and 'error'. Only the first entry of a thread is drafted;
+        repeated entries fail with a duplicate error.
+    """
+    service = service or get_gmail_service(account_id)
+    started = time.perf_counter()
+    results = []
+    entries = {}
+
+    for thread_response in thread_responses:
+        result = {'thread_id': thread_response.get('thread_id'), 'status': 'failed',
+                  'draft_id': None, 'marked_read': False, 'error': None}
+        results.append(result)
+        try:
+            thread_id, response_content = thread_response['thread_id'], thread_response['response']
+        except KeyError as key_error:
+            result['error'] = f"Missing key in thread response: {key_error}"
+            continue
+        if thread_id in entries:
+            # One draft per thread: the first response is used, later ones are reported.
+            result['error'] = f"Duplicate thread ID in batch: {thread_id}"
+            continue
+        entries[thread_id] = (response_content, result)
+
+    # Get the original threads to extract recipient and subject (reading through the cache)
+    # and the IDs of their unread messages
+    cached = {}
+    lookups = {}
+    for thread_id in entries:
+        thread_data = thread_cache.get_thread(thread_id, account_id=account_id)
+        if thread_data is not None:
+            cached[thread_id] = (thread_data['sender'], thread_data['subject'])
+            lookups[thread_id] = lambda thread_id=thread_id: service.users().threads().get(
+                userId='me', id=thread_id, **THREAD_LABELS_PROJECTION)
+        else:
+            lookups[thread_id] = lambda thread_id=thread_id: service.users().threads().get(
+                userId='me', id=thread_id, **THREAD_HEADERS_PROJECTION)
+
+    full_threads, errors = execute_batch(service, lookups)
+
+    requests = {}
+    unread_message_ids = {}
+    for thread_id, (response_content, result) in entries.items():
+        full_thread = full_threads.get(thread_id)
+        if full_thread is None:
+            result['error'] = f"Gmail API error occurred: {errors.get(thread_id)}"
+            continue
+        to_address, subject = cached.get(thread_id) or _thread_headers(full_thread)
+        unread_message_ids[thread_id] = [
+            message['id'] for message in full_thread['messages'] if 'UNREAD' in message.get('labelIds', [])
+        ]
+        body = _build_draft_body(thread_id, to_address, subject, response_content)
+        requests[thread_id] = lambda body=body: service.users().drafts().create(userId="me", body=body)
+
+    # A create that failed with a server error may still have saved the draft, so only
+    # requests rejected by the rate limit are retried; the rest are reported as failed.
+    drafts, errors = execute_batch(service, requests, batch_size=DRAFT_CREATE_BATCH_SIZE,
+                                   retryable=is_rate_limit_error)
+    for thread_id, error in errors.items():
+        entries[thread_id][1]['error'] = f"Gmail API error occurred: {error}"
+
+    message_ids = []
+    for thread_id, draft in drafts.items():
+        result = entries[thread_id][1]
+        result['status'] = 'created'
+        result['draft_id'] = draft['id']
+        draft_index.put(account_id, thread_id, draft['id'], draft.get('message', {}).get('id'))
+        message_ids.extend(unread_message_ids[thread_id])
+
+    # Mark the original emails/threads as read
+    created_ids = list(drafts)
+    try:
+        for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+            service.users().messages().batchModify(
+                userId='me',
+                body={'ids': message_ids[start:start + BATCH_MODIFY_LIMIT], 'removeLabelIds': ['UNREAD']}
+            ).execute()
+        for thread_id in created_ids:
+            entries[thread_id][1]['marked_read'] = True
+        threads_read(account_id, created_ids)
+    except HttpError as error:
+        for thread_id in created_ids:
+            entries[thread_id][1]['error'] = f"Draft created but marking as read failed: {error}"
+
+    for result in results:
+        metrics.drafts_created.inc(status=result['status'])
+    metrics.stage_latency.observe(time.perf_counter() - started, stage='draft_create_batch')
+    return results
+
+def create_drafts_from_responses(thread_responses: List[Dict[str, str]], account_id: str = DEFAULT_ACCOUNT) -> str:
     """
     Creates draft replies for Gmail threads from response data and marks the original threads as read.
-      
+
     Args:
         thread_responses: List of dictionaries with 'thread_id' and 'response' keys
-          
+        account_id: The account whose mailbox holds the threads
+
     Returns:
         Status message indicating success or failure of draft creation and marking as read
     """
     try:
-        service = get_gmail_service()
-          
         if not thread_responses:
             return "No thread responses provided to create drafts for."
 
         results = []
         created_count = 0
-          
-        for thread_response in thread_responses:
-            try:
-                thread_id = thread_response['thread_id']
-                response_content = thread_response['response']
-                  
-                # Get the original thread to extract recipient and subject
-                full_thread = service.users().threads().get(userId='me', id=thread_id).execute()
-                first_message = full_thread['messages'][0]
-                headers = first_message['payload']['headers']
-                  
-                to_address = 'unknown'
-                subject = 'No Subject'
-                  
-                for header in headers:
-                    if header['name'] == 'From':
-                        to_address = header['value']
-                    elif header['name'] == 'Subject':
-                        subject = header['value']
-
-                # Create a draft
-                message = EmailMessage()
-                message.set_content(response_content)
-                message["To"] = to_address
-                message["Subject"] = f"Re: {subject}"
-                  
-                encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-                  
-                create_message = {
-                    "message": {
-                        "raw": encoded_message,
-                        "threadId": thread_id
-                    }
-                }
-                  
-                draft = service.users().drafts().create(userId="me", body=create_message).execute()
-                  
-                # Mark the original email/thread as read
-                service.users().threads().modify(
-                    userId='me',
-                    id=thread_id,
-                    body={'removeLabelIds': ['UNREAD']}
-                ).execute()
-                  
-                results.append(f"Draft created and thread marked as read for thread ID: {draft['message']['threadId']}")
+
+        for result in create_drafts_batch(thread_responses, service=get_gmail_service(account_id), account_id=account_id):
+            if result['status'] == 'created' and result['marked_read']:
+                results.append(f"Draft created and thread marked as read for thread ID: {result['thread_id']}")
                 created_count += 1
-            
-            except HttpError as sub_error:
-                results.append(f"Gmail API error occurred for thread ID {thread_id}: {sub_error}. Skipping this thread.")
-            except KeyError as key_error:
-                results.append(f"Missing key in thread response: {key_error}. Skipping this entry.")
-            except Exception as sub_e:
-                results.append(f"An unexpected error occurred for thread ID {thread_id}: {sub_e}. Skipping this thread.")
-          
+            elif result['status'] == 'created':
+                results.append(f"{result['error']} for thread ID: {result['thread_id']}")
+                created_count += 1
+            else:
+                results.append(f"{result['error']} for thread ID {result['thread_id']}. Skipping this thread.")
+
         summary = f"Successfully created {created_count} draft replies and marked corresponding emails as read.\n" + "\n".join(results)
         return summary
-          
+
     except HttpError as error:
         return f"Gmail API error occurred while initializing the service: {error}"
     except Exception as e:
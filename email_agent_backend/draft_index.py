@@ -0,0 +1,183 @@
+"""
+A local index of the draft reply waiting in each thread.
+
+Gmail's drafts().list cannot be filtered by thread reliably, so finding the draft of a
+thread used to mean listing drafts and guessing. Instead the draft generator records the
+draft and message ID of every draft it creates, keyed by account and thread, and sending
+by thread is a single drafts().send. Drafts created or deleted outside this service are
+picked up by reconcile(), which pages through drafts().list; lookups that miss reconcile
+lazily, at most once per DRAFT_INDEX_RECONCILE_SECONDS per account.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from storage import data_path
+
+DRAFT_INDEX_PATH = os.getenv("DRAFT_INDEX_PATH") or data_path("draft_index.db")
+# Minimum interval between reconciliations of an account triggered by lookup misses.
+DRAFT_INDEX_RECONCILE_SECONDS = float(os.getenv("DRAFT_INDEX_RECONCILE_SECONDS", "300"))
+# drafts().list accepts up to 500 results per page.
+DRAFTS_PAGE_SIZE = 500
+DRAFTS_LIST_FIELDS = 'drafts(id,message(id,threadId)),nextPageToken'
+
+class DraftIndex:
+    """
+    A persistent SQLite map of (account, thread) to the thread's draft ID and message ID.
+
+    Each thread has at most one indexed draft: the most recently created one. Entries are
+    removed once their draft is sent, or by reconcile() when the draft no longer exists.
+    """
+
+    def __init__(self, path=None, reconcile_seconds=None):
+        self.path = path or DRAFT_INDEX_PATH
+        self.reconcile_seconds = DRAFT_INDEX_RECONCILE_SECONDS if reconcile_seconds is None else reconcile_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._reconcile_locks = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS drafts (
+                account_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                draft_id TEXT NOT NULL,
+                message_id TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (account_id, thread_id)
+            );
+            CREATE TABLE IF NOT EXISTS reconciled (
+                account_id TEXT PRIMARY KEY,
+                reconciled_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def put(self, account_id, thread_id, draft_id, message_id=None):
+        """Records the draft of a thread, replacing any draft indexed for it before."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO drafts VALUES (?, ?, ?, ?, ?)",
+                (account_id, thread_id, draft_id, message_id, time.time())
+            )
+            self._conn.commit()
+
+    def get(self, account_id, thread_id):
+        """Returns {'draft_id': ..., 'message_id': ...} for the thread, or None. Never calls Gmail."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT draft_id, message_id FROM drafts WHERE account_id = ? AND thread_id = ?",
+                (account_id, thread_id)
+            ).fetchone()
+        return {'draft_id': row[0], 'message_id': row[1]} if row else None
+
+    def remove(self, account_id, thread_id, draft_id=None):
+        """Removes the thread's entry; with `draft_id`, only if it still points at that draft."""
+        with self._lock:
+            if draft_id is None:
+                self._conn.execute("DELETE FROM drafts WHERE account_id = ? AND thread_id = ?", (account_id, thread_id))
+            else:
+                self._conn.execute("DELETE FROM drafts WHERE account_id = ? AND thread_id = ? AND draft_id = ?",
+                                   (account_id, thread_id, draft_id))
+            self._conn.commit()
+
+    def lookup(self, service, account_id, thread_id):
+        """
+        Returns the thread's draft entry, reconciling with Gmail first on a miss unless the
+        account was reconciled within the last `reconcile_seconds`. Returns None if the
+        thread has no draft.
+        """
+        entry = self.get(account_id, thread_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        if self.reconcile_if_stale(service, account_id):
+            entry = self.get(account_id, thread_id)
+        return entry
+
+    def reconcile_if_stale(self, service, account_id):
+        """Reconciles the account unless it was reconciled recently. Returns True if it ran."""
+        reconciled_at = self._reconciled_at(account_id)
+        if reconciled_at is not None and time.time() - reconciled_at < self.reconcile_seconds:
+            return False
+        with self._reconcile_lock(account_id):
+            # Another caller may have reconciled while this one waited.
+            if self._reconciled_at(account_id) != reconciled_at:
+                return True
+            self.reconcile(service, account_id)
+        return True
+
+    def reconcile(self, service, account_id):
+        """
+        Brings the account's entries in line with its drafts in Gmail.
+
+        Pages through drafts().list: an indexed draft that still exists is kept, a thread
+        with drafts but no (or a stale) entry gets the first draft listed for it, and entries
+        whose draft is gone are dropped. Entries added while the listing runs are left alone.
+
+        Returns:
+            The number of drafts listed.
+
+        Raises:
+            HttpError: If a drafts().list call fails.
+        """
+        started = time.time()
+        listed = {}
+        count = 0
+        page_token = None
+        while True:
+            response = service.users().drafts().list(
+                userId='me', maxResults=DRAFTS_PAGE_SIZE, pageToken=page_token, fields=DRAFTS_LIST_FIELDS
+            ).execute()
+            for draft in response.get('drafts', []):
+                message = draft.get('message', {})
+                listed.setdefault(message.get('threadId'), []).append((draft['id'], message.get('id')))
+                count += 1
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        listed.pop(None, None)
+
+        with self._lock:
+            indexed = dict(self._conn.execute(
+                "SELECT thread_id, draft_id FROM drafts WHERE account_id = ? AND created_at < ?", (account_id, started)
+            ).fetchall())
+            for thread_id, draft_id in indexed.items():
+                if not any(listed_id == draft_id for listed_id, _ in listed.get(thread_id, ())):
+                    self._conn.execute("DELETE FROM drafts WHERE account_id = ? AND thread_id = ? AND draft_id = ?",
+                                       (account_id, thread_id, draft_id))
+            for thread_id, drafts in listed.items():
+                if indexed.get(thread_id) in {draft_id for draft_id, _ in drafts}:
+                    continue
+                draft_id, message_id = drafts[0]
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO drafts VALUES (?, ?, ?, ?, ?)",
+                    (account_id, thread_id, draft_id, message_id, started)
+                )
+            self._conn.execute("INSERT OR REPLACE INTO reconciled VALUES (?, ?)", (account_id, time.time()))
+            self._conn.commit()
+        print(f"Reconciled draft index for account {account_id}: {count} drafts in {len(listed)} threads")
+        return count
+
+    def stats(self):
+        """Returns hit/miss counters and the number of indexed drafts."""
+        with self._lock:
+            drafts = self._conn.execute("SELECT COUNT(*) FROM drafts").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'drafts': drafts}
+
+    def _reconciled_at(self, account_id):
+        with self._lock:
+            row = self._conn.execute("SELECT reconciled_at FROM reconciled WHERE account_id = ?", (account_id,)).fetchone()
+        return row[0] if row else None
+
+    def _reconcile_lock(self, account_id):
+        with self._lock:
+            return self._reconcile_locks.setdefault(account_id, threading.Lock())
+
+draft_index = DraftIndex()
+metrics.register_cache('draft_index', lambda: (draft_index.hits, draft_index.misses))
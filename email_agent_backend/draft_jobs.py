@@ -0,0 +1,199 @@
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import TokenBucket
+
+BATCH_DRAFT_CONCURRENCY = int(os.getenv("BATCH_DRAFT_CONCURRENCY", "4"))
+BATCH_DRAFT_RATE_PER_MINUTE = float(os.getenv("BATCH_DRAFT_RATE_PER_MINUTE", "60"))
+BATCH_DRAFT_MAX_RETRIES = int(os.getenv("BATCH_DRAFT_MAX_RETRIES", "3"))
+# Completed jobs kept in memory for status lookups.
+MAX_FINISHED_JOBS = 50
+# How long job status stays readable from the shared store (by any worker).
+DRAFT_JOB_STATUS_TTL = float(os.getenv("DRAFT_JOB_STATUS_TTL", "3600"))
+
+_DONE = object()
+
+class DraftJob:
+    """
+    A background job generating drafts for many threads.
+
+    Results are recorded as they complete and can be consumed as a stream with iter_results().
+    """
+
+    def __init__(self, emails, save):
+        self.id = uuid.uuid4().hex
+        self.emails = list(emails)
+        self.save = save
+        self.status = 'pending'
+        self.results = []
+        self.save_result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _record(self, result):
+        """Records an item result and returns its index in `results`."""
+        with self._lock:
+            self.results.append(result)
+            index = len(self.results) - 1
+        self._events.put(result)
+        return index
+
+    def iter_results(self):
+        """
+        Yields each item result as it completes, then a final job summary.
+        Each job's results can be streamed by one consumer.
+        """
+        while True:
+            event = self._events.get()
+            if event is _DONE:
+                yield self.summary()
+                return
+            yield event
+
+    def summary(self):
+        with self._lock:
+            succeeded = sum(1 for r in self.results if r['status'] == 'ok')
+            failed = sum(1 for r in self.results if r['status'] == 'failed')
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'total': len(self.emails),
+            'completed': succeeded,
+            'failed': failed,
+            'save_result': self.save_result,
+            'elapsed': round((self.finished_at or time.time()) - self.created_at, 3),
+        }
+
+class DraftJobManager:
+    """
+    Runs DraftJobs in the background, fanning LLM calls out over a bounded worker pool
+    and a shared rate limit, and retrying failed items individually with backoff.
+
+    With a `shared` store (see shared_state) job status is published there as results
+    arrive, so a status request reaching another worker process still finds the job. Each
+    result is written once under its own key next to a small job summary, so publishing
+    stays constant-size per item however large the job grows.
+
+    Args:
+        generate: Callable taking one email and returning the draft text.
+        save: Callable taking [{'thread_id', 'response'}, ...] that stores drafts in Gmail.
+        shared: Optional SharedState receiving job status.
+        namespace: Keeps the shared job status of different accounts apart.
+    """
+
+    def __init__(self, generate, save, max_concurrency=None, rate_per_minute=None, max_retries=None, shared=None,
+                 namespace="default"):
+        self.generate = generate
+        self.save = save
+        self.shared = shared
+        self.namespace = namespace
+        self.max_concurrency = max_concurrency or BATCH_DRAFT_CONCURRENCY
+        self.max_retries = BATCH_DRAFT_MAX_RETRIES if max_retries is None else max_retries
+        rate_per_minute = rate_per_minute or BATCH_DRAFT_RATE_PER_MINUTE
+        self.rate_limiter = TokenBucket(rate_per_minute / 60.0, capacity=self.max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="draft-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, emails, save=False):
+        """Starts a job for the given emails and returns it immediately."""
+        job = DraftJob(emails, save)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, j in self._jobs.items() if j.finished_at is not None]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+        threading.Thread(target=self._run, args=(job,), name=f"draft-job-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """
+        Returns the summary and item results of a job started by this or (with a shared
+        store) any other worker, or None if it is unknown.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return self._status(job)
+        if self.shared is None:
+            return None
+        key = self._status_key(job_id)
+        summary = self.shared.get(key)
+        if summary is None:
+            return None
+        # A result whose writer has not stored it yet is left out until the next request.
+        results = [self.shared.get(f"{key}:result:{index}") for index in range(summary['completed'] + summary['failed'])]
+        return {**summary, 'results': [result for result in results if result is not None]}
+
+    def _status(self, job):
+        with job._lock:
+            results = list(job.results)
+        return {**job.summary(), 'results': results}
+
+    def _status_key(self, job_id):
+        return f"draft-job:{self.namespace}:{job_id}"
+
+    def _publish(self, job, index=None, result=None):
+        """Publishes the job summary, after storing the item result recorded at `index` if given."""
+        if self.shared is None:
+            return
+        key = self._status_key(job.id)
+        try:
+            if index is not None:
+                self.shared.set(f"{key}:result:{index}", result, ttl=DRAFT_JOB_STATUS_TTL)
+            self.shared.set(key, job.summary(), ttl=DRAFT_JOB_STATUS_TTL)
+        except Exception as e:
+            print(f"Failed to publish status of draft job {job.id}: {e}")
+
+    def queue_depth(self):
+        """Number of items in running jobs that have not completed yet."""
+        with self._lock:
+            return sum(len(job.emails) - len(job.results) for job in self._jobs.values() if job.finished_at is None)
+
+    def _run(self, job):
+        job.status = 'running'
+        self._publish(job)
+        futures = [self.executor.submit(self._generate_one, job, email) for email in job.emails]
+        for future in futures:
+            future.result()
+
+        if job.save:
+            drafts = [{'thread_id': r['thread_id'], 'response': r['draft']} for r in job.results if r['status'] == 'ok']
+            if drafts:
+                try:
+                    job.save_result = self.save(drafts)
+                except Exception as e:
+                    job.save_result = f"Failed to save drafts: {e}"
+
+        job.status = 'completed'
+        job.finished_at = time.time()
+        self._publish(job)
+        job._events.put(_DONE)
+
+    def _generate_one(self, job, email):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            attempt += 1
+            try:
+                draft = self.generate(email)
+                result = {'thread_id': email.thread_id, 'status': 'ok', 'draft': draft, 'attempts': attempt}
+                self._publish(job, job._record(result), result)
+                return
+            except Exception as e:
+                if attempt > self.max_retries:
+                    print(f"Draft generation failed for thread {email.thread_id} after {attempt} attempts: {e}")
+                    result = {'thread_id': email.thread_id, 'status': 'failed', 'error': str(e), 'attempts': attempt}
+                    self._publish(job, job._record(result), result)
+                    return
+                time.sleep(min(30.0, 2 ** (attempt - 1)) + random.uniform(0, 1))
@@ -1,173 +1,638 @@
 from typing import List, Dict
 import os  
-import base64  
+import html
+import logging
+import random
+import time
+import datetime
+import threading
+from collections import OrderedDict
+import httplib2
 from google.auth.transport.requests import Request  
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials  
 from google_auth_oauthlib.flow import InstalledAppFlow  
-from googleapiclient.discovery import build  
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError  
+from googleapiclient.http import HttpRequest
+from accounts import DEFAULT_ACCOUNT, account_registry
+from thread_cache import thread_cache
+from mime_parser import BodyMemo, body_memo, extract_body
+import metrics
   
 # Your existing functions (unchanged)  
 SCOPES = ["https://www.googleapis.com/auth/gmail.modify"]  
+
+UNREAD_QUERY = 'is:unread in:inbox -category:social -category:promotions -category:updates'
+
+# Batch hydration settings. Gmail accepts at most 100 sub-requests per batch but
+# recommends 50 or fewer to stay under the per-user concurrent request quota.
+GMAIL_MAX_BATCH_SIZE = 100
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+GMAIL_BACKOFF_BASE = float(os.getenv("GMAIL_BACKOFF_BASE", "1.0"))
+GMAIL_BACKOFF_MAX = 32.0
+
+# threads().list page size. Gmail allows up to 500 results per page.
+GMAIL_MAX_PAGE_SIZE = 500
+GMAIL_PAGE_SIZE = int(os.getenv("GMAIL_PAGE_SIZE", "100"))
+
+# Partial-response masks (the fields= parameter) so Gmail only returns what we read.
+# format=full cannot filter headers by name, so the body mask keeps the message headers
+# (Subject/From) but drops snippets, sizes, part IDs, attachment IDs and per-part headers;
+# attachments are then recognised by their filename.
+_PART_FIELDS = "mimeType,filename,body/data"
+THREAD_BODY_FIELDS = (
+    "id,historyId,messages(id,labelIds,payload(" + _PART_FIELDS + ",headers,"
+    "parts(" + _PART_FIELDS + ",parts(" + _PART_FIELDS + ",parts))))"
+)
+THREAD_BODY_PROJECTION = {'format': 'full', 'fields': THREAD_BODY_FIELDS}
+# Header-only views use format=metadata, which does filter headers by name.
+THREAD_SUMMARY_PROJECTION = {
+    'format': 'metadata',
+    'metadataHeaders': ['From', 'Subject'],
+    'fields': "id,historyId,messages(id,labelIds,snippet,payload/headers)",
+}
+THREAD_HEADERS_PROJECTION = {
+    'format': 'metadata',
+    'metadataHeaders': ['From', 'Subject'],
+    'fields': "messages(id,labelIds,payload/headers)",
+}
+THREAD_LABELS_PROJECTION = {'format': 'minimal', 'fields': "messages(id,labelIds)"}
+THREAD_LIST_FIELDS = "threads(id,historyId,snippet),nextPageToken"
+
+TOKEN_PATH = os.getenv("GMAIL_TOKEN_PATH", "token.json")
+CREDENTIALS_PATH = os.getenv("GMAIL_CREDENTIALS_PATH", "credentials.json")
+# Credentials are refreshed this long before the access token expires.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+GMAIL_HTTP_TIMEOUT = float(os.getenv("GMAIL_HTTP_TIMEOUT", "60"))
+# Gmail services kept per worker thread; beyond this the least recently used account's is dropped.
+GMAIL_SERVICES_PER_THREAD = int(os.getenv("GMAIL_SERVICES_PER_THREAD", "8"))
+
+logger = logging.getLogger(__name__)
+
+metrics.register_cache('message_body', lambda: (body_memo.hits, body_memo.misses))
+
+# Process-wide credential (per account) and discovery caches, plus per-thread services.
+_credentials = {}
+_credentials_lock = threading.Lock()
+_discovery_document = None
+_thread_local = threading.local()
+
+def _token_path(account_id):
+    return TOKEN_PATH if account_id == DEFAULT_ACCOUNT else account_registry.token_path(account_id)
+
+def _run_oauth_flow():
+    flow = InstalledAppFlow.from_client_secrets_file(
+        CREDENTIALS_PATH, SCOPES
+    )
+    # This opens a browser window for you to log in
+    return flow.run_local_server(port=8000)
   
-def get_gmail_service():  
-    """  
-    Authenticates the user and returns a Gmail API service object.  
-      
-    This function handles the OAuth 2.0 flow for a desktop application.  
-    It saves the credentials to 'token.json' after the first successful  
-    authentication for future use.  
-    """  
-    creds = None  
-    # The file token.json stores the user's access and refresh tokens.  
-    if os.path.exists("token.json"):  
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)  
-      
-    # If there are no (valid) credentials available, let the user log in.  
-    if not creds or not creds.valid:  
-        if creds and creds.expired and creds.refresh_token:  
-            # Refresh the token if it's expired  
-            creds.refresh(Request())  
-        else:  
-            # Start the new authentication flow  
-            flow = InstalledAppFlow.from_client_secrets_file(  
-                "credentials.json", SCOPES  
-            )  
-            # This opens a browser window for you to log in  
-            creds = flow.run_local_server(port=8000)  
-          
-        # Save the credentials for the next run  
-        with open("token.json", "w") as token:  
-            token.write(creds.to_json())  
-  
-    # Build and return the Gmail API service object  
-    service = build("gmail", "v1", credentials=creds)  
-    return service  
-  
-def get_message_body(message_part):  
-    """  
-    Decodes and returns the plain text body from a message part, removing email headers.  
-  
-    Args:  
-        message_part: The 'payload' dictionary of a message or a message part.  
-  
-    Returns:  
-        The decoded message body as a string with headers removed, or None if not found.  
-    """  
-    body = None
-    
-    # Check if the message has a body  
-    if 'body' in message_part and 'data' in message_part['body']:  
-        body = base64.urlsafe_b64decode(message_part['body']['data']).decode('utf-8')
-      
-    # If it's a multipart message, iterate through the parts  
-    if body is None and 'parts' in message_part:  
-        for part in message_part['parts']:  
-            if part['mimeType'] == 'text/plain':  
-                # Found the plain text part, return its decoded body  
-                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                break
-    
-    if body is None:
+def _load_credentials(account_id=DEFAULT_ACCOUNT):
+    """
+    Loads an account's credentials from its token file, refreshing them if needed, and saves
+    them back to the token file when they change. Only the default account runs the OAuth 2.0
+    desktop flow here; other accounts are authorized with `python -m accounts add --authorize`.
+
+    Raises:
+        LookupError: If a non-default account has no usable stored credentials.
+    """
+    creds = None
+    token_path = _token_path(account_id)
+    # The token file stores the user's access and refresh tokens.
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            # Refresh the token if it's expired
+            creds.refresh(Request())
+        elif account_id == DEFAULT_ACCOUNT:
+            # Start the new authentication flow
+            creds = _run_oauth_flow()
+        else:
+            raise LookupError(f"No Gmail credentials stored for account {account_id}")
+
+        _save_credentials(creds, account_id)
+
+    return creds
+
+def _save_credentials(creds, account_id=DEFAULT_ACCOUNT):
+    if account_id != DEFAULT_ACCOUNT:
+        account_registry.save_token(account_id, creds.to_json())
+        return
+    with open(TOKEN_PATH, "w") as token:
+        token.write(creds.to_json())
+
+def authorize_account(account_id):
+    """Runs the OAuth 2.0 desktop flow for an account and stores its token."""
+    creds = _run_oauth_flow()
+    _save_credentials(creds, account_id)
+    reset_gmail_service(account_id)
+    return creds
+
+def _expires_soon(creds):
+    if creds.expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime.
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - TOKEN_REFRESH_MARGIN <= now
+
+def get_credentials(account_id=DEFAULT_ACCOUNT):
+    """
+    Returns the process-wide Gmail credentials of an account, loading them on first use and
+    refreshing them shortly before the access token expires.
+    """
+    with _credentials_lock:
+        creds = _credentials.get(account_id)
+        if creds is None:
+            creds = _credentials[account_id] = _load_credentials(account_id)
+        elif creds.refresh_token and (not creds.valid or _expires_soon(creds)):
+            creds.refresh(Request())
+            _save_credentials(creds, account_id)
+        return creds
+
+def _get_discovery_document():
+    global _discovery_document
+    if _discovery_document is None:
+        _discovery_document = get_static_doc("gmail", "v1")
+    return _discovery_document
+
+class InstrumentedHttpRequest(HttpRequest):
+    """An HttpRequest that records each executed Gmail call in the request metrics."""
+
+    def execute(self, http=None, num_retries=0):
+        method = self.methodId or 'unknown'
+        start = time.perf_counter()
+        try:
+            with metrics.span("gmail." + method.rsplit('.', 1)[-1], method=method):
+                response = super().execute(http=http, num_retries=num_retries)
+        except HttpError as error:
+            metrics.record_gmail(method, str(getattr(error.resp, 'status', 'error')), time.perf_counter() - start)
+            raise
+        except Exception:
+            metrics.record_gmail(method, 'error', time.perf_counter() - start)
+            raise
+        metrics.record_gmail(method, 'ok', time.perf_counter() - start)
+        return response
+
+def get_gmail_service(account_id=DEFAULT_ACCOUNT):
+    """
+    Returns a Gmail API service object of an account for the calling thread.
+
+    Credentials are loaded once per process and account and kept in memory (see
+    get_credentials), and the discovery document is parsed once. googleapiclient services
+    and their httplib2 connections are not thread-safe, so each thread keeps its own pool
+    of services, one per recently used account (up to GMAIL_SERVICES_PER_THREAD), which
+    are reused on later calls and keep their HTTP connections to Gmail alive.
+    """
+    creds = get_credentials(account_id)
+    services = getattr(_thread_local, 'services', None)
+    if services is None:
+        services = _thread_local.services = OrderedDict()
+    entry = services.get(account_id)
+    if entry is not None and entry[0] is creds:
+        services.move_to_end(account_id)
+        return entry[1]
+
+    discovery_document = _get_discovery_document()
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT))
+    if discovery_document is not None:
+        service = build_from_document(discovery_document, http=http, requestBuilder=InstrumentedHttpRequest)
+    else:
+        service = build("gmail", "v1", http=http, cache_discovery=False, requestBuilder=InstrumentedHttpRequest)
+    services[account_id] = (creds, service)
+    services.move_to_end(account_id)
+    while len(services) > GMAIL_SERVICES_PER_THREAD:
+        services.popitem(last=False)
+    return service
+
+def reset_gmail_service(account_id=None):
+    """
+    Drops the cached credentials of an account (or of every account) so the next call
+    reloads them. Services built from dropped credentials are rebuilt on their next use.
+    """
+    global _discovery_document
+    with _credentials_lock:
+        if account_id is None:
+            _credentials.clear()
+        else:
+            _credentials.pop(account_id, None)
+    if account_id is None:
+        _discovery_document = None
+        _thread_local.__dict__.clear()
+
+def get_message_body(message_part):
+    """
+    Decodes and returns the text body from a message part, removing quoted replies and signatures.
+
+    Nested multiparts are walked recursively; text/plain is preferred and HTML-only messages
+    are converted to text. Only the selected part is decoded (see mime_parser).
+
+    Args:
+        message_part: The 'payload' dictionary of a message or a message part.
+
+    Returns:
+        The decoded message body as a string with quoted history removed, or None if not found.
+    """
+    return extract_body(message_part)
+
+def _message_body(thread_id, message, account_id=DEFAULT_ACCOUNT, parsed=None):
+    """
+    Returns the cleaned body of a message, memoized by account and message ID in memory and
+    in the persistent thread cache so unchanged messages are never parsed twice. With a
+    `parsed` list, a newly parsed message is appended to it as (message_id, headers, body)
+    for the caller to store with its thread instead of being written on its own.
+    """
+    key = (account_id, message['id'])
+    body = body_memo.get(key)
+    if body is not BodyMemo.MISSING:
+        return body
+
+    cached = thread_cache.get_message(message['id'], account_id=account_id)
+    if cached is not None:
+        body = cached['body']
+    else:
+        body = get_message_body(message['payload'])
+        if parsed is not None:
+            parsed.append((message['id'], message['payload'].get('headers', []), body))
+        else:
+            thread_cache.put_message(message['id'], thread_id, message['payload'].get('headers', []), body,
+                                     account_id=account_id)
+
+    body_memo.put(key, body)
+    return body
+
+def _status(error):
+    try:
+        return int(getattr(getattr(error, 'resp', None), 'status', None))
+    except (TypeError, ValueError):
         return None
-    
-    # Clean up email headers: Remove lines like "On [Date] at [Time] [Sender] <email> wrote:"
-    lines = body.split('\n')
-    cleaned_lines = []
-    skip_next_blank = False
-    
-    for line in lines:
-        trimmed = line.strip()
-        
-        # Check if this is an email header line
-        if trimmed.startswith('On ') and trimmed.endswith('wrote:'):
-            skip_next_blank = True
-            continue
-        
-        # Skip blank line immediately after header
-        if skip_next_blank and trimmed == '':
-            skip_next_blank = False
-            continue
-        
-        skip_next_blank = False
-        
-        # Remove quoted lines (lines starting with >)
-        if not trimmed.startswith('>'):
-            cleaned_lines.append(line)
-    
-    return '\n'.join(cleaned_lines).strip()  
-  
-def read_unread_threads(service):  
-    """  
-    Reads unread threads and returns a list of dictionaries.  
-      
-    Each dictionary contains the thread ID, subject, and the full conversation history.  
-      
-    Args:  
-        service: Authorized Gmail API service instance.  
-          
-    Returns:  
-        A list of dictionaries, where each dict has 'thread_id', 'subject', and 'history'.  
-    """  
-    print("Reading unread threads...")  
-    unread_threads_data = []  
-      
-    try:  
-        results = service.users().threads().list(userId='me', q='is:unread in:inbox -category:social -category:promotions -category:updates').execute()
-        threads = results.get('threads', [])  
-  
-        if not threads:  
-            print("No unread threads found in your inbox.")  
-            return unread_threads_data  
-  
-        print("Unread threads found in your inbox:")  
-        for thread in threads:  
-            full_thread = service.users().threads().get(userId='me', id=thread['id']).execute()  
-              
-            first_message = full_thread['messages'][0]  
-            headers = first_message['payload']['headers']  
-            subject = 'No Subject'  
-              
-            for header in headers:  
-                if header['name'] == 'Subject':  
-                    subject = header['value']  
-                    break  
-              
-            # Use a list to build the full conversation history.  
-            full_conversation_history = []  
-              
-            # Iterate through all messages in the thread and get their body.  
-            for message in full_thread['messages']:  
-                body = get_message_body(message['payload'])  
-                if body:  
-                    full_conversation_history.append(body)  
-              
-            print("-" * 40)  
-            print(f"--- Thread ID: {thread['id']} ---")  
-            print(f"Subject: {subject}")  
-            print("\nConversation History:\n" + "\n---\n".join(full_conversation_history))  
-            print("-" * 40)  
-              
-            # Extract sender
-            sender = 'Unknown'
-            for header in headers:
-                if header['name'] == 'From':
-                    sender = header['value']
-                    break
-              
-            # Append the structured data to the list.  
-            unread_threads_data.append({  
-                'thread_id': thread['id'],  
-                'subject': subject,  
-                'sender': sender,
-                'history': "\n---\n".join(full_conversation_history)  
-            })  
-  
-    except HttpError as error:  
-        print(f"An error occurred while reading threads: {error}")  
-      
-    return unread_threads_data  
-  
+
+def is_rate_limit_error(error):
+    """
+    Returns True if a Gmail API error is a per-user quota error, i.e. the request was
+    rejected without being carried out.
+    """
+    status = _status(error)
+    if status == 403:
+        # Gmail reports per-user quota exhaustion as 403 rateLimitExceeded / userRateLimitExceeded.
+        return 'rateLimitExceeded' in str(error)
+    return status == 429
+
+def is_retryable_error(error):
+    """
+    Returns True if a Gmail API error is a per-user quota or transient server error
+    that is worth retrying with backoff.
+    """
+    return is_rate_limit_error(error) or _status(error) in (500, 502, 503, 504)
+
+def execute_batch(service, requests, batch_size=None, max_retries=None, retryable=is_retryable_error):
+    """
+    Executes many Gmail API requests as batch requests.
+
+    Requests are sent in batches of at most `batch_size` sub-requests. Sub-requests that
+    fail with a quota or transient error are rebuilt and retried with exponential backoff.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        requests: Dict mapping a request ID to a zero-argument callable that builds the request.
+        batch_size: Maximum number of sub-requests per batch (defaults to GMAIL_BATCH_SIZE).
+        max_retries: Maximum number of backoff rounds (defaults to GMAIL_MAX_RETRIES).
+        retryable: Predicate selecting the errors to retry. Requests that must not be repeated
+            once Gmail may have carried them out pass is_rate_limit_error.
+
+    Returns:
+        A tuple (responses, errors) of dicts keyed by request ID.
+    """
+    batch_size = max(1, min(batch_size or GMAIL_BATCH_SIZE, GMAIL_MAX_BATCH_SIZE))
+    max_retries = GMAIL_MAX_RETRIES if max_retries is None else max_retries
+
+    responses = {}
+    errors = {}
+    pending = list(requests)
+    attempt = 0
+
+    while pending:
+        retry = []
+        methods = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+                metrics.record_gmail(methods[request_id], 'ok')
+                return
+            metrics.record_gmail(methods[request_id], str(getattr(getattr(exception, 'resp', None), 'status', 'error')))
+            if retryable(exception):
+                retry.append(request_id)
+                errors[request_id] = exception
+            else:
+                errors[request_id] = exception
+
+        for start in range(0, len(pending), batch_size):
+            batch = service.new_batch_http_request(callback=callback)
+            chunk = pending[start:start + batch_size]
+            for request_id in chunk:
+                request = requests[request_id]()
+                methods[request_id] = getattr(request, 'methodId', None) or 'unknown'
+                batch.add(request, request_id=request_id)
+            batch_start = time.perf_counter()
+            with metrics.span("gmail.batch", size=len(chunk)):
+                batch.execute()
+            metrics.record_gmail('batch', 'ok', time.perf_counter() - batch_start)
+
+        if not retry:
+            break
+        if attempt >= max_retries:
+            print(f"Giving up on {len(retry)} requests after {attempt} retries due to rate limiting.")
+            break
+
+        for request_id in retry:
+            errors.pop(request_id, None)
+        delay = min(GMAIL_BACKOFF_MAX, GMAIL_BACKOFF_BASE * (2 ** attempt)) + random.uniform(0, GMAIL_BACKOFF_BASE)
+        print(f"Rate limited on {len(retry)} requests, retrying in {delay:.1f}s...")
+        time.sleep(delay)
+        attempt += 1
+        pending = retry
+
+    return responses, errors
+
+def batch_get_threads(service, thread_ids, batch_size=None, max_retries=None, errors=None, **get_kwargs):
+    """
+    Fetches many threads using Gmail batch requests instead of one blocking call per thread.
+
+    Quota and transient errors are retried with backoff (see execute_batch); other errors
+    are logged and the thread is skipped.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        thread_ids: Iterable of thread IDs to fetch.
+        batch_size: Maximum number of sub-requests per batch (defaults to GMAIL_BATCH_SIZE).
+        max_retries: Maximum number of backoff rounds (defaults to GMAIL_MAX_RETRIES).
+        errors: Optional dict that receives the error of each thread that could not be fetched.
+        **get_kwargs: Extra arguments passed to threads().get (e.g. format). Defaults to
+            THREAD_BODY_PROJECTION, which is everything parse_thread reads.
+
+    Returns:
+        A dict mapping thread ID to the thread resource returned by Gmail.
+    """
+    get_kwargs = get_kwargs or THREAD_BODY_PROJECTION
+    requests = {
+        thread_id: (lambda thread_id=thread_id: service.users().threads().get(userId='me', id=thread_id, **get_kwargs))
+        for thread_id in thread_ids
+    }
+    with metrics.stage_latency.time(stage='hydrate'):
+        threads_by_id, failed = execute_batch(service, requests, batch_size=batch_size, max_retries=max_retries)
+    for thread_id, error in failed.items():
+        print(f"An error occurred while fetching thread {thread_id}: {error}")
+    if errors is not None:
+        errors.update(failed)
+    return threads_by_id
+
+def parse_thread(thread_id, full_thread, account_id=DEFAULT_ACCOUNT):
+    """
+    Extracts the subject, sender and cleaned conversation history from a thread resource.
+
+    Message bodies are read through the persistent thread cache so unchanged messages are
+    not decoded again, and the parsed thread is written back to the cache.
+
+    Args:
+        thread_id: The Gmail thread ID.
+        full_thread: The thread resource returned by threads().get.
+        account_id: The account whose mailbox holds the thread (scopes the cache entries).
+
+    Returns:
+        A dictionary with 'thread_id', 'subject', 'sender', 'history', 'history_id' and
+        'customer_message' (the newest message not sent from the mailbox, or None).
+    """
+    first_message = full_thread['messages'][0]
+    subject, sender = _subject_and_sender(first_message['payload']['headers'])
+
+    # Use a list to build the full conversation history.
+    full_conversation_history = []
+
+    # Iterate through all messages in the thread and get their body; newly parsed messages
+    # are stored together with the thread in one transaction.
+    parsed = []
+    customer_message = None
+    for message in full_thread['messages']:
+        body = _message_body(thread_id, message, account_id, parsed)
+        if body:
+            full_conversation_history.append(body)
+            if not {'SENT', 'DRAFT'} & set(message.get('labelIds', [])):
+                customer_message = body
+
+    thread_data = {
+        'thread_id': thread_id,
+        'subject': subject,
+        'sender': sender,
+        'history': "\n---\n".join(full_conversation_history),
+        'history_id': full_thread.get('historyId'),
+        'customer_message': customer_message,
+    }
+    thread_cache.put_thread(thread_data, [message['id'] for message in full_thread['messages']], account_id=account_id,
+                            messages=parsed)
+    return thread_data
+
+def _subject_and_sender(headers):
+    subject = 'No Subject'
+    sender = 'Unknown'
+    for header in headers:
+        if header['name'] == 'Subject' and subject == 'No Subject':
+            subject = header['value']
+        elif header['name'] == 'From' and sender == 'Unknown':
+            sender = header['value']
+    return subject, sender
+
+def parse_thread_summary(thread_id, thread, snippet=None):
+    """
+    Builds the lightweight list entry for a thread fetched with THREAD_SUMMARY_PROJECTION.
+
+    Args:
+        thread_id: The Gmail thread ID.
+        thread: The thread resource (format=metadata with From/Subject headers).
+        snippet: The snippet from threads().list, if known; otherwise the last message's.
+
+    Returns:
+        A dictionary with 'thread_id', 'subject', 'sender', 'snippet', 'history_id' and 'message_count'.
+    """
+    messages = thread.get('messages', [])
+    subject, sender = _subject_and_sender(messages[0].get('payload', {}).get('headers', []) if messages else [])
+    if snippet is None:
+        snippet = messages[-1].get('snippet', '') if messages else ''
+    return {
+        'thread_id': thread_id,
+        'subject': subject,
+        'sender': sender,
+        'snippet': html.unescape(snippet),
+        'history_id': thread.get('historyId'),
+        'message_count': len(messages),
+    }
+
+def read_thread(service, thread_id, history_id=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Loads one thread with its full conversation history, for opening a thread from the list view.
+
+    If `history_id` is given and matches the cached copy, Gmail is not contacted.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        thread_id: The Gmail thread ID.
+        history_id: The thread historyId shown in the list view, if known.
+        account_id: The account `service` belongs to.
+
+    Returns:
+        A thread dictionary as produced by parse_thread.
+    """
+    if history_id is not None:
+        cached = thread_cache.get_thread(thread_id, history_id=history_id, account_id=account_id)
+        if cached is not None:
+            return cached
+    full_thread = service.users().threads().get(userId='me', id=thread_id, **THREAD_BODY_PROJECTION).execute()
+    return parse_thread(thread_id, full_thread, account_id)
+
+def iter_unread_thread_pages(service, page_size=None, first_page_size=None, query=UNREAD_QUERY):
+    """
+    Yields pages of thread stubs ({'id', 'historyId', 'snippet'}) matching the unread inbox query,
+    following nextPageToken until the listing is exhausted.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        page_size: Number of threads requested per page (defaults to GMAIL_PAGE_SIZE).
+        first_page_size: Optional smaller size for the first page so callers can render quickly.
+        query: Gmail search query.
+    """
+    page_size = max(1, min(page_size or GMAIL_PAGE_SIZE, GMAIL_MAX_PAGE_SIZE))
+    max_results = first_page_size or page_size
+    page_token = None
+
+    while True:
+        with metrics.stage_latency.time(stage='list_page'):
+            results = service.users().threads().list(
+                userId='me', q=query, maxResults=max_results, pageToken=page_token, fields=THREAD_LIST_FIELDS
+            ).execute()
+        threads = results.get('threads', [])
+        if threads:
+            yield threads
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+        max_results = page_size
+
+def iter_unread_threads(service, page_size=None, first_page_size=None, batch_size=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Generator that yields hydrated unread threads as each listing page arrives.
+
+    Threads whose listed historyId matches the cached copy are served from the thread cache;
+    only the remaining threads are fetched from Gmail.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        page_size: Number of threads listed per page.
+        first_page_size: Optional smaller size for the first page.
+        batch_size: Optional override for the number of threads fetched per batch.
+        account_id: The account `service` belongs to.
+
+    Yields:
+        Dictionaries with 'thread_id', 'subject', 'sender' and 'history'.
+    """
+    for page in iter_unread_thread_pages(service, page_size=page_size, first_page_size=first_page_size):
+        cached_threads = {}
+        for thread in page:
+            cached = thread_cache.get_thread(thread['id'], history_id=thread.get('historyId'), account_id=account_id)
+            if cached is not None:
+                cached_threads[thread['id']] = cached
+
+        missing_ids = [thread['id'] for thread in page if thread['id'] not in cached_threads]
+        threads_by_id = batch_get_threads(service, missing_ids, batch_size=batch_size) if missing_ids else {}
+
+        for thread in page:
+            thread_data = cached_threads.get(thread['id'])
+            if thread_data is None:
+                full_thread = threads_by_id.get(thread['id'])
+                if full_thread is None:
+                    continue
+                with metrics.stage_latency.time(stage='parse'):
+                    thread_data = parse_thread(thread['id'], full_thread, account_id)
+
+            # Printing every body is slow on large inboxes, so it is only done at debug level.
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Thread %s\nSubject: %s\nConversation History:\n%s",
+                             thread_data['thread_id'], thread_data['subject'], thread_data['history'])
+
+            yield thread_data
+
+def iter_unread_thread_summaries(service, page_size=None, first_page_size=None, batch_size=None,
+                                 account_id=DEFAULT_ACCOUNT):
+    """
+    Generator that yields list-view summaries of unread threads, page by page.
+
+    Only the From and Subject headers are fetched (THREAD_SUMMARY_PROJECTION); bodies are
+    loaded on demand with read_thread. Threads already cached at the listed historyId are
+    summarised without contacting Gmail.
+
+    Yields:
+        Dictionaries as produced by parse_thread_summary.
+    """
+    for page in iter_unread_thread_pages(service, page_size=page_size, first_page_size=first_page_size):
+        summaries = {}
+        for thread in page:
+            cached = thread_cache.get_thread(thread['id'], history_id=thread.get('historyId'), account_id=account_id)
+            if cached is not None:
+                summaries[thread['id']] = {
+                    'thread_id': thread['id'],
+                    'subject': cached['subject'],
+                    'sender': cached['sender'],
+                    'snippet': html.unescape(thread.get('snippet', '')),
+                    'history_id': cached['history_id'],
+                    'message_count': len(cached['message_ids']),
+                }
+
+        missing_ids = [thread['id'] for thread in page if thread['id'] not in summaries]
+        if missing_ids:
+            threads_by_id = batch_get_threads(service, missing_ids, batch_size=batch_size, **THREAD_SUMMARY_PROJECTION)
+            for thread in page:
+                if thread['id'] in threads_by_id:
+                    summaries[thread['id']] = parse_thread_summary(
+                        thread['id'], threads_by_id[thread['id']], snippet=thread.get('snippet'))
+
+        for thread in page:
+            if thread['id'] in summaries:
+                yield summaries[thread['id']]
+
+def read_unread_threads(service, batch_size=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Reads unread threads and returns a list of dictionaries.
+
+    Each dictionary contains the thread ID, subject, and the full conversation history.
+    All result pages are read; thread bodies are hydrated with Gmail batch requests.
+
+    Args:
+        service: Authorized Gmail API service instance.
+        batch_size: Optional override for the number of threads fetched per batch.
+        account_id: The account `service` belongs to.
+
+    Returns:
+        A list of dictionaries, where each dict has 'thread_id', 'subject', 'sender' and 'history'.
+    """
+    print("Reading unread threads...")
+    unread_threads_data = []
+
+    try:
+        for thread_data in iter_unread_threads(service, batch_size=batch_size, account_id=account_id):
+            unread_threads_data.append(thread_data)
+    except HttpError as error:
+        print(f"An error occurred while reading threads: {error}")
+
+    if not unread_threads_data:
+        print("No unread threads found in your inbox.")
+
+    return unread_threads_data
+
 def fetch_unread_threads() -> str:  
     """  
     Reads unread Gmail threads and returns formatted conversation data.  
@@ -1,5 +1,19 @@
-from email_fetcher_tool import get_gmail_service
+import base64
+import hashlib
+import os
+import uuid
+from email.message import EmailMessage
+from accounts import DEFAULT_ACCOUNT
+from draft_index import draft_index
+from email_fetcher_tool import get_gmail_service, execute_batch
 from googleapiclient.errors import HttpError
+from inbox_sync import threads_read
+from send_queue import SendQueue, Step
+import metrics
+
+# Number of drafts().send calls per batch request when approving many drafts at once; each
+# batch also takes this many tokens from the send rate limiter, so it is capped at its burst.
+DRAFT_SEND_BATCH_SIZE = int(os.getenv("DRAFT_SEND_BATCH_SIZE", "5"))
 
 def send_draft(draft_id):
     """
@@ -14,54 +28,255 @@ def send_draft(draft_id):
     except Exception as e:
         return f"An unhandled error occurred: {str(e)}"
 
-def send_draft_by_thread_id(thread_id):
+def deliver_draft_by_thread_id(thread_id, account_id=DEFAULT_ACCOUNT):
     """
     Finds and sends the draft associated with a specific thread ID.
+
+    The draft is found in the draft index, so the usual case is a single drafts().send. If
+    the indexed draft no longer exists, the index is reconciled with Gmail and the send is
+    retried once.
+
+    Raises:
+        HttpError: If a Gmail API call fails.
+        LookupError: If the thread has no draft.
     """
+    service = get_gmail_service(account_id)
+    entry = draft_index.lookup(service, account_id, thread_id)
+    if entry is None:
+        raise LookupError(f"No draft found for thread ID: {thread_id}")
+
     try:
-        service = get_gmail_service()
-        # List drafts in the specified thread
-        drafts_response = service.users().drafts().list(userId='me', q=f'threadId:{thread_id}').execute()
-        drafts = drafts_response.get('drafts', [])
-        
-        if not drafts:
-            return f"No draft found for thread ID: {thread_id}"
-        
-        # In this workflow, we assume the most recent draft in the thread is the one to send
-        draft_id = drafts[0]['id']
-        service.users().drafts().send(userId='me', body={'id': draft_id}).execute()
-        return f"Successfully sent draft for thread ID: {thread_id}"
-        
+        sent = service.users().drafts().send(userId='me', body={'id': entry['draft_id']}).execute()
     except HttpError as error:
-        return f"Gmail API error occurred: {error}"
+        if getattr(error.resp, 'status', None) != 404:
+            raise
+        # Deleted or sent outside this service: look for another draft in the thread.
+        draft_index.remove(account_id, thread_id, entry['draft_id'])
+        draft_index.reconcile(service, account_id)
+        entry = draft_index.get(account_id, thread_id)
+        if entry is None:
+            raise LookupError(f"No draft found for thread ID: {thread_id}")
+        sent = service.users().drafts().send(userId='me', body={'id': entry['draft_id']}).execute()
+
+    draft_index.remove(account_id, thread_id, entry['draft_id'])
+    return {'draft_id': entry['draft_id'], 'message_id': sent.get('id')}
+
+def deliver_drafts_by_thread_ids(thread_ids, mark_read=False, account_id=DEFAULT_ACCOUNT):
+    """
+    Sends the drafts of many threads with batched drafts().send calls, optionally marking
+    the sent threads as read.
+
+    Drafts are found in the draft index (reconciling once if any thread is missing) and sent
+    in batch requests of DRAFT_SEND_BATCH_SIZE, each paced by the send rate limiter. A draft
+    that no longer exists is reported as not found rather than looked up again.
+
+    Returns:
+        One result per distinct thread, in order, with 'thread_id', 'status' ('sent', 'not_found' or
+        'failed'), 'draft_id', 'message_id', 'marked_read' and 'error'.
+    """
+    service = get_gmail_service(account_id)
+    results = {thread_id: {'thread_id': thread_id, 'status': 'not_found', 'draft_id': None, 'message_id': None,
+                           'marked_read': False, 'error': None} for thread_id in thread_ids}
+    entries = {thread_id: draft_index.get(account_id, thread_id) for thread_id in results}
+    if None in entries.values() and draft_index.reconcile_if_stale(service, account_id):
+        entries = {thread_id: entry or draft_index.get(account_id, thread_id) for thread_id, entry in entries.items()}
+
+    requests = {}
+    for thread_id, entry in entries.items():
+        if entry is None:
+            results[thread_id]['error'] = f"No draft found for thread ID: {thread_id}"
+            continue
+        results[thread_id]['draft_id'] = entry['draft_id']
+        requests[thread_id] = lambda draft_id=entry['draft_id']: service.users().drafts().send(
+            userId='me', body={'id': draft_id})
+
+    pending = list(requests)
+    batch_size = max(1, min(DRAFT_SEND_BATCH_SIZE, int(outbox.rate_limiter.capacity)))
+    sent_threads = []
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        outbox.rate_limiter.acquire(len(chunk))
+        with metrics.span("email.send_batch", kind='draft', size=len(chunk)):
+            sent, errors = execute_batch(service, {thread_id: requests[thread_id] for thread_id in chunk},
+                                         batch_size=batch_size)
+        for thread_id, response in sent.items():
+            result = results[thread_id]
+            result.update(status='sent', message_id=response.get('id'))
+            draft_index.remove(account_id, thread_id, result['draft_id'])
+            metrics.emails_sent.inc(kind='draft', status='sent')
+            sent_threads.append(thread_id)
+        for thread_id, error in errors.items():
+            result = results[thread_id]
+            if getattr(getattr(error, 'resp', None), 'status', None) == 404:
+                result.update(status='not_found', error=f"Draft no longer exists: {result['draft_id']}")
+                draft_index.remove(account_id, thread_id, result['draft_id'])
+            else:
+                result.update(status='failed', error=f"Gmail API error occurred: {error}")
+                metrics.emails_sent.inc(kind='draft', status='error')
+
+    if mark_read and sent_threads:
+        marked, errors = execute_batch(service, {
+            thread_id: lambda thread_id=thread_id: service.users().threads().modify(
+                userId='me', id=thread_id, body={'removeLabelIds': ['UNREAD']})
+            for thread_id in sent_threads
+        })
+        for thread_id in marked:
+            results[thread_id]['marked_read'] = True
+        threads_read(account_id, marked)
+        for thread_id, error in errors.items():
+            results[thread_id]['error'] = f"Draft sent but marking as read failed: {error}"
+
+    return [results[thread_id] for thread_id in results]
+
+def deliver_message(thread_id, response_content, to_address, subject, account_id=DEFAULT_ACCOUNT):
+    """
+    Sends a new email message in a thread.
+
+    Raises:
+        HttpError: If the Gmail API call fails.
+    """
+    service = get_gmail_service(account_id)
+
+    message = EmailMessage()
+    message.set_content(response_content)
+    message["To"] = to_address
+    message["Subject"] = subject
+
+    encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+    send_message_body = {
+        "raw": encoded_message,
+        "threadId": thread_id
+    }
+
+    sent_message = service.users().messages().send(userId="me", body=send_message_body).execute()
+    return {'message_id': sent_message.get('id')}
+
+def mark_thread_read(thread_id, account_id=DEFAULT_ACCOUNT):
+    """Removes the UNREAD label from every message in a thread."""
+    service = get_gmail_service(account_id)
+    service.users().threads().modify(
+        userId='me',
+        id=thread_id,
+        body={'removeLabelIds': ['UNREAD']}
+    ).execute()
+    threads_read(account_id, [thread_id])
+    return {'marked_read': thread_id}
+
+def _instrumented(kind, fn):
+    """Wraps a delivery step so each attempt is counted in emails_sent_total."""
+    def step(payload):
+        try:
+            with metrics.span("email.send", kind=kind, thread_id=payload.get('thread_id')):
+                result = fn(payload)
+        except Exception:
+            metrics.emails_sent.inc(kind=kind, status='error')
+            raise
+        metrics.emails_sent.inc(kind=kind, status='sent')
+        return result
+    return step
+
+def _account(payload):
+    # Jobs queued before accounts existed carry no account_id.
+    return payload.get('account_id', DEFAULT_ACCOUNT)
+
+def _mark_read_step(payload):
+    return mark_thread_read(payload['thread_id'], _account(payload)) if payload.get('mark_read') else None
+
+outbox = SendQueue(handlers={
+    'message': [
+        Step(_instrumented('message', lambda p: deliver_message(
+                 p['thread_id'], p['response_content'], p['to_address'], p['subject'], _account(p))),
+             idempotent=False, rate_limited=True),
+        Step(_mark_read_step, idempotent=True),
+    ],
+    'draft': [
+        Step(_instrumented('draft', lambda p: deliver_draft_by_thread_id(p['thread_id'], _account(p))),
+             idempotent=False, rate_limited=True),
+        Step(_mark_read_step, idempotent=True),
+    ],
+    # Repeating the batch is safe: Gmail deletes sent drafts, so a second send finds nothing.
+    'draft_batch': [
+        Step(lambda p: deliver_drafts_by_thread_ids(p['thread_ids'], p.get('mark_read', False), _account(p)),
+             idempotent=True),
+    ],
+})
+metrics.register_queue('send', lambda: outbox.stats(recent=0)['depth'])
+
+# An identical message to a thread queued within this many seconds of an earlier one is
+# treated as a resubmitted request; later ones (e.g. the same canned reply) are sent again.
+MESSAGE_DEDUPE_SECONDS = float(os.getenv("MESSAGE_DEDUPE_SECONDS", "600"))
+
+def _default_key(kind, *parts):
+    return hashlib.sha256("\x1f".join((kind,) + parts).encode()).hexdigest()
+
+def _scoped_key(account_id, key):
+    # Default-account keys are unchanged, so jobs queued before accounts existed still dedupe.
+    return key if account_id == DEFAULT_ACCOUNT else f"{account_id}:{key}"
+
+def queue_message(thread_id, response_content, to_address, subject, mark_read=False, idempotency_key=None,
+                  account_id=DEFAULT_ACCOUNT):
+    """
+    Queues a new email message for sending from an account and returns the queue job.
+
+    Without an idempotency key, a message with the same thread, recipient, subject and
+    content queued less than MESSAGE_DEDUPE_SECONDS earlier is returned instead, so a
+    resubmitted reply is not sent again, while the same reply sent to the thread later is
+    queued anew. Clients retrying across a longer span should pass their own
+    idempotency_key. Keys are scoped to the account.
+    """
+    outbox.start()
+    payload = {
+        'thread_id': thread_id,
+        'response_content': response_content,
+        'to_address': to_address,
+        'subject': subject,
+        'mark_read': mark_read,
+        'account_id': account_id,
+    }
+    if idempotency_key:
+        return outbox.enqueue('message', payload, _scoped_key(account_id, idempotency_key))
+    content_key = _scoped_key(account_id, _default_key('message', thread_id, to_address, subject, response_content))
+    return outbox.enqueue('message', payload, f"{content_key}:{uuid.uuid4().hex}",
+                          dedupe_key=content_key, dedupe_seconds=MESSAGE_DEDUPE_SECONDS)
+
+def queue_draft_send(thread_id, mark_read=False, idempotency_key=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Queues sending the draft of a thread from an account and returns the queue job.
+
+    Without an explicit idempotency key every call gets its own job: Gmail deletes a draft
+    once it is sent, so a repeated send of the same draft fails instead of sending twice.
+    """
+    outbox.start()
+    key = _scoped_key(account_id, idempotency_key or _default_key('draft', thread_id, uuid.uuid4().hex))
+    return outbox.enqueue('draft', {'thread_id': thread_id, 'mark_read': mark_read, 'account_id': account_id}, key)
+
+def queue_drafts_send(thread_ids, mark_read=False, idempotency_key=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Queues sending the drafts of many threads as one batch job and returns the queue job.
+    The job's result lists the outcome for each thread (see deliver_drafts_by_thread_ids).
+    """
+    outbox.start()
+    key = _scoped_key(account_id, idempotency_key or _default_key('draft_batch', *thread_ids, uuid.uuid4().hex))
+    payload = {'thread_ids': list(thread_ids), 'mark_read': mark_read, 'account_id': account_id}
+    return outbox.enqueue('draft_batch', payload, key)
+
+def send_draft_by_thread_id(thread_id):
+    """
+    Queues the draft associated with a specific thread ID for sending.
+    """
+    try:
+        job = queue_draft_send(thread_id)
+        return f"Queued draft for thread ID: {thread_id} (send job {job['id']}, status {job['status']})"
     except Exception as e:
         return f"An unhandled error occurred: {str(e)}"
 
 def send_message(thread_id, response_content, to_address, subject):
     """
-    Sends a new email message (alternative to sending a draft).
+    Queues a new email message for sending (alternative to sending a draft).
     """
-    import base64
-    from email.message import EmailMessage
-    
     try:
-        service = get_gmail_service()
-        
-        message = EmailMessage()
-        message.set_content(response_content)
-        message["To"] = to_address
-        message["Subject"] = subject
-        
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        
-        send_message_body = {
-            "raw": encoded_message,
-            "threadId": thread_id
-        }
-        
-        sent_message = service.users().messages().send(userId="me", body=send_message_body).execute()
-        return f"Successfully sent email for thread ID: {thread_id}"
-    except HttpError as error:
-        return f"Gmail API error occurred: {error}"
+        job = queue_message(thread_id, response_content, to_address, subject)
+        return f"Queued email for thread ID: {thread_id} (send job {job['id']}, status {job['status']})"
     except Exception as e:
         return f"An unhandled error occurred: {str(e)}"
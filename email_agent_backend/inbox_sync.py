@@ -0,0 +1,194 @@
+import threading
+from googleapiclient.errors import HttpError
+from accounts import DEFAULT_ACCOUNT
+from email_fetcher_tool import batch_get_threads, iter_unread_threads, parse_thread
+
+# Labels that exclude a thread from the unread inbox view (mirrors UNREAD_QUERY).
+EXCLUDED_CATEGORY_LABELS = {'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES'}
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+# Callbacks receiving (account_id, thread_ids) when this service marks threads as read.
+_read_callbacks = []
+
+def on_threads_read(callback):
+    """Registers a callback called with (account_id, thread_ids) whenever threads_read() reports threads."""
+    _read_callbacks.append(callback)
+
+def threads_read(account_id, thread_ids):
+    """
+    Reports threads this service has just marked as read (after a send or a saved draft),
+    so stores can drop them before the next history sync sees the label change.
+    """
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return
+    for callback in _read_callbacks:
+        try:
+            callback(account_id, thread_ids)
+        except Exception as e:
+            print(f"Read-thread callback failed: {e}")
+
+def thread_is_unread_inbox(full_thread):
+    """
+    Returns True if a thread resource still matches the unread inbox query,
+    i.e. at least one message is unread, in the inbox and not in an excluded category.
+    """
+    for message in full_thread.get('messages', []):
+        labels = set(message.get('labelIds', []))
+        if 'UNREAD' in labels and 'INBOX' in labels and not labels & EXCLUDED_CATEGORY_LABELS:
+            return True
+    return False
+
+def _not_found(error):
+    return getattr(getattr(error, 'resp', None), 'status', None) == 404
+
+def _activity_key(thread):
+    # A thread's historyId grows with every change to it, so it orders threads by recent activity.
+    return int(thread.get('history_id') or 0)
+
+class InboxSync:
+    """
+    Keeps a local store of unread inbox threads in step with Gmail.
+
+    The first sync performs a full scan and records the mailbox historyId. Later syncs call
+    users().history().list from that historyId and only re-fetch threads touched by the
+    returned changes (new messages, deletions, read/unread and other label flips).
+    A full rescan happens again only when Gmail reports the stored historyId as expired.
+
+    A changed thread that cannot be re-fetched is dropped only if Gmail no longer has it
+    (404) or the history shows it was marked as read; otherwise its stored entry is kept
+    and the historyId is not advanced, so the next sync replays the change.
+
+    The store is replaced rather than mutated on each sync, so snapshot() never waits for a
+    sync in progress. `last_changed` holds the IDs of the threads touched by the latest sync.
+
+    Args:
+        account_id: The account whose mailbox is synced (scopes its thread cache entries).
+    """
+
+    def __init__(self, account_id=DEFAULT_ACCOUNT):
+        self.account_id = account_id
+        self.history_id = None
+        self.last_changed = []
+        self._threads = {}
+        self._snapshot = []
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def sync(self, service):
+        """
+        Brings the local thread store up to date and returns the unread threads, newest first.
+
+        Args:
+            service: Authorized Gmail API service instance.
+
+        Returns:
+            A list of thread dictionaries as produced by parse_thread.
+        """
+        with self._lock:
+            if self.history_id is None:
+                self._full_sync(service)
+            else:
+                try:
+                    self._incremental_sync(service)
+                except HttpError as error:
+                    if getattr(error.resp, 'status', None) != 404:
+                        raise
+                    print(f"History {self.history_id} has expired, performing a full resync...")
+                    self._full_sync(service)
+            return self.snapshot()
+
+    def snapshot(self):
+        """Returns the current unread threads without contacting Gmail."""
+        return list(self._snapshot)
+
+    def get(self, thread_id):
+        """Returns a stored unread thread, or None."""
+        return self._threads.get(thread_id)
+
+    def discard(self, thread_ids):
+        """
+        Drops threads from the store without contacting Gmail, e.g. once they have been
+        marked as read locally. The next sync still applies the label change from history.
+        """
+        with self._publish_lock:
+            threads = {thread_id: thread for thread_id, thread in self._threads.items() if thread_id not in thread_ids}
+            if len(threads) != len(self._threads):
+                self._snapshot = sorted(threads.values(), key=_activity_key, reverse=True)
+                self._threads = threads
+
+    def reset(self):
+        """Drops the local store so the next sync performs a full scan."""
+        with self._lock:
+            self.history_id = None
+            self.last_changed = []
+            self._publish({})
+
+    def _publish(self, threads):
+        with self._publish_lock:
+            self._snapshot = sorted(threads.values(), key=_activity_key, reverse=True)
+            self._threads = threads
+
+    def _full_sync(self, service):
+        print("Performing full inbox sync...")
+        # Record the historyId before scanning so changes made during the scan are replayed next time.
+        history_id = service.users().getProfile(userId='me').execute()['historyId']
+
+        threads = {thread['thread_id']: thread for thread in iter_unread_threads(service, account_id=self.account_id)}
+        self.last_changed = list(threads)
+        self._publish(threads)
+        self.history_id = history_id
+
+    def _incremental_sync(self, service):
+        changed_thread_ids = []
+        # Threads whose latest UNREAD change in the history is a removal.
+        read_thread_ids = set()
+        latest_history_id = self.history_id
+        page_token = None
+
+        while True:
+            response = service.users().history().list(
+                userId='me',
+                startHistoryId=self.history_id,
+                historyTypes=HISTORY_TYPES,
+                pageToken=page_token
+            ).execute()
+
+            for record in response.get('history', []):
+                for key in ('messagesAdded', 'messagesDeleted', 'labelsAdded', 'labelsRemoved'):
+                    for change in record.get(key, []):
+                        thread_id = change['message']['threadId']
+                        changed_thread_ids.append(thread_id)
+                        if key == 'labelsRemoved' and 'UNREAD' in change.get('labelIds', []):
+                            read_thread_ids.add(thread_id)
+                        elif key == 'messagesAdded' or 'UNREAD' in change.get('labelIds', []):
+                            read_thread_ids.discard(thread_id)
+
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        changed_thread_ids = list(dict.fromkeys(changed_thread_ids))
+        if changed_thread_ids:
+            print(f"Applying changes to {len(changed_thread_ids)} threads since history {self.history_id}")
+            errors = {}
+            threads_by_id = batch_get_threads(service, changed_thread_ids, errors=errors)
+
+            threads = dict(self._threads)
+            for thread_id in changed_thread_ids:
+                full_thread = threads_by_id.get(thread_id)
+                if full_thread is not None and thread_is_unread_inbox(full_thread):
+                    threads[thread_id] = parse_thread(thread_id, full_thread, self.account_id)
+                elif full_thread is not None or _not_found(errors.get(thread_id)) or thread_id in read_thread_ids:
+                    threads.pop(thread_id, None)
+            self._publish(threads)
+
+            failed = [thread_id for thread_id, error in errors.items() if not _not_found(error)]
+            if failed:
+                print(f"Could not re-fetch {len(failed)} changed threads, keeping history {self.history_id} for the next sync")
+                self.last_changed = [thread_id for thread_id in changed_thread_ids if thread_id not in errors]
+                return
+
+        self.last_changed = changed_thread_ids
+        self.history_id = latest_history_id
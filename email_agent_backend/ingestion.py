@@ -0,0 +1,224 @@
+"""
+Background ingestion of new mail into the local inbox store.
+
+The daemon keeps an InboxSync store hot so /emails is answered from memory. With a Pub/Sub
+topic configured it subscribes to Gmail push notifications through users().watch and syncs
+when the /gmail/push webhook reports a new historyId, with a slow safety poll in case a
+notification is lost. Without a topic it polls history().list on an adaptive interval that
+shortens while mail is arriving and backs off while the mailbox is idle.
+
+The Gmail service comes from an injectable factory, so the daemon runs offline against
+benchmarks.fake_gmail.FakeGmailService:
+
+    python -m ingestion --stub 20
+"""
+import os
+import threading
+import time
+
+import metrics
+
+# Pub/Sub topic ("projects/<project>/topics/<topic>") for users().watch; empty means poll.
+GMAIL_PUBSUB_TOPIC = os.getenv("GMAIL_PUBSUB_TOPIC", "")
+# Adaptive polling bounds in seconds, and the growth factor applied after an idle poll.
+INGESTION_MIN_INTERVAL = float(os.getenv("INGESTION_MIN_INTERVAL", "5"))
+INGESTION_MAX_INTERVAL = float(os.getenv("INGESTION_MAX_INTERVAL", "120"))
+INGESTION_BACKOFF = 2.0
+# Safety poll interval while push notifications are active.
+INGESTION_PUSH_POLL_INTERVAL = float(os.getenv("INGESTION_PUSH_POLL_INTERVAL", "600"))
+# Notifications arriving within this many seconds are handled by one sync.
+INGESTION_PUSH_DEBOUNCE = float(os.getenv("INGESTION_PUSH_DEBOUNCE", "1"))
+# Gmail watches expire after 7 days; they are renewed once less than this remains.
+WATCH_RENEW_MARGIN = 24 * 3600
+
+class IngestionDaemon:
+    """
+    Keeps an InboxSync store current from a background thread.
+
+    Args:
+        inbox_sync: The InboxSync store to keep hot.
+        service_factory: Zero-argument callable returning a Gmail service (real or fake).
+            It is called on the daemon thread.
+        topic: Pub/Sub topic for users().watch; None or empty selects polling.
+        on_new_threads: Optional callback receiving the threads added or updated by an
+            incremental sync (not by the initial full sync), e.g. to pre-generate drafts.
+        min_interval, max_interval: Adaptive polling bounds in seconds.
+    """
+
+    def __init__(self, inbox_sync, service_factory, topic=None, on_new_threads=None,
+                 min_interval=None, max_interval=None):
+        self.inbox_sync = inbox_sync
+        self.service_factory = service_factory
+        self.topic = GMAIL_PUBSUB_TOPIC if topic is None else topic
+        self.on_new_threads = on_new_threads
+        self.min_interval = min_interval or INGESTION_MIN_INTERVAL
+        self.max_interval = max(self.min_interval, max_interval or INGESTION_MAX_INTERVAL)
+        self.interval = self.min_interval
+        self.mode = 'push' if self.topic else 'poll'
+        self.watch_expiration = None
+        self.syncs = 0
+        self.errors = 0
+        self.notifications = 0
+        self.last_sync_at = None
+        self.last_sync_seconds = None
+        self.last_error = None
+        self._synced = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the daemon thread; the first sync runs immediately."""
+        if self.running:
+            return
+        self._stop.clear()
+        account_id = self.inbox_sync.account_id
+        self._thread = threading.Thread(target=self._run, name=f"ingestion-{account_id}", daemon=True)
+        self._thread.start()
+        print(f"Ingestion daemon for account {account_id} started in {self.mode} mode")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_until_synced(self, timeout=None):
+        """Blocks until the first sync has completed; returns False on timeout."""
+        return self._synced.wait(timeout)
+
+    @property
+    def is_hot(self):
+        """True once the store has been filled and the daemon is keeping it current."""
+        return self.running and self._synced.is_set()
+
+    def notify(self, history_id=None):
+        """
+        Signals that the mailbox changed (a push notification or a local send/modify).
+        Notifications for history the store has already seen are ignored.
+        """
+        self.notifications += 1
+        known = self.inbox_sync.history_id
+        if history_id is not None and known is not None and int(history_id) <= int(known):
+            return
+        self._wake.set()
+
+    def status(self):
+        return {
+            'running': self.running,
+            'mode': self.mode,
+            'interval': self.interval,
+            'history_id': self.inbox_sync.history_id,
+            'threads': len(self.inbox_sync.snapshot()),
+            'syncs': self.syncs,
+            'errors': self.errors,
+            'notifications': self.notifications,
+            'last_sync_at': self.last_sync_at,
+            'last_sync_seconds': self.last_sync_seconds,
+            'last_changed': len(self.inbox_sync.last_changed),
+            'last_error': self.last_error,
+            'watch_expiration': self.watch_expiration,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                service = self.service_factory()
+                if self.mode == 'push':
+                    self._ensure_watch(service)
+                changed = self._sync(service)
+                self._adapt(changed)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                self.interval = self.max_interval
+                print(f"Ingestion sync failed, retrying in {self.interval:.0f}s: {e}")
+
+            woken = self._wake.wait(self.interval)
+            self._wake.clear()
+            if woken and not self._stop.is_set():
+                # Let a burst of notifications settle into one sync.
+                self._stop.wait(INGESTION_PUSH_DEBOUNCE)
+                self._wake.clear()
+
+    def _sync(self, service):
+        initial = self.inbox_sync.history_id is None
+        start = time.perf_counter()
+        self.inbox_sync.sync(service)
+        self.last_sync_seconds = time.perf_counter() - start
+        metrics.stage_latency.observe(self.last_sync_seconds, stage='inbox_sync')
+        self.last_sync_at = time.time()
+        self.syncs += 1
+        self._synced.set()
+
+        changed = self.inbox_sync.last_changed
+        if changed and not initial and self.on_new_threads is not None:
+            threads = [thread for thread in (self.inbox_sync.get(thread_id) for thread_id in changed) if thread]
+            if threads:
+                try:
+                    self.on_new_threads(threads)
+                except Exception as e:
+                    print(f"Ingestion callback failed: {e}")
+        return len(changed)
+
+    def _adapt(self, changed):
+        if self.mode == 'push':
+            self.interval = INGESTION_PUSH_POLL_INTERVAL
+        elif changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * INGESTION_BACKOFF)
+
+    def _ensure_watch(self, service):
+        now_ms = time.time() * 1000
+        if self.watch_expiration is not None and self.watch_expiration - now_ms > WATCH_RENEW_MARGIN * 1000:
+            return
+        try:
+            response = service.users().watch(userId='me', body={
+                'topicName': self.topic,
+                'labelIds': ['INBOX'],
+                'labelFilterBehavior': 'include',
+            }).execute()
+            self.watch_expiration = int(response['expiration'])
+            print(f"Gmail watch active on {self.topic} until {time.ctime(self.watch_expiration / 1000)}")
+        except Exception as e:
+            print(f"Gmail watch failed, falling back to polling: {e}")
+            self.mode = 'poll'
+            self.interval = self.min_interval
+
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description="Runs the ingestion daemon against Gmail or a local stub.")
+    parser.add_argument('--stub', type=int, metavar='THREADS', help="Use an in-memory Gmail stub with this many threads")
+    parser.add_argument('--new-mail-every', type=float, default=10, help="Stub only: seconds between new messages")
+    parser.add_argument('--duration', type=float, default=60)
+    args = parser.parse_args()
+
+    from inbox_sync import InboxSync
+    if args.stub is not None:
+        from benchmarks.fake_gmail import FakeGmailService
+        stub = FakeGmailService.with_synthetic_inbox(args.stub)
+        factory = lambda: stub
+    else:
+        from email_fetcher_tool import get_gmail_service
+        stub, factory = None, get_gmail_service
+
+    daemon = IngestionDaemon(InboxSync(), factory,
+                             on_new_threads=lambda threads: print(f"New mail in {len(threads)} threads"))
+    daemon.start()
+    deadline = time.time() + args.duration
+    while time.time() < deadline:
+        time.sleep(args.new_mail_every if stub else 1)
+        if stub is not None:
+            thread_id = f"t{random.randrange(args.stub + 5):05d}"
+            stub.add_message(thread_id, "Customer <c@example.com>", "Follow-up", "Any update on my question?")
+            print(f"Stub delivered a message to {thread_id}; next poll in {daemon.interval:.0f}s")
+    print(daemon.status())
+    daemon.stop()
@@ -0,0 +1,224 @@
+"""
+Scheduling and model routing for LLM calls.
+
+LLMScheduler admits calls in priority order (interactive requests before bulk background
+jobs) under a concurrency limit that adapts AIMD-style to the API quota: every success
+raises the limit a little, a quota or overload error (429/503) halves it and the call is
+retried after a backoff, so bursts queue up instead of failing.
+
+ModelRouter sends short, simple inquiries to a cheaper and faster model tier
+(GEMINI_FAST_MODEL) and everything else to the main model (GEMINI_MODEL). RAGAgent
+escalates a fast-tier answer to the main model when it is not grounded in the knowledge base.
+"""
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Priorities: lower runs first.
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Model tiers.
+FAST = 'fast'
+STRONG = 'strong'
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "4"))
+# Retries of a call rejected for quota or overload, with exponential backoff.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = 30.0
+
+# Cheaper model for simple inquiries; empty disables tiering.
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "")
+# Inquiries up to this many words (subject and thread) may use the fast tier...
+LLM_FAST_MAX_WORDS = int(os.getenv("LLM_FAST_MAX_WORDS", "120"))
+# ...unless they mention one of these topics.
+LLM_STRONG_KEYWORDS = os.getenv(
+    "LLM_STRONG_KEYWORDS", "refund,complaint,cancel,cancellation,legal,lawyer,chargeback,dispute,urgent,escalate")
+
+_WORDS = re.compile(r"\w+")
+
+def is_overload_error(error):
+    """True for quota (429 / RESOURCE_EXHAUSTED) and overload (503 / UNAVAILABLE) API errors."""
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    status = str(getattr(error, 'status', '') or '')
+    return code in (429, 503) or status in ('RESOURCE_EXHAUSTED', 'UNAVAILABLE')
+
+class LLMScheduler:
+    """
+    A priority queue in front of the LLM with an adaptive (AIMD) concurrency limit.
+
+    Each successful call raises the limit by 1/limit, i.e. by about one per limit's worth of
+    calls. An overload error halves it, at most once per window: errors from calls that
+    started before the last decrease do not decrease it again.
+
+    Args:
+        max_concurrency: Upper bound of the limit.
+        min_concurrency: Lower bound of the limit.
+        initial_concurrency: Starting limit.
+        max_retries: Retries of a call rejected for quota or overload.
+        backoff_base: Base of the exponential retry backoff, in seconds.
+    """
+
+    def __init__(self, max_concurrency=None, min_concurrency=None, initial_concurrency=None, max_retries=None,
+                 backoff_base=None):
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.min_concurrency = min_concurrency or LLM_MIN_CONCURRENCY
+        initial = initial_concurrency or LLM_INITIAL_CONCURRENCY
+        self.limit = float(min(self.max_concurrency, max(self.min_concurrency, initial)))
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = LLM_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.in_flight = 0
+        self.counters = {'completed': 0, 'overloaded': 0, 'failed': 0, 'retried': 0, 'decreases': 0}
+        self._waits = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """
+        Waits for a slot in priority order and holds it for the block. The block's outcome
+        adjusts the limit: success raises it, an overload error lowers it.
+        """
+        started = self._acquire(priority)
+        outcome = 'cancelled'
+        try:
+            yield
+            outcome = 'completed'
+        except Exception as e:
+            outcome = 'overloaded' if is_overload_error(e) else 'failed'
+            raise
+        finally:
+            self._release(started, outcome)
+
+    def retry_delay(self, error, attempt):
+        """Returns the seconds to wait before retrying a call that failed on `attempt`, or None."""
+        if not is_overload_error(error) or attempt > self.max_retries:
+            return None
+        with self._lock:
+            self.counters['retried'] += 1
+        return min(LLM_BACKOFF_MAX, self.backoff_base * 2 ** (attempt - 1)) + random.uniform(0, self.backoff_base)
+
+    def run(self, fn, priority=INTERACTIVE):
+        """Runs `fn()` in a slot, retrying quota and overload errors with backoff."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.slot(priority):
+                    return fn()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                print(f"LLM call rejected ({e}), retrying in {delay:.1f}s at concurrency {int(self.limit)}")
+                time.sleep(delay)
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self._queue)
+
+    def stats(self):
+        """Returns the current limit, running and queued calls, outcome counts and mean queue wait by priority."""
+        with self._lock:
+            waits = {name: round(total / count, 4) for name, (count, total) in self._waits.items()}
+            return {'limit': round(self.limit, 2), 'in_flight': self.in_flight, 'queued': len(self._queue),
+                    **self.counters, 'mean_queue_wait': waits}
+
+    def _acquire(self, priority):
+        enqueued = time.perf_counter()
+        with self._lock:
+            if not self._queue and self.in_flight < self._capacity():
+                self.in_flight += 1
+                ready = None
+            else:
+                ready = threading.Event()
+                heapq.heappush(self._queue, (priority, next(self._seq), ready))
+        if ready is not None:
+            # _dispatch takes the slot on our behalf before setting the event.
+            ready.wait()
+        waited = time.perf_counter() - enqueued
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        metrics.llm_queue_wait.observe(waited, priority=name)
+        with self._lock:
+            count, total = self._waits.get(name, (0, 0.0))
+            self._waits[name] = (count + 1, total + waited)
+        return time.monotonic()
+
+    def _release(self, started, outcome):
+        with self._lock:
+            self.in_flight -= 1
+            self.counters[outcome] = self.counters.get(outcome, 0) + 1
+            if outcome == 'completed':
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            elif outcome == 'overloaded' and started >= self._decreased_at and self.limit > self.min_concurrency:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._decreased_at = time.monotonic()
+                self.counters['decreases'] += 1
+            self._dispatch()
+
+    def _capacity(self):
+        # Caller holds the lock.
+        return max(self.min_concurrency, int(self.limit))
+
+    def _dispatch(self):
+        # Caller holds the lock.
+        while self._queue and self.in_flight < self._capacity():
+            _, _, ready = heapq.heappop(self._queue)
+            self.in_flight += 1
+            ready.set()
+
+class ModelRouter:
+    """
+    Chooses the model tier of a call from the inquiry text.
+
+    Short inquiries without any of the `keywords` go to `fast_model`; longer threads and
+    sensitive topics go to `strong_model`. Without a fast model every call uses the strong one.
+
+    Args:
+        strong_model: The main model.
+        fast_model: The cheaper model, or None to disable tiering.
+        max_words: Longest inquiry (in words) routed to the fast tier.
+        keywords: Comma-separated words that always route to the strong tier.
+    """
+
+    def __init__(self, strong_model, fast_model=None, max_words=None, keywords=None):
+        self.strong_model = strong_model
+        self.fast_model = GEMINI_FAST_MODEL if fast_model is None else fast_model
+        self.max_words = max_words or LLM_FAST_MAX_WORDS
+        keywords = LLM_STRONG_KEYWORDS if keywords is None else keywords
+        self.keywords = {word.strip().lower() for word in keywords.split(',') if word.strip()}
+
+    def model(self, tier):
+        return self.fast_model if tier == FAST else self.strong_model
+
+    def route(self, text):
+        """Returns (tier, reason) for an inquiry."""
+        if not self.fast_model or self.fast_model == self.strong_model:
+            return STRONG, 'single_tier'
+        words = _WORDS.findall(text.lower())
+        if len(words) > self.max_words:
+            return STRONG, 'long'
+        if self.keywords.intersection(words):
+            return STRONG, 'keyword'
+        return FAST, 'simple'
+
+# One scheduler for every agent: they share the API key and therefore the quota.
+llm_scheduler = LLMScheduler()
+
+metrics.register_queue('llm', llm_scheduler.queue_depth)
+metrics.registry.callback("llm_concurrency_limit", "Current adaptive LLM concurrency limit.",
+                          lambda: llm_scheduler.limit)
+metrics.registry.callback("llm_in_flight", "LLM calls currently running.", lambda: llm_scheduler.in_flight)
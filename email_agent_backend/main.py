@@ -1,21 +1,74 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 import json
+import logging
+import base64
 import time
+import asyncio
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from googleapiclient.errors import HttpError
 
-from email_fetcher_tool import fetch_unread_threads, get_gmail_service, read_unread_threads
+from email_fetcher_tool import (
+    fetch_unread_threads, get_gmail_service, read_unread_threads, iter_unread_threads, parse_thread, batch_get_threads,
+    iter_unread_thread_summaries, parse_thread_summary, read_thread, THREAD_HEADERS_PROJECTION
+)
+from accounts import DEFAULT_ACCOUNT, TenantPool, account_registry
 from draft_generator_tool import create_drafts_from_responses
-from email_sender import send_message
-from agent import rag_llm as llm
+from email_sender import queue_drafts_send, queue_message, outbox
+from inbox_sync import InboxSync, on_threads_read
+from thread_cache import thread_cache
+from response_cache import ResponseCache, response_cache
+from draft_jobs import DraftJobManager
+from ingestion import IngestionDaemon
+from prompt_builder import PromptBuilder, split_history
+from shared_state import shared_state
+from single_flight import SingleFlight
+from agent import rag_llm as llm, rag_agents
+from llm_scheduler import BULK, INTERACTIVE, is_overload_error, llm_scheduler
+import metrics
+from compression import CompressionMiddleware
 
 load_dotenv()
 
+# LOG_LEVEL=DEBUG also logs every fetched thread body (see iter_unread_threads)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+# Size of the first threads().list page used by /emails/stream, kept small so the
+# first threads reach the browser quickly.
+STREAM_FIRST_PAGE_SIZE = int(os.getenv("STREAM_FIRST_PAGE_SIZE", "10"))
+# Responses smaller than this are sent uncompressed.
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+# Vite puts a content hash in every file name under /assets, so they never change in place.
+ASSETS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Blocking Gmail and LLM calls run on a bounded thread pool so they never stall the event loop.
+# Each endpoint is additionally capped so one slow endpoint cannot take every worker thread.
+API_WORKER_THREADS = int(os.getenv("API_WORKER_THREADS", "16"))
+executor = ThreadPoolExecutor(max_workers=API_WORKER_THREADS, thread_name_prefix="api-worker")
+endpoint_limits = {
+    "emails": asyncio.Semaphore(int(os.getenv("EMAILS_CONCURRENCY", "2"))),
+    "generate_draft": asyncio.Semaphore(int(os.getenv("GENERATE_DRAFT_CONCURRENCY", "8"))),
+    "send_email": asyncio.Semaphore(int(os.getenv("SEND_EMAIL_CONCURRENCY", "4"))),
+    "send_draft": asyncio.Semaphore(int(os.getenv("SEND_DRAFT_CONCURRENCY", "4"))),
+}
+
+async def run_blocking(endpoint, fn, *args, **kwargs):
+    """
+    Runs a blocking function on the shared worker pool, within the endpoint's concurrency limit.
+    """
+    async with endpoint_limits[endpoint]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
 app = FastAPI()
 
 # Enable CORS
@@ -27,9 +80,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON bodies (conversation histories); NDJSON and SSE streams are left as is.
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, compresslevel=COMPRESSION_LEVEL)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Counts and times every request by its route template (streaming bodies excluded)."""
+    start = time.perf_counter()
+    status = 500
+    with metrics.span(f"{request.method} {request.url.path}"):
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get('route')
+            # Label by template (/emails/{thread_id}) so per-thread paths do not create new series.
+            path = getattr(route, 'path', None) or 'unmatched'
+            if 'account_id' in request.path_params and not path.startswith('/accounts/'):
+                # Depending on the FastAPI version, routes included with a prefix may report
+                # the router's own path.
+                path = "/accounts/{account_id}" + path
+            metrics.http_requests.inc(route=path, method=request.method, status=status)
+            metrics.http_latency.observe(time.perf_counter() - start, route=path, method=request.method)
+
 # Detect frontend path
 current_dir = os.path.dirname(os.path.abspath(__file__))
-frontend_dist_path = os.path.join(os.path.dirname(current_dir), "frontend", "dist")
+frontend_dist_path = os.getenv("FRONTEND_DIST_PATH") or os.path.join(os.path.dirname(current_dir), "frontend", "dist")
+
+# Endpoints on `router` serve one account: the default account at the root and registered
+# accounts under /accounts/{account_id} (both are included at the end of this module).
+router = APIRouter()
+
+def current_account(request: Request) -> str:
+    """Resolves the account of a request from its /accounts/{account_id} prefix."""
+    account_id = request.path_params.get('account_id', DEFAULT_ACCOUNT)
+    if account_registry.get(account_id) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown account: {account_id}")
+    return account_id
 
 class ThreadResponse(BaseModel):
     thread_id: str
@@ -40,36 +128,170 @@ class EmailData(BaseModel):
     subject: str
     sender: str
     history: str
+    history_id: Optional[str] = None
+    customer_message: Optional[str] = None
+
+class EmailSummary(BaseModel):
+    thread_id: str
+    subject: str
+    sender: str
+    snippet: str
+    history_id: Optional[str] = None
+    message_count: int
+
+# Local unread-thread store kept current with Gmail history deltas
+inbox_sync = InboxSync()
+
+# Per-account state. The default account uses the module-level objects; other accounts get
+# a Tenant, created on first use and dropped when idle.
+def _inbox_sync(account_id):
+    return inbox_sync if account_id == DEFAULT_ACCOUNT else tenants.get(account_id).inbox_sync
+
+def _response_cache(account_id):
+    return response_cache if account_id == DEFAULT_ACCOUNT else tenants.get(account_id).response_cache
+
+def _draft_jobs(account_id):
+    return draft_jobs if account_id == DEFAULT_ACCOUNT else tenants.get(account_id).draft_jobs
+
+def _llm(account_id):
+    return llm if account_id == DEFAULT_ACCOUNT else rag_agents.get(account_id)
+
+def _ingestion(account_id):
+    return ingestion if account_id == DEFAULT_ACCOUNT else tenants.get(account_id).ingestion
+
+def _is_hot(account_id):
+    # A registered account's daemon starts when its tenant is loaded; until its first sync
+    # completes, requests sync on their own.
+    return _ingestion(account_id).is_hot
+
+def _sync_inbox(account_id=DEFAULT_ACCOUNT):
+    return _inbox_sync(account_id).sync(get_gmail_service(account_id))
+
+def _threads_etag(threads, *variant):
+    """
+    A weak ETag for a list of threads. A thread's content only changes together with its
+    historyId, so the thread and history IDs (plus the `variant` of the response, such as
+    its view) identify the whole response.
+    """
+    versions = list(variant) + [f"{thread['thread_id']}:{thread.get('history_id')}" for thread in threads]
+    return f'W/"{_content_hash(*versions)[:32]}"'
+
+def _not_modified(request: Request, etag):
+    """True if the request's If-None-Match matches `etag` (weak comparison)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def _validator_headers(threads, *variant):
+    # no-cache: clients may keep the response but revalidate it on every poll.
+    return {"ETag": _threads_etag(threads, *variant), "Cache-Control": "private, no-cache"}
+
+def _conditional(request: Request, response: Response, threads):
+    """
+    Sets the validator headers for a threads response and returns a 304 response if the
+    client's copy is current, or None to send `threads` as usual.
+    """
+    headers = _validator_headers(threads)
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+@router.get("/emails", response_model=List[EmailData])
+async def get_emails(request: Request, response: Response, refresh: bool = False,
+                     account_id: str = Depends(current_account)):
+    """
+    Returns the unread threads. Responses carry an ETag; a poll sending it back in
+    If-None-Match gets a 304 without a body while the inbox is unchanged.
+    """
+    # While the ingestion daemon keeps the store current, serve it from memory.
+    if _is_hot(account_id) and not refresh:
+        emails = _inbox_sync(account_id).snapshot()
+    else:
+        try:
+            emails = await run_blocking("emails", _sync_inbox, account_id)
+        except Exception as e:
+            print(f"Error fetching emails: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    return _conditional(request, response, emails) or emails
+
+def _summarize(thread):
+    """Builds an EmailSummary dict from a stored thread (which carries no Gmail snippet)."""
+    messages = split_history(thread['history'])
+    snippet = " ".join(messages[-1].split())[:200] if messages else ""
+    return {**thread, 'snippet': snippet, 'message_count': len(thread.get('message_ids') or messages)}
+
+@router.get("/emails/stream")
+async def stream_emails(request: Request, view: str = "full", account_id: str = Depends(current_account)):
+    """
+    Streams unread threads as newline-delimited JSON, one object per line, as each page of
+    the inbox is hydrated. view=full sends EmailData with the whole conversation;
+    view=summary sends EmailSummary (subject, sender and snippet only) and the history is
+    loaded on demand from /emails/{thread_id}.
+
+    When the account's store is kept current by ingestion, the response carries an ETag and
+    an unchanged inbox is answered with a 304; a stream hydrated from Gmail has none.
+    """
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+
+    if _is_hot(account_id):
+        # Served from the in-memory store kept current by the account's ingestion daemon.
+        threads = _inbox_sync(account_id).snapshot()
+        headers = _validator_headers(threads, view)
+        if _not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        if view == "summary":
+            lines = [json.dumps(EmailSummary(**_summarize(thread)).model_dump()) + "\n" for thread in threads]
+        else:
+            lines = [json.dumps(EmailData(**thread).model_dump()) + "\n" for thread in threads]
+        return StreamingResponse(iter(lines), media_type="application/x-ndjson", headers=headers)
 
-@app.get("/emails", response_model=List[EmailData])
-async def get_emails():
+    def generate():
+        try:
+            service = get_gmail_service(account_id)
+            if view == "summary":
+                for summary in iter_unread_thread_summaries(service, first_page_size=STREAM_FIRST_PAGE_SIZE,
+                                                            account_id=account_id):
+                    yield json.dumps(EmailSummary(**summary).model_dump()) + "\n"
+            else:
+                for thread in iter_unread_threads(service, first_page_size=STREAM_FIRST_PAGE_SIZE, account_id=account_id):
+                    yield json.dumps(EmailData(**thread).model_dump()) + "\n"
+        except Exception as e:
+            print(f"Error streaming emails: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def _read_thread(thread_id, history_id, account_id=DEFAULT_ACCOUNT):
+    return read_thread(get_gmail_service(account_id), thread_id, history_id=history_id, account_id=account_id)
+
+@router.get("/emails/{thread_id}", response_model=EmailData)
+async def get_email(request: Request, response: Response, thread_id: str, history_id: Optional[str] = None,
+                    account_id: str = Depends(current_account)):
+    """
+    Returns one thread with its full conversation history. Passing the history_id from the
+    list view serves an unchanged thread from the thread cache; like /emails, the response
+    carries an ETag and an unchanged thread is answered with a 304.
+    """
     try:
-        service = get_gmail_service()
-        emails = read_unread_threads(service)
-        return emails
+        thread = await run_blocking("emails", _read_thread, thread_id, history_id, account_id)
+        return _conditional(request, response, [thread]) or thread
+    except HttpError as e:
+        if getattr(e.resp, 'status', None) == 404:
+            raise HTTPException(status_code=404, detail=f"Unknown thread: {thread_id}")
+        print(f"Error fetching thread {thread_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        print(f"Error fetching emails: {e}")
+        print(f"Error fetching thread {thread_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate_draft")
-async def generate_draft(email: EmailData):
-    try:
-        print(f"Generating draft for thread: {email.thread_id}")
-        
-        # Show generating draft message and wait for 2 seconds
-        print("Generating Draft...")
-        time.sleep(2)
-
-        # Use RAG LLM for all questions with improved customer service prompt
-        prompt = f"""You are a professional customer service agent for Nexa Learn. You have access to the company's knowledge base and services through a file search tool.
-
-Your task: Respond to the following customer inquiry using ONLY the information from the company knowledge base provided via file search.
+# Static part of the customer service prompt, sent as the (cached) system instruction.
+DRAFT_INSTRUCTION = """You are a professional customer service agent for Nexa Learn. You have access to the company's knowledge base and services through a file search tool.
 
-Customer Email:
-Subject: {email.subject}
-From: {email.sender}
-Previous conversation history:
-{email.history}
+Your task: Respond to the customer inquiry in the user message using ONLY the information from the company knowledge base provided via file search.
 
 IMPORTANT INSTRUCTIONS:
 1. SEARCH the knowledge base for relevant information about: resume reviews, interviews, placement support, career guidance, company programs, and services
@@ -82,62 +304,515 @@ IMPORTANT INSTRUCTIONS:
 
 Generate a professional response to the customer's last message using the knowledge base.
 Return ONLY the reply text, no other formatting or explanations."""
-        
-        response = llm.call([{"role": "user", "content": prompt}])
+
+# Keeps long threads within the prompt token budget (PROMPT_TOKEN_BUDGET)
+draft_prompts = PromptBuilder(DRAFT_INSTRUCTION)
+
+def build_draft_prompt(email: EmailData):
+    """
+    Builds the customer service prompt for a thread: the static instruction plus the
+    thread fitted to the token budget (see prompt_builder.PromptBuilder.build).
+    """
+    with metrics.stage_latency.time(stage='prompt_build'):
+        return draft_prompts.build(email.subject, email.sender, email.history)
+
+def _draft_request(prompt):
+    """Returns the messages for the LLM and the response cache key for a built prompt."""
+    messages = [
+        {"role": "system", "content": prompt['instruction']},
+        {"role": "user", "content": prompt['content']},
+    ]
+    return messages, prompt['instruction'] + "\n\n" + prompt['content']
+
+def last_customer_message(email: EmailData):
+    """
+    Returns the newest message the customer wrote in a thread. Threads parsed before this was
+    recorded (or sent by clients without it) fall back to the newest message of the history.
+    """
+    return email.customer_message or email.history.split("\n---\n")[-1]
+
+def _cache_context(email: EmailData):
+    # Cached replies are only reused for near-duplicate messages from the same customer and subject.
+    return f"{email.sender}\x1f{email.subject}"
+
+# Concurrent identical requests (two tabs, a retrying client, a batch job racing the UI) share
+# one LLM call or Gmail write, also across worker processes. Sends are not reused after they
+# complete: the send queue's idempotency key already returns the existing job.
+draft_flights = SingleFlight('draft')
+save_draft_flights = SingleFlight('save_draft')
+send_flights = SingleFlight('send', result_ttl=0)
+
+def _content_hash(*parts):
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+def _report_usage(email, usage):
+    print(f"Prompt for thread {email.thread_id}: ~{usage['estimated_prompt_tokens']} tokens estimated, "
+          f"{usage['verbatim_messages']} verbatim / {usage['trimmed_messages']} trimmed / "
+          f"{usage['omitted_messages']} omitted messages, {usage['duplicate_paragraphs']} duplicate paragraphs dropped")
+
+def generate_draft_text(email: EmailData, usage=None, account_id=DEFAULT_ACCOUNT, priority=INTERACTIVE):
+    """
+    Generates a draft reply for a thread with the account's knowledge base, serving repeated
+    or near-duplicate inquiries from the account's response cache instead of calling the LLM.
+
+    If a `usage` dict is given it receives the prompt estimates and the token usage
+    reported by the model. Concurrent calls for the same thread and prompt share one LLM
+    call; the callers that waited for it get `usage['coalesced']` set. Background jobs pass
+    priority=BULK so interactive requests are scheduled first.
+    """
+    llm = _llm(account_id)
+    response_cache = _response_cache(account_id)
+    prompt = build_draft_prompt(email)
+    messages, cache_key = _draft_request(prompt)
+    message = last_customer_message(email)
+    context = _cache_context(email)
+    version = getattr(llm, 'knowledge_digest', None)
+    usage = {} if usage is None else usage
+    usage.update(prompt['usage'], response_cache_hit=False, coalesced=False)
+
+    cached = response_cache.get(cache_key, message, version=version, context=context)
+    if cached is not None:
+        print(f"Draft served from response cache for thread: {email.thread_id}")
+        usage['response_cache_hit'] = True
+        return cached
+
+    def call_llm():
+        _report_usage(email, prompt['usage'])
+        start = time.perf_counter()
+        response = llm.call(messages, query=f"{email.subject}\n{prompt['history']}", usage=usage, priority=priority)
+        # The knowledge base version is read again: the first call may have waited for it to load.
+        response_cache.put(cache_key, message, response, version=getattr(llm, 'knowledge_digest', None),
+                           latency=time.perf_counter() - start, context=context)
+        return {'draft': response, 'usage': usage}
+
+    key = f"{account_id}:{email.thread_id}:{_content_hash(version, cache_key)}"
+    result, shared = draft_flights.do(key, call_llm)
+    if shared:
+        print(f"Draft shared with a concurrent request for thread: {email.thread_id}")
+        usage.update(result['usage'], coalesced=True)
+    return result['draft']
+
+def stream_draft_text(email: EmailData, usage=None, account_id=DEFAULT_ACCOUNT):
+    """
+    Yields a draft reply in chunks as the LLM produces it. A cached draft, or one generated
+    by a concurrent request for the same thread and prompt, is yielded whole.
+    `usage` is filled as in generate_draft_text once the stream is exhausted.
+    """
+    llm = _llm(account_id)
+    response_cache = _response_cache(account_id)
+    prompt = build_draft_prompt(email)
+    messages, cache_key = _draft_request(prompt)
+    message = last_customer_message(email)
+    context = _cache_context(email)
+    version = getattr(llm, 'knowledge_digest', None)
+    usage = {} if usage is None else usage
+    usage.update(prompt['usage'], response_cache_hit=False, coalesced=False)
+
+    cached = response_cache.get(cache_key, message, version=version, context=context)
+    if cached is not None:
+        print(f"Draft served from response cache for thread: {email.thread_id}")
+        usage['response_cache_hit'] = True
+        yield cached
+        return
+
+    flight = draft_flights.begin(f"{account_id}:{email.thread_id}:{_content_hash(version, cache_key)}")
+    if not flight.leader:
+        result = flight.wait()
+        print(f"Draft shared with a concurrent request for thread: {email.thread_id}")
+        usage.update(result['usage'], coalesced=True)
+        yield result['draft']
+        return
+
+    try:
+        _report_usage(email, prompt['usage'])
+        start = time.perf_counter()
+        parts = []
+        for chunk in llm.call_stream(messages, query=f"{email.subject}\n{prompt['history']}", usage=usage):
+            parts.append(chunk)
+            yield chunk
+    except GeneratorExit:
+        # The client disconnected; requests waiting on this one get an error to retry on.
+        flight.fail(RuntimeError("The request generating this draft was cancelled, please retry"))
+        raise
+    except BaseException as e:
+        flight.fail(e)
+        raise
+    response = "".join(parts)
+    response_cache.put(cache_key, message, response, version=getattr(llm, 'knowledge_digest', None),
+                       latency=time.perf_counter() - start, context=context)
+    flight.finish({'draft': response, 'usage': usage})
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.post("/generate_draft")
+async def generate_draft(email: EmailData, account_id: str = Depends(current_account)):
+    try:
+        print(f"Generating draft for thread: {email.thread_id}")
+
+        usage = {}
+        response = await run_blocking("generate_draft", generate_draft_text, email, usage, account_id)
 
         print(f"Draft generated: {response[:50]}...")
-        return {"draft": response}
+        return {"draft": response, "usage": usage}
     except Exception as e:
+        if is_overload_error(e):
+            # The scheduler already retried with backoff; let the client retry later.
+            print(f"LLM quota exhausted generating draft for thread {email.thread_id}: {e}")
+            raise HTTPException(status_code=503, detail="The LLM is over quota, please retry shortly.",
+                                headers={"Retry-After": "30"})
         import traceback
         error_details = traceback.format_exc()
         print(f"Error generating draft: {error_details}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Background bulk draft generation, sharing the response cache with /generate_draft
+draft_jobs = DraftJobManager(generate=functools.partial(generate_draft_text, priority=BULK),
+                             save=create_drafts_from_responses, shared=shared_state)
+metrics.register_queue('draft_jobs', draft_jobs.queue_depth)
+
+class Tenant:
+    """
+    The state of a registered account: its inbox store and the ingestion daemon keeping it
+    current, its response cache and its batch draft jobs. The daemon runs while the tenant
+    is loaded.
+    """
+
+    def __init__(self, account_id):
+        self.account_id = account_id
+        self.inbox_sync = InboxSync(account_id)
+        self.response_cache = ResponseCache(shared=shared_state, namespace=account_id)
+        self.draft_jobs = DraftJobManager(
+            generate=functools.partial(generate_draft_text, account_id=account_id, priority=BULK),
+            save=functools.partial(create_drafts_from_responses, account_id=account_id),
+            shared=shared_state,
+            namespace=account_id,
+        )
+        self.ingestion = IngestionDaemon(
+            self.inbox_sync,
+            service_factory=functools.partial(get_gmail_service, account_id),
+            on_new_threads=functools.partial(_pregenerate_drafts, jobs=self.draft_jobs) if PREGENERATE_DRAFTS else None
+        )
+        if INGESTION_ENABLED:
+            self.ingestion.start()
+
+    def close(self):
+        self.ingestion.stop()
+        self.draft_jobs.executor.shutdown(wait=False)
+
+# Tenants with a running draft job are kept until it finishes.
+tenants = TenantPool(Tenant, in_use=lambda tenant: tenant.draft_jobs.queue_depth() > 0, on_evict=Tenant.close)
+
+# Background ingestion keeps each loaded account's inbox store hot (push via users().watch, or adaptive polling)
+INGESTION_ENABLED = os.getenv("INGESTION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Pre-generate drafts for threads that receive new mail, so opening them hits the response cache
+PREGENERATE_DRAFTS = os.getenv("PREGENERATE_DRAFTS", "false").lower() in ("1", "true", "yes")
+# Shared secret expected as ?token= on Pub/Sub push requests, if set
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN", "")
+
+def _pregenerate_drafts(threads, jobs=None):
+    job = (jobs or draft_jobs).start([EmailData(**thread) for thread in threads], save=False)
+    print(f"Pre-generating drafts for {len(threads)} updated threads (job {job.id})")
+
+ingestion = IngestionDaemon(
+    inbox_sync,
+    service_factory=lambda: get_gmail_service(),
+    on_new_threads=_pregenerate_drafts if PREGENERATE_DRAFTS else None
+)
+
+def _discard_read_threads(account_id, thread_ids):
+    # Threads marked read by a send or a saved draft leave the hot store at once, and the
+    # daemon syncs soon after to confirm the change from history.
+    if account_id == DEFAULT_ACCOUNT:
+        store, daemon = inbox_sync, ingestion
+    else:
+        tenant = tenants.peek(account_id)
+        if tenant is None:
+            return
+        store, daemon = tenant.inbox_sync, tenant.ingestion
+    store.discard(thread_ids)
+    daemon.notify()
+
+on_threads_read(_discard_read_threads)
+
+@app.on_event("startup")
+def start_background_work():
+    """
+    Starts the background work of the default account: loading its knowledge base, the
+    send queue workers (resuming jobs left by a previous run) and ingestion.
+    """
+    if llm is not None:
+        llm.start()
+    outbox.start()
+    if INGESTION_ENABLED:
+        ingestion.start()
+
+@app.on_event("shutdown")
+def stop_background_work():
+    ingestion.stop()
+    tenants.clear()
+    outbox.stop()
+
+@app.post("/gmail/push", status_code=204)
+async def gmail_push(request: Request, token: Optional[str] = None):
+    """
+    Pub/Sub push endpoint for Gmail watch notifications. Wakes the ingestion daemon, which
+    fetches the history since its last sync. Malformed messages are acknowledged and
+    dropped so Pub/Sub does not redeliver them.
+    """
+    if GMAIL_PUSH_TOKEN and token != GMAIL_PUSH_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    try:
+        envelope = await request.json()
+        notification = json.loads(base64.b64decode(envelope['message']['data']))
+        account = account_registry.find_by_email(notification.get('emailAddress', ''))
+        if account is None:
+            ingestion.notify(notification.get('historyId'))
+        else:
+            # An account that is not loaded has no daemon; it syncs when it is next used.
+            tenant = tenants.peek(account['account_id'])
+            if tenant is not None:
+                tenant.ingestion.notify(notification.get('historyId'))
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Ignoring malformed Gmail push notification: {e}")
+    return Response(status_code=204)
+
+@router.get("/ingestion/status")
+async def ingestion_status(account_id: str = Depends(current_account)):
+    return _ingestion(account_id).status()
+
+class BatchDraftRequest(BaseModel):
+    thread_ids: Optional[List[str]] = None  # None means every unread thread
+    save: bool = False
+    stream: bool = True
+
+def _load_threads(thread_ids, account_id=DEFAULT_ACCOUNT):
+    """
+    Returns EmailData for the given thread IDs (or for every unread thread), reading from the
+    inbox store and thread cache and batch-fetching anything else from Gmail.
+    """
+    if not thread_ids:
+        return [EmailData(**thread) for thread in _sync_inbox(account_id)]
+
+    store = _inbox_sync(account_id)
+    threads = {}
+    for thread_id in thread_ids:
+        thread = store.get(thread_id) or thread_cache.get_thread(thread_id, account_id=account_id)
+        if thread is not None:
+            threads[thread_id] = thread
+
+    missing = [thread_id for thread_id in thread_ids if thread_id not in threads]
+    if missing:
+        for thread_id, full_thread in batch_get_threads(get_gmail_service(account_id), missing).items():
+            threads[thread_id] = parse_thread(thread_id, full_thread, account_id)
+
+    return [EmailData(**threads[thread_id]) for thread_id in thread_ids if thread_id in threads]
+
+@router.post("/generate_drafts/batch")
+async def generate_drafts_batch(data: BatchDraftRequest, account_id: str = Depends(current_account)):
+    """
+    Starts a background job generating drafts for many threads. By default the completed
+    drafts are streamed back as NDJSON as they finish, followed by a job summary line;
+    with stream=false the job summary is returned immediately.
+    """
+    try:
+        emails = await run_blocking("emails", _load_threads, data.thread_ids, account_id)
+        job = _draft_jobs(account_id).start(emails, save=data.save)
+    except Exception as e:
+        print(f"Error starting batch draft job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    print(f"Started batch draft job {job.id} for {len(emails)} threads")
+    if not data.stream:
+        return job.summary()
+
+    def generate():
+        for result in job.iter_results():
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson", headers={"X-Job-Id": job.id})
+
+@router.get("/generate_drafts/jobs/{job_id}")
+async def draft_job_status(job_id: str, account_id: str = Depends(current_account)):
+    # Jobs started by another worker are read from the shared store.
+    status = _draft_jobs(account_id).status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return status
+
+@router.post("/generate_draft/stream")
+async def generate_draft_stream(email: EmailData, account_id: str = Depends(current_account)):
+    """
+    Streams a draft reply as server-sent events: one 'data' event per text chunk with
+    {"delta": ...}, then a 'done' event with the full draft and timings, or an 'error' event.
+    """
+    def generate():
+        start = time.perf_counter()
+        time_to_first_token = None
+        parts = []
+        usage = {}
+        try:
+            for chunk in stream_draft_text(email, usage, account_id):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start
+                parts.append(chunk)
+                yield _sse({"delta": chunk})
+            total = time.perf_counter() - start
+            print(f"Draft streamed for thread {email.thread_id}: first chunk {time_to_first_token or 0:.3f}s, total {total:.3f}s")
+            yield _sse({"draft": "".join(parts), "time_to_first_token": time_to_first_token, "total_time": total,
+                        "usage": usage}, event="done")
+        except Exception as e:
+            print(f"Error streaming draft: {e}")
+            yield _sse({"error": str(e)}, event="error")
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Reports hit/miss counters for the LLM response cache and the thread cache, and the loaded tenants."""
+    return {"responses": response_cache.stats(), "threads": thread_cache.stats(),
+            "tenants": tenants.stats(), "agents": rag_agents.stats()}
+
+@app.get("/llm/scheduler")
+async def llm_scheduler_status():
+    """Reports the adaptive LLM concurrency limit, running and queued calls, and outcome counts."""
+    return llm_scheduler.stats()
+
+@app.get("/accounts")
+async def list_accounts():
+    """Lists the registered accounts (without credentials) and whether each is loaded."""
+    return [{
+        "account_id": account['account_id'],
+        "email": account['email'],
+        "has_credentials": account_registry.has_credentials(account['account_id']),
+        "loaded": tenants.peek(account['account_id']) is not None,
+    } for account in account_registry.list()]
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint: request, Gmail, LLM, cache and queue metrics."""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
 class SendEmailRequest(BaseModel):
     thread_id: str
     response: str
-    recipient: str
-    subject: str
+    recipient: Optional[str] = None
+    subject: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
-@app.post("/send_email")
-async def send_email_endpoint(data: SendEmailRequest):
-    try:
-        result = send_message(
-            thread_id=data.thread_id,
-            response_content=data.response,
-            to_address=data.recipient,
-            subject=f"Re: {data.subject}"
-        )
-        
-        # Mark thread as read
-        service = get_gmail_service()
-        service.users().threads().modify(
-            userId='me',
-            id=data.thread_id,
-            body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+def _send_email(data: SendEmailRequest, account_id=DEFAULT_ACCOUNT):
+    key = f"{account_id}:{data.thread_id}:{_content_hash(data.response, data.recipient, data.subject, data.idempotency_key)}"
+    job, _ = send_flights.do(key, functools.partial(_queue_send, data, account_id))
+    return job
 
-        return {"status": "success", "message": result}
+def _queue_send(data: SendEmailRequest, account_id):
+    recipient = data.recipient
+    subject = data.subject
+    if not recipient or not subject:
+        # Fill in missing headers from the thread cache before falling back to Gmail
+        thread_data = thread_cache.get_thread(data.thread_id, account_id=account_id)
+        if thread_data is None:
+            thread = get_gmail_service(account_id).users().threads().get(
+                userId='me', id=data.thread_id, **THREAD_HEADERS_PROJECTION).execute()
+            thread_data = parse_thread_summary(data.thread_id, thread)
+        recipient = recipient or thread_data['sender']
+        subject = subject or thread_data['subject']
+
+    # The send and marking the thread as read both happen on the outbound queue
+    return queue_message(
+        thread_id=data.thread_id,
+        response_content=data.response,
+        to_address=recipient,
+        subject=f"Re: {subject}",
+        mark_read=True,
+        idempotency_key=data.idempotency_key,
+        account_id=account_id
+    )
+
+@router.post("/send_email")
+async def send_email_endpoint(data: SendEmailRequest, account_id: str = Depends(current_account)):
+    """Queues the reply for sending and returns as soon as it is enqueued."""
+    try:
+        job = await run_blocking("send_email", _send_email, data, account_id)
+        return {"status": "queued", "message": f"Queued email for thread ID: {data.thread_id}", "job": job}
     except Exception as e:
         print(f"Error sending email: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/send_draft")
-async def send_draft(data: ThreadResponse):
+@app.get("/send_queue")
+async def send_queue_status():
+    """Reports outbound queue depth, counts by status and the most recent send jobs."""
+    return outbox.stats()
+
+@app.get("/send_queue/{job_id}")
+async def send_job_status(job_id: int):
+    job = outbox.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown send job: {job_id}")
+    return job
+
+def _save_draft(data: ThreadResponse, account_id=DEFAULT_ACCOUNT):
+    # A repeated or concurrent save of the same reply returns the first result instead of a second draft.
+    key = f"{account_id}:{data.thread_id}:{_content_hash(data.response)}"
+    result, _ = save_draft_flights.do(key, lambda: create_drafts_from_responses(
+        [{"thread_id": data.thread_id, "response": data.response}], account_id))
+    return result
+
+class ApproveDraftsRequest(BaseModel):
+    thread_ids: List[str]
+    mark_read: bool = True
+    idempotency_key: Optional[str] = None
+
+@router.post("/approve_drafts")
+async def approve_drafts(data: ApproveDraftsRequest, account_id: str = Depends(current_account)):
+    """Queues sending the saved drafts of many threads as one batched send job."""
+    if not data.thread_ids:
+        raise HTTPException(status_code=400, detail="No thread IDs provided")
+    try:
+        job = await run_blocking("send_email", queue_drafts_send, data.thread_ids, data.mark_read,
+                                 data.idempotency_key, account_id)
+        return {"status": "queued", "message": f"Queued {len(data.thread_ids)} drafts for sending", "job": job}
+    except Exception as e:
+        print(f"Error queueing drafts: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/send_draft")
+async def send_draft(data: ThreadResponse, account_id: str = Depends(current_account)):
     try:
-        result = create_drafts_from_responses([{"thread_id": data.thread_id, "response": data.response}])
+        result = await run_blocking("send_draft", _save_draft, data, account_id)
         return {"status": "success", "message": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+app.include_router(router)
+app.include_router(router, prefix="/accounts/{account_id}")
+
 # Mount static files (must be after API routes)
+class ImmutableStaticFiles(StaticFiles):
+    """Static files with content-hashed names, cached by browsers without revalidation."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = ASSETS_CACHE_CONTROL
+        return response
+
 if os.path.exists(frontend_dist_path):
-    app.mount("/assets", StaticFiles(directory=os.path.join(frontend_dist_path, "assets")), name="assets")
+    app.mount("/assets", ImmutableStaticFiles(directory=os.path.join(frontend_dist_path, "assets")), name="assets")
+
+    # index.html is read once and served from memory. It names the current asset bundles, so
+    # browsers revalidate it on every load (a rebuild takes effect on restart).
+    with open(os.path.join(frontend_dist_path, "index.html"), "rb") as index_file:
+        index_html = index_file.read()
+    # Weak: the compressed and uncompressed bodies share it.
+    index_etag = f'W/"{hashlib.sha256(index_html).hexdigest()[:32]}"'
 
     @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
-        index_path = os.path.join(frontend_dist_path, "index.html")
-        return FileResponse(index_path)
+    async def serve_frontend(request: Request, full_path: str):
+        headers = {"ETag": index_etag, "Cache-Control": "no-cache"}
+        if _not_modified(request, index_etag):
+            return Response(status_code=304, headers=headers)
+        return Response(index_html, media_type="text/html", headers=headers)
 else:
     print(f"Warning: Frontend dist not found at {frontend_dist_path}. Run 'npm run build' in frontend directory.")
 
@@ -0,0 +1,270 @@
+"""
+In-process metrics with a Prometheus text exposition, and optional OpenTelemetry spans.
+
+Counters and histograms are updated where the work happens (Gmail calls, LLM calls, draft
+and send paths). Values that components already track, such as cache hit counters and
+queue depths, are registered as callbacks and read when /metrics is scraped.
+
+Spans are recorded only when OTEL_TRACING is enabled and the opentelemetry API is
+installed; otherwise span() is a no-op.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:
+    _otel_trace = None
+
+OTEL_TRACING = os.getenv("OTEL_TRACING", "false").lower() in ("1", "true", "yes")
+PREFIX = "email_agent_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by labels."""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class CallbackMetric(_Metric):
+    """
+    A gauge or counter whose samples are read from a callback at scrape time. The callback
+    returns a number, or a dict mapping label value tuples to numbers when labelnames are set.
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), type="gauge"):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.type = type
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metric callback {self.name} failed: {e}")
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value or 0)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v or 0)}"
+                for key, v in value.items()]
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(entry['buckets']), entry['sum'], entry['count']) for key, entry in self._values.items()]
+        lines = []
+        for key, buckets, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, extra=(('le', _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds a metric, replacing any previous one of the same name (e.g. a re-registered callback)."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, labelnames=(), type="gauge"):
+        return self.register(CallbackMetric(name, help, fn, labelnames, type))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Gmail API: one count per request (batch sub-requests included) and per-round-trip latency.
+gmail_requests = registry.counter("gmail_requests_total", "Gmail API requests by method and outcome.",
+                                  ("method", "status"))
+gmail_latency = registry.histogram("gmail_request_seconds", "Gmail API round-trip latency by method.", ("method",))
+
+# LLM calls.
+llm_requests = registry.counter("llm_requests_total", "LLM requests by model, kind and outcome.",
+                                ("model", "kind", "status"))
+llm_latency = registry.histogram("llm_request_seconds", "LLM request latency (full response).", ("model", "kind"))
+llm_first_token = registry.histogram("llm_time_to_first_token_seconds", "Time to the first streamed chunk.", ("model",))
+llm_tokens = registry.counter("llm_tokens_total", "Tokens reported by the LLM API by type.", ("model", "type"))
+llm_queue_wait = registry.histogram("llm_queue_wait_seconds", "Time LLM calls waited for a scheduler slot.",
+                                    ("priority",))
+llm_tiers = registry.counter("llm_tier_total", "LLM calls by model tier and routing reason.", ("tier", "reason"))
+
+# Drafts and sends.
+drafts_created = registry.counter("drafts_total", "Gmail drafts created by outcome.", ("status",))
+emails_sent = registry.counter("emails_sent_total", "Outbound sends by kind and outcome.", ("kind", "status"))
+
+# Latency of pipeline stages (thread listing, hydration, prompt building, ...).
+stage_latency = registry.histogram("stage_seconds", "Time spent per pipeline stage.", ("stage",))
+
+# HTTP API.
+http_requests = registry.counter("http_requests_total", "API requests by route, method and status.",
+                                 ("route", "method", "status"))
+http_latency = registry.histogram("http_request_seconds", "API request latency by route.", ("route", "method"))
+
+# Deduplicated calls (see single_flight): leaders ran the work, the others shared its result.
+single_flight = registry.counter("single_flight_total", "Deduplicated calls by flight and role.", ("flight", "role"))
+
+# Caches and queues register a callback reporting their current state; it is read at scrape time.
+_cache_sources = {}
+_queue_sources = {}
+
+def register_cache(name, fn):
+    """Registers a cache whose `fn` returns its cumulative (hits, misses)."""
+    _cache_sources[name] = fn
+
+def register_queue(name, fn):
+    """Registers a queue whose `fn` returns its current depth (items waiting or in progress)."""
+    _queue_sources[name] = fn
+
+def _read_sources(sources):
+    values = {}
+    for name, fn in list(sources.items()):
+        try:
+            values[name] = fn()
+        except Exception as e:
+            print(f"Metric source {name} failed: {e}")
+    return values
+
+def _cache_requests():
+    samples = {}
+    for name, (hits, misses) in _read_sources(_cache_sources).items():
+        samples[(name, 'hit')] = hits
+        samples[(name, 'miss')] = misses
+    return samples
+
+def _cache_hit_ratio():
+    return {(name,): hits / (hits + misses) if hits + misses else 0.0
+            for name, (hits, misses) in _read_sources(_cache_sources).items()}
+
+registry.callback("cache_requests_total", "Cache lookups by cache and result.", _cache_requests,
+                  labelnames=("cache", "result"), type="counter")
+registry.callback("cache_hit_ratio", "Share of cache lookups that hit since start-up.", _cache_hit_ratio,
+                  labelnames=("cache",))
+registry.callback("queue_depth", "Items waiting or in progress by queue.",
+                  lambda: {(name,): depth for name, depth in _read_sources(_queue_sources).items()},
+                  labelnames=("queue",))
+
+def record_gmail(method, status, seconds=None):
+    gmail_requests.inc(method=method, status=status)
+    if seconds is not None:
+        gmail_latency.observe(seconds, method=method)
+
+def record_llm_usage(model, usage):
+    """Adds the token counts of one response (as filled in by RAGAgent) to llm_tokens_total."""
+    for token_type in ('prompt', 'cached', 'output'):
+        count = usage.get(f'{token_type}_tokens')
+        if count:
+            llm_tokens.inc(count, model=model, type=token_type)
+
+_tracer = _otel_trace.get_tracer("email_agent") if (OTEL_TRACING and _otel_trace is not None) else None
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Opens an OpenTelemetry span when tracing is enabled; otherwise does nothing.
+    Exporters are configured by the usual OpenTelemetry SDK setup (e.g. opentelemetry-instrument).
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None}) as current:
+        yield current
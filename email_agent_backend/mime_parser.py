@@ -0,0 +1,171 @@
+import binascii
+import html
+import re
+import threading
+from collections import OrderedDict
+
+# Reply headers and separators that start the quoted part of a reply, for the common clients.
+_QUOTE_HEADER = re.compile(
+    r"^[ \t]*(?:"
+    r"On\b[^\n]{0,300}?(?:\n[^\n]{0,200}?)?\bwrote:[ \t]*$"   # Gmail / Apple Mail: On <date>, <name> wrote:
+    r"|-{2,}[ \t]*Original Message[ \t]*-{2,}"                 # Outlook (plain)
+    r"|_{20,}[ \t]*$"                                          # Outlook separator line
+    r"|From:[^\n]*\n[ \t]*(?:Sent|Date):[^\n]*\n[ \t]*(?:To|Cc|Subject):"  # Outlook header block
+    r"|Begin forwarded message:"                               # Apple Mail forward
+    r")",
+    re.MULTILINE,
+)
+_QUOTE_MARKERS = ('wrote:', 'Original Message', '_' * 20, 'From:', 'Begin forwarded message:')
+# Signature delimiter ("-- ") and mobile client footers.
+_SIGNATURE = re.compile(
+    r"^(?:-- ?[ \t]*$|Sent from my (?:iPhone|iPad|Android|Samsung|mobile)[^\n]*$|Get Outlook for (?:iOS|Android)[^\n]*$)",
+    re.MULTILINE,
+)
+_SIGNATURE_MARKERS = ('--', 'Sent from my ', 'Get Outlook for ')
+_QUOTED_LINE = re.compile(r"^[ \t]*>[^\n]*(?:\n|$)", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+
+# HTML: quoted history containers are cut, blocks become line breaks, tags are dropped.
+# Only blockquotes marked as quoted replies (Gmail's class, Apple Mail's and Thunderbird's
+# type="cite") are cut; a plain <blockquote> is often part of the message itself.
+_HTML_QUOTE = re.compile(
+    r"<(?:div[^>]*class=\"[^\"]*(?:gmail_quote|moz-cite-prefix)[^\"]*\"|div[^>]*id=\"(?:appendonsend|divRplyFwdMsg)\""
+    r"|blockquote[^>]*(?:class=\"[^\"]*gmail_quote[^\"]*\"|type=\"?cite\b))",
+    re.IGNORECASE,
+)
+_HTML_DROP = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_HTML_PARAGRAPH = re.compile(r"</(?:p|h[1-6]|table)\s*>", re.IGNORECASE)
+_HTML_BREAK = re.compile(r"<br\s*/?>|</(?:div|tr|ul|ol|blockquote)\s*>", re.IGNORECASE)
+_HTML_ITEM = re.compile(r"<li\b[^>]*>", re.IGNORECASE)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_LINE_EDGES = re.compile(r" ?\n ?")
+
+_URLSAFE = bytes.maketrans(b'-_', b'+/')
+
+def _decode(data):
+    # Gmail uses URL-safe base64 and may omit the padding. binascii skips the argument
+    # handling of base64.urlsafe_b64decode, which dominates for short bodies.
+    padded = (data + '=' * (-len(data) % 4)).encode('ascii')
+    return binascii.a2b_base64(padded.translate(_URLSAFE)).decode('utf-8', errors='replace')
+
+def _is_attachment(part):
+    if part.get('filename'):
+        return True
+    for header in part.get('headers', ()):
+        if header['name'].lower() == 'content-disposition' and header['value'].lower().startswith('attachment'):
+            return True
+    return False
+
+def find_text_part(payload):
+    """
+    Walks a Gmail message payload depth-first and returns (mime_type, base64_data) of the
+    first text/plain part, or of the first text/html part if there is no plain text.
+    Attachments are skipped and nothing is decoded.
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if _is_attachment(part):
+            continue
+        mime_type = part.get('mimeType', '')
+        data = part.get('body', {}).get('data')
+        if data and mime_type in ('text/plain', ''):
+            return 'text/plain', data
+        if data and mime_type == 'text/html' and html_part is None:
+            html_part = ('text/html', data)
+        children = part.get('parts')
+        if children:
+            # Reverse so parts are visited in their original order.
+            stack.extend(reversed(children))
+    return html_part
+
+def html_to_text(markup):
+    """Converts an HTML body to plain text, dropping quoted history containers."""
+    quote = _HTML_QUOTE.search(markup)
+    if quote and quote.start() > 0:
+        markup = markup[:quote.start()]
+    markup = _HTML_DROP.sub('', markup)
+    markup = _HTML_COMMENT.sub('', markup)
+    markup = _HTML_PARAGRAPH.sub('\n\n', markup)
+    markup = _HTML_BREAK.sub('\n', markup)
+    markup = _HTML_ITEM.sub('\n- ', markup)
+    text = html.unescape(_HTML_TAG.sub('', markup)).replace('\xa0', ' ')
+    # Collapse runs of spaces, then trim the (at most one) space left around each line break.
+    text = _LINE_EDGES.sub('\n', _SPACES.sub(' ', text))
+    return _BLANK_LINES.sub('\n\n', text).strip()
+
+def strip_quoted_reply(text):
+    """
+    Removes the quoted previous messages and signature from a plain-text reply.
+
+    Text is cut at the first reply header (Gmail, Apple Mail and Outlook styles) unless that
+    would leave nothing, remaining '>' quoted lines are dropped, and the text is cut at a
+    signature delimiter or mobile footer. Headers must start a line; an Outlook header block
+    is only recognized as consecutive From, Sent/Date and To/Cc/Subject lines.
+    """
+    # Substring checks are much cheaper than the multiline patterns, so each pattern only
+    # runs when its marker is present (map avoids a generator frame per check).
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    first_marker = min((index for index in map(text.find, _QUOTE_MARKERS) if index >= 0), default=-1)
+    if first_marker >= 0:
+        # A header starts at most one line above its marker (a wrapped "On ... wrote:").
+        start = text.rfind('\n', 0, max(0, text.rfind('\n', 0, first_marker))) + 1
+        header = _QUOTE_HEADER.search(text, start)
+        if header and text[:header.start()].strip():
+            text = text[:header.start()]
+    if '>' in text:
+        text = _QUOTED_LINE.sub('', text)
+    if any(map(text.__contains__, _SIGNATURE_MARKERS)):
+        signature = _SIGNATURE.search(text)
+        if signature and text[:signature.start()].strip():
+            text = text[:signature.start()]
+    if '\n\n' in text:
+        text = _BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+def extract_body(payload):
+    """
+    Returns the cleaned text of a message payload, or None if it has no text part.
+    """
+    found = find_text_part(payload)
+    if found is None:
+        return None
+    mime_type, data = found
+    text = _decode(data)
+    if mime_type == 'text/html':
+        text = html_to_text(text)
+    return strip_quoted_reply(text)
+
+class BodyMemo:
+    """A bounded, thread-safe LRU memo of cleaned bodies keyed by (account ID, message ID)."""
+
+    MISSING = object()
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message_id):
+        with self._lock:
+            if message_id not in self._entries:
+                self.misses += 1
+                return self.MISSING
+            self.hits += 1
+            self._entries.move_to_end(message_id)
+            return self._entries[message_id]
+
+    def put(self, message_id, body):
+        with self._lock:
+            self._entries[message_id] = body
+            self._entries.move_to_end(message_id)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+body_memo = BodyMemo()
@@ -0,0 +1,161 @@
+"""
+Token-budgeted prompt construction for long conversation histories.
+
+The static instruction block is kept separate from the per-thread content so the model
+client can send it as a reusable prefix (see RAGAgent's context caching). The thread
+history is fitted to a token budget: repeated paragraphs (quoted earlier messages) are
+dropped, the newest messages are kept verbatim and older ones are trimmed or omitted.
+"""
+import os
+import re
+from mime_parser import strip_quoted_reply
+
+# Total prompt budget in estimated tokens, including the instruction block.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Number of newest messages that are never trimmed while the budget allows.
+PROMPT_RECENT_MESSAGES = int(os.getenv("PROMPT_RECENT_MESSAGES", "3"))
+# Older messages are cut to this many estimated tokens when the history does not fit.
+PROMPT_TRIMMED_MESSAGE_TOKENS = int(os.getenv("PROMPT_TRIMMED_MESSAGE_TOKENS", "150"))
+
+# Separator used by parse_thread between messages of a conversation history.
+HISTORY_SEPARATOR = "\n---\n"
+TRIM_MARKER = " [...]"
+# Paragraphs shorter than this ("Hi,", "Thanks!") are never treated as duplicates.
+MIN_DUPLICATE_CHARS = 40
+# A message is omitted rather than cut to fewer tokens than this.
+MIN_TRIMMED_TOKENS = 20
+OMITTED_MARKER = "[{} earlier messages omitted]"
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_WHITESPACE = re.compile(r"\s+")
+
+def estimate_tokens(text):
+    """
+    Estimates the token count of English text (about four characters per token for Gemini).
+    Cheap enough to run on every request; the exact counts come back in the response usage.
+    """
+    return (len(text) + 3) // 4
+
+def split_history(history):
+    """Splits a conversation history built by parse_thread into messages, oldest first."""
+    return [message for message in history.split(HISTORY_SEPARATOR) if message.strip()]
+
+def dedupe_messages(messages):
+    """
+    Removes quoted history and paragraphs that repeat an earlier message.
+
+    Returns:
+        A tuple (messages, removed) where `removed` is the number of paragraphs dropped.
+        Messages left empty are dropped as well.
+    """
+    seen = set()
+    removed = 0
+    result = []
+    for message in messages:
+        kept = []
+        for paragraph in _PARAGRAPH_BREAK.split(strip_quoted_reply(message)):
+            key = _WHITESPACE.sub(' ', paragraph).strip().lower()
+            if not key:
+                continue
+            if len(key) >= MIN_DUPLICATE_CHARS:
+                if key in seen:
+                    removed += 1
+                    continue
+                seen.add(key)
+            kept.append(paragraph.strip())
+        if kept:
+            result.append("\n\n".join(kept))
+    return result, removed
+
+def trim_to_tokens(text, max_tokens, count_tokens=estimate_tokens):
+    """Cuts text at a word boundary so it fits in `max_tokens`, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    limit = max(0, max_tokens * 4 - len(TRIM_MARKER))
+    cut = text[:limit]
+    if ' ' in cut:
+        cut = cut[:cut.rindex(' ')]
+    while cut and count_tokens(cut + TRIM_MARKER) > max_tokens:
+        cut = cut[:-max(1, len(cut) // 10)]
+    return cut.rstrip() + TRIM_MARKER
+
+class PromptBuilder:
+    """
+    Builds draft prompts whose estimated size stays within a token budget.
+
+    Args:
+        instruction: The static instruction block, sent as the system prompt.
+        budget: Maximum estimated tokens for instruction plus content.
+        recent_messages: Number of newest messages kept verbatim.
+        trimmed_message_tokens: Size older messages are trimmed to when the history does not fit.
+        count_tokens: Function returning the token count of a string.
+    """
+
+    def __init__(self, instruction, budget=None, recent_messages=None, trimmed_message_tokens=None,
+                 count_tokens=estimate_tokens):
+        self.instruction = instruction
+        self.budget = budget or PROMPT_TOKEN_BUDGET
+        self.recent_messages = max(1, recent_messages or PROMPT_RECENT_MESSAGES)
+        self.trimmed_message_tokens = trimmed_message_tokens or PROMPT_TRIMMED_MESSAGE_TOKENS
+        self.count_tokens = count_tokens
+        self.instruction_tokens = count_tokens(instruction)
+
+    def build(self, subject, sender, history):
+        """
+        Builds the prompt for one thread.
+
+        Returns:
+            A dictionary with 'instruction' (the static block), 'content' (the per-thread
+            prompt), 'history' (the fitted history) and 'usage' (token estimates and counts
+            of verbatim, trimmed, omitted and deduplicated content).
+        """
+        header = f"Customer Email:\nSubject: {subject}\nFrom: {sender}\nPrevious conversation history:\n"
+        messages, duplicates = dedupe_messages(split_history(history))
+        available = self.budget - self.instruction_tokens - self.count_tokens(header)
+        separator_tokens = self.count_tokens(HISTORY_SEPARATOR)
+        sizes = [self.count_tokens(message) for message in messages]
+
+        fitted = list(messages)
+        trimmed = omitted = 0
+        if sum(sizes) + separator_tokens * len(messages) > available:
+            # Room for the omitted-messages marker is set aside first, sized for the largest
+            # count it can show, so adding it cannot push the prompt over the budget.
+            available -= self.count_tokens(OMITTED_MARKER.format(len(messages)))
+            fitted = [None] * len(messages)
+            recent_start = max(0, len(messages) - self.recent_messages)
+            # Newest first: recent messages verbatim, older ones trimmed, the rest omitted.
+            for i in range(len(messages) - 1, -1, -1):
+                room = available - separator_tokens
+                limit = room if i >= recent_start else min(room, self.trimmed_message_tokens)
+                if limit < min(sizes[i], MIN_TRIMMED_TOKENS):
+                    break
+                text = trim_to_tokens(messages[i], limit, self.count_tokens)
+                trimmed += text is not messages[i]
+                fitted[i] = text
+                available -= self.count_tokens(text) + separator_tokens
+            omitted = fitted.count(None)
+            fitted = [text for text in fitted if text is not None]
+
+        parts = list(fitted)
+        if omitted:
+            parts.insert(0, OMITTED_MARKER.format(omitted))
+        fitted_history = HISTORY_SEPARATOR.join(parts)
+        content = header + fitted_history
+        content_tokens = self.count_tokens(content)
+
+        return {
+            'instruction': self.instruction,
+            'content': content,
+            'history': fitted_history,
+            'usage': {
+                'budget': self.budget,
+                'instruction_tokens': self.instruction_tokens,
+                'content_tokens': content_tokens,
+                'estimated_prompt_tokens': self.instruction_tokens + content_tokens,
+                'messages': len(messages),
+                'verbatim_messages': len(fitted) - trimmed,
+                'trimmed_messages': trimmed,
+                'omitted_messages': omitted,
+                'duplicate_paragraphs': duplicates,
+            },
+        }
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from shared_state import shared_state
+
+_WORD_PATTERN = re.compile(r"\w+")
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def normalize(text):
+    """Lowercases text and collapses whitespace so trivially different prompts share a key."""
+    return " ".join(text.lower().split())
+
+class MinHasher:
+    """
+    Computes MinHash signatures over word shingles. The fraction of equal positions in two
+    signatures estimates the Jaccard similarity of the underlying shingle sets.
+    """
+
+    def __init__(self, num_perm=64, shingle_size=3, seed=1):
+        self.shingle_size = shingle_size
+        # Deterministic (a, b) pairs for the universal hash family h(x) = (a * x + b) mod p.
+        seeds = hashlib.sha256(str(seed).encode()).digest()
+        self.params = []
+        for i in range(num_perm):
+            digest = hashlib.sha256(seeds + i.to_bytes(4, 'big')).digest()
+            a = int.from_bytes(digest[:8], 'big') % _MERSENNE_PRIME or 1
+            b = int.from_bytes(digest[8:16], 'big') % _MERSENNE_PRIME
+            self.params.append((a, b))
+
+    def shingles(self, text):
+        words = _WORD_PATTERN.findall(text.lower())
+        if len(words) < self.shingle_size:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text, shingles=None):
+        shingles = self.shingles(text) if shingles is None else shingles
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'big') for s in shingles]
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self.params
+        )
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class ResponseCache:
+    """
+    A response cache placed in front of the LLM.
+
+    Lookups first try an exact match on the normalized prompt hash, then a near-duplicate
+    match on the MinHash similarity of the customer's last message. Near-duplicates are only
+    matched within the same thread context (e.g. sender and subject), so one customer is never
+    served a reply written for another, and only for messages of at least `min_shingles`
+    word shingles, so short messages ("Thanks!") never match at all. Entries expire after
+    `ttl` seconds, the least recently used entry is evicted beyond `capacity`, and the
+    whole cache is dropped when the knowledge base version changes.
+
+    With a `shared` store (see shared_state) responses are also written there, so an exact
+    match generated by another worker process is served instead of calling the LLM again.
+    `namespace` keeps the shared entries of different accounts apart.
+    """
+
+    def __init__(self, capacity=None, ttl=None, similarity_threshold=None, num_perm=64, shared=None,
+                 namespace="default", min_shingles=None):
+        self.capacity = capacity or int(os.getenv("RESPONSE_CACHE_CAPACITY", "1000"))
+        self.ttl = ttl or float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+        self.similarity_threshold = similarity_threshold or float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.8"))
+        self.min_shingles = min_shingles or int(os.getenv("RESPONSE_CACHE_MIN_SHINGLES", "8"))
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.shared = shared
+        self.namespace = namespace
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'exact_hits': 0,
+            'similar_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+        self._llm_seconds = 0.0
+        self._llm_calls = 0
+
+    def _key(self, prompt):
+        return hashlib.sha256(normalize(prompt).encode()).hexdigest()
+
+    def _signature(self, message):
+        # None marks a message too short to be matched as a near-duplicate.
+        shingles = self.hasher.shingles(message)
+        return self.hasher.signature(message, shingles) if len(shingles) >= self.min_shingles else None
+
+    def _context_key(self, context):
+        return hashlib.sha256(normalize(context or "").encode()).hexdigest()
+
+    def _shared_key(self, key, version):
+        return f"response:{self.namespace}:{version}:{key}"
+
+    def _check_version(self, version):
+        # Caller holds the lock.
+        if version != self.version:
+            if self._entries:
+                self._counters['invalidations'] += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, prompt, message, version=None, context=None):
+        """
+        Returns a cached response for the prompt, or for a sufficiently similar customer
+        message in the same context, or one another worker shared for the prompt, or None
+        on a miss.
+
+        Args:
+            prompt: The full prompt sent to the LLM.
+            message: The customer's last message, used for near-duplicate matching.
+            version: The knowledge base version the response must have been generated against.
+            context: The thread context near-duplicates must share (e.g. sender and subject).
+        """
+        now = time.time()
+        with self._lock:
+            self._check_version(version)
+
+            key = self._key(prompt)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(key, entry, now):
+                self._entries.move_to_end(key)
+                self._counters['exact_hits'] += 1
+                return entry['response']
+
+            signature = self._signature(message)
+            context_key = self._context_key(context)
+            best_key, best_score = None, 0.0
+            for candidate_key, candidate in (list(self._entries.items()) if signature is not None else []):
+                if self._expired(candidate_key, candidate, now):
+                    continue
+                if candidate['signature'] is None or candidate['context'] != context_key:
+                    continue
+                score = MinHasher.similarity(signature, candidate['signature'])
+                if score > best_score:
+                    best_key, best_score = candidate_key, score
+
+            if best_key is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self._counters['similar_hits'] += 1
+                return self._entries[best_key]['response']
+
+        response = self._get_shared(key, version)
+        with self._lock:
+            if response is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['shared_hits'] += 1
+            if version == self.version:
+                self._entries[key] = {'response': response, 'signature': signature, 'context': context_key,
+                                      'created_at': now}
+                self._evict()
+            return response
+
+    def put(self, prompt, message, response, version=None, latency=None, context=None):
+        """
+        Stores a response. `latency` is the LLM call duration, used to estimate time saved by hits.
+        """
+        signature = self._signature(message)
+        context_key = self._context_key(context)
+        with self._lock:
+            self._check_version(version)
+            key = self._key(prompt)
+            self._entries[key] = {'response': response, 'signature': signature, 'context': context_key,
+                                  'created_at': time.time()}
+            self._entries.move_to_end(key)
+            self._evict()
+            if latency is not None:
+                self._llm_seconds += latency
+                self._llm_calls += 1
+        if self.shared is not None:
+            try:
+                self.shared.set(self._shared_key(key, version), response, ttl=self.ttl)
+            except Exception as e:
+                print(f"Failed to share cached response: {e}")
+
+    def _evict(self):
+        # Caller holds the lock.
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _get_shared(self, key, version):
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.get(self._shared_key(key, version))
+        except Exception as e:
+            # The local cache keeps working if the shared store is unavailable.
+            print(f"Shared response cache lookup failed: {e}")
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters, hit rate and the estimated LLM time saved."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            hits = stats['exact_hits'] + stats['similar_hits'] + stats['shared_hits']
+            lookups = hits + stats['misses']
+            stats['hit_rate'] = hits / lookups if lookups else 0.0
+            avg_latency = self._llm_seconds / self._llm_calls if self._llm_calls else 0.0
+            stats['llm_calls_saved'] = hits
+            stats['estimated_seconds_saved'] = round(hits * avg_latency, 3)
+            return stats
+
+    def _expired(self, key, entry, now):
+        # Caller holds the lock.
+        if now - entry['created_at'] <= self.ttl:
+            return False
+        del self._entries[key]
+        self._counters['expirations'] += 1
+        return True
+
+response_cache = ResponseCache(shared=shared_state)
+
+def _response_cache_counts():
+    stats = response_cache.stats()
+    return stats['exact_hits'] + stats['similar_hits'] + stats['shared_hits'], stats['misses']
+
+metrics.register_cache('response', _response_cache_counts)
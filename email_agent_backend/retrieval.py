@@ -0,0 +1,164 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its me my no not of on or our
+so than that the their them then there these they this to was we what when where which who will with you your
+""".split())
+
+def _stem(token):
+    # Light plural folding so "resumes" matches "resume"; a full stemmer is not worth it for a small FAQ.
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """Lowercases text and splits it into alphanumeric terms, dropping common stopwords."""
+    return [_stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def chunk_text(text, max_chars=300):
+    """
+    Splits text into passages on blank lines, merging consecutive short paragraphs
+    until a passage would exceed `max_chars`.
+    """
+    chunks = []
+    current = []
+    current_len = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph or paragraph == '---':
+            continue
+        if current and current_len + len(paragraph) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(paragraph)
+        current_len += len(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+class BM25Index:
+    """
+    An in-memory Okapi BM25 index that supports adding and removing documents,
+    so a changed source file can be re-indexed without rebuilding everything.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def add(self, doc_id, tokens):
+        self.remove(doc_id)
+        for term, frequency in Counter(tokens).items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in list(self.postings):
+            docs = self.postings[term]
+            if docs.pop(doc_id, None) is not None and not docs:
+                del self.postings[term]
+
+    def search(self, tokens, k=4):
+        """Returns up to k (doc_id, score) pairs, best first."""
+        num_docs = len(self.doc_lengths)
+        if not num_docs:
+            return []
+        avg_length = self.total_length / num_docs
+        scores = {}
+        for term in set(tokens):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+class LocalRetriever:
+    """
+    Local retrieval over knowledge base files using a BM25 index.
+
+    Files are chunked into passages and indexed in memory. refresh() checks each file's
+    modification time and size and only re-chunks files that changed.
+    """
+
+    def __init__(self, file_paths, chunk_chars=300):
+        self.file_paths = list(file_paths)
+        self.chunk_chars = chunk_chars
+        self.index = BM25Index()
+        self.passages = {}
+        self._file_state = {}
+        self._file_digests = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def version(self):
+        """A digest of all indexed file contents; changes whenever the knowledge base changes."""
+        combined = hashlib.sha256()
+        for path in self.file_paths:
+            combined.update(self._file_digests.get(path, '').encode())
+        return combined.hexdigest()
+
+    def refresh(self):
+        """
+        Re-indexes files whose modification time or size changed since the last refresh.
+
+        Returns:
+            The list of file paths that were re-indexed.
+        """
+        changed = []
+        with self._lock:
+            for path in self.file_paths:
+                stat = os.stat(path)
+                state = (stat.st_mtime_ns, stat.st_size)
+                if self._file_state.get(path) == state:
+                    continue
+
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                self._file_state[path] = state
+                if self._file_digests.get(path) == digest:
+                    continue
+
+                self._reindex_file(path, data.decode('utf-8'))
+                self._file_digests[path] = digest
+                changed.append(path)
+        return changed
+
+    def _reindex_file(self, path, text):
+        for doc_id in [doc_id for doc_id in self.passages if doc_id[0] == path]:
+            self.index.remove(doc_id)
+            del self.passages[doc_id]
+
+        for position, chunk in enumerate(chunk_text(text, self.chunk_chars)):
+            doc_id = (path, position)
+            self.passages[doc_id] = chunk
+            self.index.add(doc_id, tokenize(chunk))
+
+    def search(self, query, k=4):
+        """
+        Returns the top-k passages for a query as dicts with 'source', 'text' and 'score'.
+        """
+        with self._lock:
+            results = self.index.search(tokenize(query), k)
+            return [
+                {'source': os.path.basename(doc_id[0]), 'text': self.passages[doc_id], 'score': score}
+                for doc_id, score in results
+            ]
@@ -0,0 +1,287 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from googleapiclient.errors import HttpError
+from email_fetcher_tool import is_retryable_error
+from rate_limit import TokenBucket
+from storage import data_path
+
+SEND_QUEUE_PATH = os.getenv("SEND_QUEUE_PATH") or data_path("send_queue.db")
+SEND_QUEUE_WORKERS = int(os.getenv("SEND_QUEUE_WORKERS", "2"))
+SEND_QUEUE_MAX_ATTEMPTS = int(os.getenv("SEND_QUEUE_MAX_ATTEMPTS", "8"))
+# A send costs 100 of the 250 quota units per user per second, so sustained sends are
+# capped a little under 2.5 per second.
+SEND_RATE_PER_SECOND = float(os.getenv("SEND_RATE_PER_SECOND", "2"))
+SEND_RATE_BURST = float(os.getenv("SEND_RATE_BURST", "5"))
+# Jobs left in progress longer than this are assumed to belong to a crashed worker.
+SEND_QUEUE_LEASE_SECONDS = float(os.getenv("SEND_QUEUE_LEASE_SECONDS", "300"))
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+class Step:
+    """
+    One stage of a queued job.
+
+    Args:
+        fn: Callable taking the job payload and returning a JSON-serializable result.
+        idempotent: Whether the step can safely be repeated if a worker dies mid-step or
+            Gmail answers it with a server error. Other steps are only retried after errors
+            that show the request was not carried out (see retryable()).
+        rate_limited: Whether the step consumes a token from the send rate limiter.
+    """
+
+    def __init__(self, fn, idempotent, rate_limited=False):
+        self.fn = fn
+        self.idempotent = idempotent
+        self.rate_limited = rate_limited
+
+def retryable(error, step):
+    """
+    Whether a failed step is worth retrying. Quota rejections (429, 403 rateLimitExceeded)
+    and refused connections mean the request was not carried out. A server error or a
+    dropped connection may come after Gmail accepted the request (a 5xx on messages.send
+    can still deliver the message), so those are only retried for idempotent steps.
+    """
+    if isinstance(error, ConnectionRefusedError):
+        return True
+    if not (isinstance(error, HttpError) and is_retryable_error(error)):
+        return False
+    return step.idempotent or int(error.resp.status) < 500
+
+class SendQueue:
+    """
+    A durable, SQLite-backed outbound queue.
+
+    Jobs are made of ordered steps (e.g. send the message, then mark the thread read).
+    Progress is recorded after every step, so a retry resumes after the last completed
+    step and a message is never sent twice. Each job has an idempotency key; enqueueing
+    the same key again returns the existing job. A job may also carry a dedupe key, which
+    only matches jobs created within a given number of seconds. Workers retry quota and transient errors
+    with exponential backoff and share a token-bucket rate limit.
+
+    Args:
+        handlers: Dict mapping a job kind to its list of Steps.
+    """
+
+    def __init__(self, handlers, path=None, workers=None, rate=None, burst=None, max_attempts=None,
+                 lease_seconds=None):
+        self.handlers = handlers
+        self.lease_seconds = lease_seconds or SEND_QUEUE_LEASE_SECONDS
+        self.path = path or SEND_QUEUE_PATH
+        self.num_workers = workers or SEND_QUEUE_WORKERS
+        self.max_attempts = max_attempts or SEND_QUEUE_MAX_ATTEMPTS
+        self.rate_limiter = TokenBucket(rate or SEND_RATE_PER_SECOND, capacity=burst or SEND_RATE_BURST)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                steps_done INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                dedupe_key TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_ready ON outbox (status, next_attempt_at);
+        """)
+        if 'dedupe_key' not in [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN dedupe_key TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_dedupe ON outbox (dedupe_key, created_at)")
+
+    def start(self):
+        """Starts the worker threads (idempotent)."""
+        with self._lock:
+            if self._workers:
+                return
+            self._stop.clear()
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._work, name=f"send-queue-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self, timeout=5):
+        """Stops the worker threads once their current job is done; start() resumes them."""
+        self._stop.set()
+        self._wakeup.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join(timeout)
+
+    def enqueue(self, kind, payload, idempotency_key, dedupe_key=None, dedupe_seconds=0):
+        """
+        Adds a job and returns it as a dict. If a job with the same idempotency key already
+        exists, nothing is added and the existing job is returned. The same holds for a job
+        with the same `dedupe_key` created less than `dedupe_seconds` ago: the window slides
+        with each request, so a retry always finds a job created just before it.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = None
+                if dedupe_key is not None:
+                    row = self._conn.execute(
+                        "SELECT * FROM outbox WHERE dedupe_key = ? AND created_at > ? ORDER BY id DESC LIMIT 1",
+                        (dedupe_key, now - dedupe_seconds)
+                    ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox (idempotency_key, kind, payload, status, next_attempt_at, "
+                        "created_at, updated_at, dedupe_key) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                        (idempotency_key, kind, json.dumps(payload), now, now, now, dedupe_key)
+                    )
+                    row = self._conn.execute("SELECT * FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            job = self._to_dict(row)
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def stats(self, recent=50):
+        """Returns job counts by status, the age of the oldest queued job and the most recent jobs."""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM outbox WHERE status = 'queued'").fetchone()[0]
+            rows = self._conn.execute("SELECT * FROM outbox ORDER BY id DESC LIMIT ?", (recent,)).fetchall()
+        return {
+            'counts': counts,
+            'depth': counts.get('queued', 0) + counts.get('in_progress', 0),
+            'oldest_queued_age': round(time.time() - oldest, 3) if oldest else None,
+            'recent': [self._to_dict(row) for row in rows],
+        }
+
+    def _to_dict(self, row):
+        columns = ('id', 'idempotency_key', 'kind', 'payload', 'status', 'steps_done', 'attempts',
+                   'next_attempt_at', 'last_error', 'result', 'created_at', 'updated_at', 'dedupe_key')
+        job = dict(zip(columns, row))
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _recover_stale_jobs(self):
+        # Caller holds the lock, inside a transaction. A job's lease is renewed whenever its
+        # progress is recorded, so one left in progress past the lease belongs to a worker
+        # that died, in this process or another one sharing the file, before or after a restart.
+        cutoff = time.time() - self.lease_seconds
+        for row in self._conn.execute(
+            "SELECT id, kind, steps_done FROM outbox WHERE status = 'in_progress' AND updated_at < ?", (cutoff,)
+        ).fetchall():
+            job_id, kind, steps_done = row
+            step = self.handlers[kind][steps_done]
+            if step.idempotent:
+                self._conn.execute("UPDATE outbox SET status = 'queued', updated_at = ? WHERE id = ?", (time.time(), job_id))
+            else:
+                # The worker may have died after Gmail accepted the send; retrying could send twice.
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'failed', last_error = ?, updated_at = ? WHERE id = ?",
+                    ("Interrupted during a non-repeatable step; not retried to avoid a duplicate send", time.time(), job_id)
+                )
+
+    def _claim(self):
+        """
+        Atomically moves the next due job to in_progress and returns it, or None. Jobs whose
+        lease has expired are recovered first, on every poll.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._recover_stale_jobs()
+                row = self._conn.execute(
+                    "SELECT * FROM outbox WHERE status = 'queued' AND next_attempt_at <= ? ORDER BY id LIMIT 1", (now,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE outbox SET status = 'in_progress', updated_at = ? WHERE id = ?", (now, row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._to_dict(row) if row else None
+
+    def _seconds_until_next_job(self, max_wait=1.0):
+        with self._lock:
+            next_at = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'queued'").fetchone()[0]
+        if next_at is None:
+            return max_wait
+        return min(max_wait, max(0.01, next_at - time.time()))
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(timeout=self._seconds_until_next_job())
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        steps = self.handlers[job['kind']]
+        results = job['result'] or []
+        steps_done = job['steps_done']
+        step = steps[steps_done]
+        # Renew the lease while a step runs, so a long one (a large draft batch waiting on the
+        # rate limiter) is not taken for abandoned.
+        done = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(job['id'], done), name=f"send-lease-{job['id']}",
+                         daemon=True).start()
+        try:
+            while steps_done < len(steps):
+                step = steps[steps_done]
+                if step.rate_limited:
+                    self.rate_limiter.acquire()
+                results.append(step.fn(job['payload']))
+                steps_done += 1
+                self._update(job['id'], steps_done=steps_done, result=json.dumps(results))
+            self._update(job['id'], status='sent', last_error=None)
+            threads = job['payload'].get('thread_ids') or [job['payload'].get('thread_id')]
+            print(f"Send job {job['id']} completed for thread ID: {', '.join(map(str, threads))}")
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            if retryable(e, step) and attempts < self.max_attempts:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1))) + random.uniform(0, BACKOFF_BASE)
+                print(f"Send job {job['id']} failed ({e}), retrying in {delay:.1f}s")
+                self._update(job['id'], status='queued', attempts=attempts, last_error=str(e),
+                             next_attempt_at=time.time() + delay)
+            else:
+                error = str(e)
+                if isinstance(e, HttpError) and is_retryable_error(e) and not retryable(e, step):
+                    error += " (not retried: the request may have been carried out)"
+                print(f"Send job {job['id']} failed permanently: {error}")
+                self._update(job['id'], status='failed', attempts=attempts, last_error=error)
+        finally:
+            done.set()
+
+    def _renew_lease(self, job_id, done):
+        while not done.wait(self.lease_seconds / 3):
+            self._update(job_id)
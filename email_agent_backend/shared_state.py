@@ -0,0 +1,266 @@
+"""
+State shared by every worker process serving the API: short-lived results, locks and job
+status that must agree across `uvicorn --workers N` or several nodes.
+
+The store is a small key-value interface modelled on Redis (GET, SET with expiry, SET NX,
+DEL, PEXPIRE), so any Redis-like service can back it. SHARED_STATE_URL selects the implementation:
+
+    sqlite:///shared_state.db   every worker on one host, through a SQLite file (the default
+                                uses shared_state.db in DATA_DIR, see storage.py)
+    memory://                   this process only, e.g. a single worker or benchmarks
+    redis://host:6379/0         every worker on every node; needs the redis package
+
+Values must be JSON-serializable; readers always get a fresh copy.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from storage import data_path
+
+try:
+    import redis as _redis
+except ImportError:
+    _redis = None
+
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL") or "sqlite:///" + data_path("shared_state.db")
+# Expired SQLite rows are purged once every this many writes.
+SQLITE_PURGE_INTERVAL = 1000
+
+class SharedState(ABC):
+    """
+    Interface of a shared key-value store with per-key expiry.
+
+    `ttl` is in seconds; None means the key does not expire.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Returns the value of a key, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        """Stores a value, replacing any existing one."""
+
+    @abstractmethod
+    def add(self, key, value, ttl=None):
+        """Stores a value only if the key is missing or expired. Returns True if it was stored."""
+
+    @abstractmethod
+    def delete(self, key, value=None):
+        """
+        Removes a key. If `value` is given the key is only removed while it still holds that
+        value, so a lock is only released by its owner. Returns True if a key was removed.
+        """
+
+    @abstractmethod
+    def touch(self, key, value, ttl):
+        """
+        Resets the expiry of a key to `ttl` seconds from now, only while it still holds
+        `value`, so a lock is only extended by its owner. Returns True if the key was extended.
+        """
+
+    @contextmanager
+    def lock(self, name, ttl=60, timeout=None, poll_interval=0.05):
+        """
+        Holds a lock shared by every worker for the duration of the block. The lock expires
+        after `ttl` seconds so a crashed holder cannot block the others forever.
+
+        Raises:
+            TimeoutError: If the lock could not be taken within `timeout` seconds.
+        """
+        key = f"lock:{name}"
+        token = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.add(key, token, ttl=ttl):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for lock: {name}")
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            self.delete(key, token)
+
+class MemoryState(SharedState):
+    """An in-process store, shared by the threads of one worker only."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        # Caller holds the lock.
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+        return json.loads(entry[0]) if entry else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (json.dumps(value), expires_at)
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._entries[key] = (json.dumps(value), now + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, key, value=None):
+        with self._lock:
+            entry = self._live(key, time.time())
+            if entry is None or (value is not None and entry[0] != json.dumps(value)):
+                return False
+            del self._entries[key]
+            return True
+
+    def touch(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None or entry[0] != json.dumps(value):
+                return False
+            self._entries[key] = (entry[0], now + ttl)
+            return True
+
+class SQLiteState(SharedState):
+    """
+    A store in a SQLite file. Every process opening the same file shares it; each operation
+    is a single statement, so SET NX and owner-checked DEL are atomic across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS shared_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+        """)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_state VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl is not None else None)
+            )
+            self._purge(now)
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            # Inserts, or takes over a row that has expired; a live row is left alone.
+            cursor = self._conn.execute(
+                "INSERT INTO shared_state VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= ?",
+                (key, json.dumps(value), now + ttl if ttl is not None else None, now)
+            )
+            self._purge(now)
+            return cursor.rowcount > 0
+
+    def delete(self, key, value=None):
+        with self._lock:
+            if value is None:
+                cursor = self._conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+            else:
+                cursor = self._conn.execute("DELETE FROM shared_state WHERE key = ? AND value = ?",
+                                            (key, json.dumps(value)))
+            return cursor.rowcount > 0
+
+    def touch(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE shared_state SET expires_at = ? "
+                "WHERE key = ? AND value = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (now + ttl, key, json.dumps(value), now)
+            )
+            return cursor.rowcount > 0
+
+    def _purge(self, now):
+        # Caller holds the lock.
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_INTERVAL == 0:
+            self._conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+class RedisState(SharedState):
+    """A store in Redis (or any server speaking its protocol), shared across nodes."""
+
+    # Deletes the key only while it holds the expected value.
+    _DELETE_IF_EQUAL = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+    # Extends the key's expiry only while it holds the expected value.
+    _EXPIRE_IF_EQUAL = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+
+    def __init__(self, url):
+        if _redis is None:
+            raise RuntimeError("SHARED_STATE_URL points to Redis but the redis package is not installed")
+        self.client = _redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl is not None else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl is not None else None, nx=True))
+
+    def delete(self, key, value=None):
+        if value is None:
+            return self.client.delete(key) > 0
+        return self.client.eval(self._DELETE_IF_EQUAL, 1, key, json.dumps(value)) > 0
+
+    def touch(self, key, value, ttl):
+        return self.client.eval(self._EXPIRE_IF_EQUAL, 1, key, json.dumps(value), int(ttl * 1000)) > 0
+
+def from_url(url):
+    """Creates the store selected by a SHARED_STATE_URL."""
+    if url.startswith("memory://"):
+        return MemoryState()
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+shared_state = from_url(SHARED_STATE_URL)
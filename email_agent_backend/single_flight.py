@@ -0,0 +1,185 @@
+"""
+Single-flight deduplication: concurrent calls with the same key share one execution.
+
+Within a process, callers arriving while a call is running wait for it and receive its
+result (or its exception). Across worker processes the leader holds a lock in the shared
+state store and publishes its result there, so a caller in another worker waits for that
+result instead of repeating the work; if the leader fails, one of the waiting callers takes
+over. Published results are kept for `result_ttl` seconds, which also absorbs retries that
+arrive just after the first call completed.
+
+The leader's lock expires after `lock_ttl` seconds so a crashed worker cannot block the key,
+and is extended while the leader is alive, so work that first waits its turn (e.g. in the
+LLM scheduler queue) is not taken over. Callers waiting on a leader give up with a
+TimeoutError after `wait_timeout` seconds.
+"""
+import os
+import threading
+import time
+import uuid
+
+import metrics
+from shared_state import shared_state
+
+# How long the lock of a leader that stopped refreshing it (a crashed worker) blocks the key.
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "180"))
+# Longest a caller waits for another caller's result before failing.
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "600"))
+# How long a completed result is served to repeated calls.
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "60"))
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Flight:
+    """
+    One caller's part in a call. The leader runs the work and reports it with finish() or
+    fail(); every other caller gets the leader's outcome from wait().
+    """
+
+    def __init__(self, group, key, call, leader, token=None):
+        self.group = group
+        self.key = key
+        self.leader = leader
+        self._call = call
+        self._token = token
+        self._released = threading.Event()
+        if leader:
+            threading.Thread(target=self._refresh_lock, name=f"flight-{group.name}", daemon=True).start()
+
+    def wait(self):
+        """
+        Blocks until the leader completes and returns its result, or raises its exception.
+
+        Raises:
+            TimeoutError: If the leader has not completed within the group's wait_timeout.
+        """
+        if not self._call.done.wait(self.group.wait_timeout):
+            raise TimeoutError(f"Timed out waiting for {self.group.name} call: {self.key}")
+        if self._call.error is not None:
+            raise self._call.error
+        return self._call.result
+
+    def finish(self, result):
+        if self.group.result_ttl > 0:
+            self.group.state.set(self.group._result_key(self.key), {'result': result}, ttl=self.group.result_ttl)
+        self._release()
+        self.group._complete(self.key, self._call, result=result)
+
+    def fail(self, error):
+        # Without a published result, callers waiting in other workers retry the work.
+        self._release()
+        self.group._complete(self.key, self._call, error=error)
+
+    def _release(self):
+        self._released.set()
+        self.group.state.delete(self.group._lock_key(self.key), self._token)
+
+    def _refresh_lock(self):
+        # Stops once the lock is released, or lost to a caller that took over after it expired.
+        while not self._released.wait(self.group.lock_ttl / 3):
+            try:
+                if not self.group.state.touch(self.group._lock_key(self.key), self._token, self.group.lock_ttl):
+                    return
+            except Exception as e:
+                print(f"Failed to refresh {self.group.name} lock for {self.key}: {e}")
+
+class SingleFlight:
+    """
+    A group of deduplicated calls, e.g. draft generation. Keys only need to be unique
+    within the group. Results must be JSON-serializable to be shared across workers.
+
+    Args:
+        name: Group name, used to namespace shared keys and label metrics.
+        state: SharedState store; defaults to the process-wide shared_state.
+        lock_ttl: Seconds after which the lock of a leader that stopped refreshing it expires.
+        result_ttl: Seconds a completed result is reused; 0 disables reuse.
+        poll_interval: Seconds between checks while another worker leads.
+        wait_timeout: Seconds a caller waits for another caller's result before failing.
+    """
+
+    def __init__(self, name, state=None, lock_ttl=None, result_ttl=None, poll_interval=0.1, wait_timeout=None):
+        self.name = name
+        self.state = state or shared_state
+        self.lock_ttl = lock_ttl or SINGLE_FLIGHT_LOCK_TTL
+        self.result_ttl = SINGLE_FLIGHT_RESULT_TTL if result_ttl is None else result_ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout or SINGLE_FLIGHT_WAIT_TIMEOUT
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _lock_key(self, key):
+        return f"flight:{self.name}:{key}"
+
+    def _result_key(self, key):
+        return f"flight-result:{self.name}:{key}"
+
+    def begin(self, key):
+        """
+        Joins the call for `key` and returns a Flight. If `flight.leader` is True the caller
+        must run the work and then call finish() or fail(); otherwise it calls wait().
+
+        Raises:
+            TimeoutError: If another worker led the call for longer than wait_timeout.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                metrics.single_flight.inc(flight=self.name, role='coalesced')
+                return Flight(self, key, call, leader=False)
+            call = self._calls[key] = _Call()
+
+        # This thread acts for the whole process: it either leads, or waits for the leader in
+        # another worker while the local callers wait on it.
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while True:
+                published = self.state.get(self._result_key(key))
+                if published is not None:
+                    metrics.single_flight.inc(flight=self.name, role='reused')
+                    self._complete(key, call, result=published['result'])
+                    return Flight(self, key, call, leader=False)
+                if self.state.add(self._lock_key(key), token, ttl=self.lock_ttl):
+                    metrics.single_flight.inc(flight=self.name, role='leader')
+                    return Flight(self, key, call, leader=True, token=token)
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for {self.name} call: {key}")
+                time.sleep(self.poll_interval)
+        except BaseException as e:
+            self._complete(key, call, error=e)
+            raise
+
+    def do(self, key, fn):
+        """
+        Runs `fn()` once for all concurrent callers with the same key.
+
+        Returns:
+            (result, shared): `shared` is True if the result came from another caller.
+        """
+        flight = self.begin(key)
+        if not flight.leader:
+            return flight.wait(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            flight.fail(e)
+            raise
+        flight.finish(result)
+        return result, False
+
+    def in_flight(self):
+        """Number of keys this process is currently running or waiting on."""
+        with self._lock:
+            return len(self._calls)
+
+    def _complete(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
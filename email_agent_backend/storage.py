@@ -0,0 +1,22 @@
+"""
+Location of the service's local SQLite files (thread cache, send queue, account registry,
+draft index and shared state).
+
+They live in DATA_DIR, by default the data/ directory next to this module, rather than in
+the working directory. Each file can still be placed elsewhere with its own setting
+(THREAD_CACHE_PATH, SEND_QUEUE_PATH, ACCOUNTS_DB_PATH, DRAFT_INDEX_PATH, SHARED_STATE_URL).
+"""
+import os
+
+DATA_DIR = os.getenv("DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def data_path(name):
+    """
+    Returns the path of a data file in DATA_DIR, creating the directory if needed. A file
+    of that name left in the working directory by an earlier version is used instead, so
+    upgrading keeps queued sends and registered accounts.
+    """
+    if os.path.exists(name):
+        return os.path.abspath(name)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
@@ -0,0 +1,21 @@
+"""
+Points every module-level store at a temporary directory before the modules under test are
+imported, so running the tests never creates or touches files in data/.
+"""
+import os
+import shutil
+import tempfile
+
+_DATA_DIR = tempfile.mkdtemp(prefix="email-agent-tests-")
+
+os.environ.update({
+    'DATA_DIR': _DATA_DIR,
+    'THREAD_CACHE_PATH': os.path.join(_DATA_DIR, "thread_cache.db"),
+    'SEND_QUEUE_PATH': os.path.join(_DATA_DIR, "send_queue.db"),
+    'ACCOUNTS_DB_PATH': os.path.join(_DATA_DIR, "accounts.db"),
+    'DRAFT_INDEX_PATH': os.path.join(_DATA_DIR, "draft_index.db"),
+    'SHARED_STATE_URL': "memory://",
+})
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
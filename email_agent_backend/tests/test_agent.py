@@ -0,0 +1,41 @@
+import pytest
+
+from agent import FileSearchStoreBackend, RAGAgent
+from benchmarks.fake_llm import FakeFileSearchBackend, FakeGenaiClient
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    path = tmp_path / "knowledge.txt"
+    path.write_text("Weekend batches start on the first Saturday of every month.\n")
+    return path
+
+def _agent(path, backend):
+    return RAGAgent(file_path=str(path), backend=backend, background=False, retrieval="file_search",
+                    client=FakeGenaiClient(latency=0))
+
+def test_unchanged_knowledge_base_reuses_the_store(knowledge_base):
+    backend = FakeFileSearchBackend()
+    first = _agent(knowledge_base, backend)
+    second = _agent(knowledge_base, backend)
+
+    assert second.store == first.store
+    assert len(backend.stores) == 1
+    assert backend.uploads == [(first.store, str(knowledge_base))]
+
+def test_changed_knowledge_base_gets_a_new_store(knowledge_base):
+    backend = FakeFileSearchBackend()
+    first = _agent(knowledge_base, backend)
+    knowledge_base.write_text("Weekend batches start on the second Saturday of every month.\n")
+    second = _agent(knowledge_base, backend)
+
+    assert second.store != first.store
+    assert second.knowledge_digest != first.knowledge_digest
+    assert [store for store, _ in backend.uploads] == [first.store, second.store]
+
+def test_backend_must_implement_the_interface():
+    class Partial(FileSearchStoreBackend):
+        def find_store(self, display_name):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+import compression
+from compression import CompressionMiddleware, choose_encoding
+
+def _scope(accept_encoding='gzip'):
+    return {'type': 'http', 'method': 'GET', 'path': '/', 'headers': [(b'accept-encoding', accept_encoding.encode())]}
+
+async def _receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+def test_ndjson_stream_first_line_arrives_before_the_stream_ends():
+    async def scenario():
+        release = asyncio.Event()
+        first_line = json.dumps({'thread_id': 't1', 'subject': 'x' * 2000}).encode() + b'\n'
+
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'application/x-ndjson')]})
+            await send({'type': 'http.response.body', 'body': first_line, 'more_body': True})
+            await release.wait()
+            await send({'type': 'http.response.body', 'body': b'{"thread_id": "t2"}\n', 'more_body': False})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        task = asyncio.create_task(CompressionMiddleware(app, minimum_size=100)(_scope(), _receive, send))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        bodies = [m['body'] for m in sent if m['type'] == 'http.response.body']
+        assert bodies == [first_line]
+        assert b'content-encoding' not in dict(sent[0]['headers'])
+        release.set()
+        await task
+    asyncio.run(scenario())
+
+def _run_json(body, accept_encoding='gzip', minimum_size=100):
+    async def scenario():
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(body)).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await CompressionMiddleware(app, minimum_size=minimum_size)(_scope(accept_encoding), _receive, send)
+        return dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+    return asyncio.run(scenario())
+
+def test_json_response_is_gzipped():
+    body = json.dumps([{'thread_id': f't{i}', 'history': 'hello ' * 50} for i in range(20)]).encode()
+    headers, sent = _run_json(body)
+    assert headers[b'content-encoding'] == b'gzip'
+    assert headers[b'vary'] == b'Accept-Encoding'
+    assert int(headers[b'content-length']) == len(sent) < len(body)
+    assert gzip.decompress(sent) == body
+
+def test_small_or_unaccepted_responses_are_not_compressed():
+    body = b'[]'
+    headers, sent = _run_json(body)
+    assert b'content-encoding' not in headers and sent == body
+    body = b'{"a": "' + b'x' * 500 + b'"}'
+    headers, sent = _run_json(body, accept_encoding='identity')
+    assert b'content-encoding' not in headers and sent == body
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ('gzip, deflate, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('br;q=0, gzip;q=0.1', 'gzip'),
+    ('gzip;q=0, br;q=0', None),
+    ('gzip;q=0', None),
+    ('*', 'br'),
+    ('*;q=0.5, br;q=0', 'gzip'),
+    ('identity', None),
+    ('', None),
+])
+def test_choose_encoding_honours_q_values(monkeypatch, accept_encoding, expected):
+    monkeypatch.setattr(compression, 'brotli', object())
+    assert choose_encoding(accept_encoding) == expected
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert choose_encoding('br, gzip;q=0.5') == 'gzip'
+    assert choose_encoding('br') is None
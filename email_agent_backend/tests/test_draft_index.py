@@ -0,0 +1,47 @@
+import pytest
+
+from benchmarks.fake_gmail import FakeGmailService
+from draft_index import DraftIndex
+
+@pytest.fixture
+def service():
+    return FakeGmailService()
+
+def _create(service, thread_id):
+    return service.users().drafts().create(userId='me', body={'message': {'threadId': thread_id}}).execute()
+
+def test_reconcile_matches_the_index_to_gmail(service):
+    index = DraftIndex(path=':memory:')
+    kept = _create(service, 't1')
+    outside = _create(service, 't2')
+    index.put('a', 't1', kept['id'], kept['message']['id'])
+    index.put('a', 't3', 'd-deleted')
+    index.put('b', 't3', 'd-other-account')
+
+    assert index.reconcile(service, 'a') == 2
+
+    assert index.get('a', 't1') == {'draft_id': kept['id'], 'message_id': kept['message']['id']}
+    assert index.get('a', 't2') == {'draft_id': outside['id'], 'message_id': outside['message']['id']}
+    assert index.get('a', 't3') is None
+    assert index.get('b', 't3') == {'draft_id': 'd-other-account', 'message_id': None}
+
+def test_stale_entry_is_replaced_by_the_thread_s_listed_draft(service):
+    index = DraftIndex(path=':memory:')
+    draft = _create(service, 't1')
+    index.put('a', 't1', 'd-sent-elsewhere')
+
+    index.reconcile(service, 'a')
+
+    assert index.get('a', 't1')['draft_id'] == draft['id']
+
+def test_lookup_misses_reconcile_at_most_once_per_interval(service):
+    index = DraftIndex(path=':memory:', reconcile_seconds=300)
+    assert index.lookup(service, 'a', 't1') is None
+    _create(service, 't1')
+
+    assert index.lookup(service, 'a', 't1') is None
+    assert service.calls['gmail.users.drafts.list'] == 1
+
+    index.reconcile_seconds = 0
+    assert index.lookup(service, 'a', 't1')['draft_id'] == 'd00001'
+    assert service.calls['gmail.users.drafts.list'] == 2
@@ -0,0 +1,86 @@
+import pytest
+
+import email_fetcher_tool
+from benchmarks.fake_gmail import FakeGmailService, _http_error
+from inbox_sync import InboxSync
+
+SENDER = "Customer <customer@example.com>"
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(email_fetcher_tool, 'GMAIL_MAX_RETRIES', 0)
+
+def _synced(num_threads=3):
+    service = FakeGmailService.with_synthetic_inbox(num_threads)
+    sync = InboxSync(account_id='test')
+    sync.sync(service)
+    return service, sync
+
+def _ids(threads):
+    return sorted(thread['thread_id'] for thread in threads)
+
+def _fail_fetches(monkeypatch, service, thread_id, status, reason):
+    render = service.render_thread
+
+    def failing(requested_id, **kwargs):
+        if requested_id == thread_id:
+            raise _http_error(status, reason)
+        return render(requested_id, **kwargs)
+    monkeypatch.setattr(service, 'render_thread', failing)
+
+def test_first_sync_scans_the_inbox():
+    service, sync = _synced()
+
+    assert _ids(sync.snapshot()) == ['t00000', 't00001', 't00002']
+    assert sync.history_id == '1'
+    assert service.calls.get('gmail.users.history.list') is None
+
+def test_history_sync_refetches_only_changed_threads():
+    service, sync = _synced()
+    service.add_message('t00003', SENDER, "New question", "When does the next batch start?")
+    service.users().threads().modify(userId='me', id='t00000', body={'removeLabelIds': ['UNREAD']}).execute()
+    fetched = service.calls.get('gmail.users.threads.get', 0)
+
+    threads = sync.sync(service)
+
+    assert _ids(threads) == ['t00001', 't00002', 't00003']
+    assert sorted(sync.last_changed) == ['t00000', 't00003']
+    assert service.calls['gmail.users.threads.get'] - fetched == 2
+    assert sync.history_id == str(service.history_id)
+
+def test_expired_history_falls_back_to_a_full_sync():
+    service, sync = _synced()
+    service.add_message('t00003', SENDER, "New question", "When does the next batch start?")
+    service.expire_history()
+
+    threads = sync.sync(service)
+
+    assert _ids(threads) == ['t00000', 't00001', 't00002', 't00003']
+    assert service.calls['gmail.users.getProfile'] == 2
+
+def test_failed_refetch_keeps_the_thread_and_replays_history(monkeypatch):
+    service, sync = _synced()
+    service.add_message('t00001', SENDER, "Question 1", "Any update?")
+    _fail_fetches(monkeypatch, service, 't00001', 500, 'Backend Error')
+
+    assert _ids(sync.sync(service)) == ['t00000', 't00001', 't00002']
+    assert sync.history_id == '1'
+
+    monkeypatch.undo()
+    assert 'Any update?' in sync.sync(service)[0]['history']
+    assert sync.history_id == str(service.history_id)
+
+def test_failed_refetch_of_a_read_thread_drops_it(monkeypatch):
+    service, sync = _synced()
+    service.users().threads().modify(userId='me', id='t00001', body={'removeLabelIds': ['UNREAD']}).execute()
+    _fail_fetches(monkeypatch, service, 't00001', 500, 'Backend Error')
+
+    assert _ids(sync.sync(service)) == ['t00000', 't00002']
+
+def test_deleted_thread_is_dropped():
+    service, sync = _synced()
+    service.add_message('t00002', SENDER, "Question 2", "Never mind")
+    del service.threads['t00002']
+
+    assert _ids(sync.sync(service)) == ['t00000', 't00001']
+    assert sync.history_id == str(service.history_id)
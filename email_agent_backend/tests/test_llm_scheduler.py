@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from agent import RAGAgent, nexa_file_path
+from benchmarks.fake_llm import FakeAPIError, FakeFileSearchBackend, FakeGenaiClient
+from llm_scheduler import BULK, FAST, INTERACTIVE, STRONG, LLMScheduler, ModelRouter
+
+STRONG_MODEL = "strong-model"
+FAST_MODEL = "fast-model"
+
+def _generate(client, model=STRONG_MODEL):
+    return lambda: client.models.generate_content(model=model, contents="Hello")
+
+def test_overload_halves_the_limit_and_success_raises_it():
+    scheduler = LLMScheduler(max_concurrency=16, initial_concurrency=8, max_retries=0)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.run(_generate(FakeGenaiClient(latency=0, quota_error_rate=1.0)))
+    assert scheduler.limit == 4
+
+    scheduler.run(_generate(FakeGenaiClient(latency=0)))
+    assert scheduler.limit == 4.25
+    assert scheduler.stats()['decreases'] == 1
+
+def test_overloads_from_one_window_decrease_the_limit_once():
+    scheduler = LLMScheduler(max_concurrency=16, initial_concurrency=8, max_retries=0)
+    with pytest.raises(FakeAPIError):
+        with scheduler.slot():
+            with scheduler.slot():
+                raise FakeAPIError(429, 'RESOURCE_EXHAUSTED', "Quota exceeded")
+    assert scheduler.limit == 4
+    assert scheduler.stats()['overloaded'] == 2
+
+def test_overloaded_calls_are_retried():
+    client = FakeGenaiClient(latency=0, quota_concurrency=0)
+    scheduler = LLMScheduler(max_concurrency=4, initial_concurrency=4, max_retries=2, backoff_base=0)
+
+    with pytest.raises(FakeAPIError):
+        scheduler.run(_generate(client))
+    assert client.rejected == 3
+    assert scheduler.stats()['retried'] == 2
+
+def test_interactive_calls_are_admitted_before_queued_bulk_calls():
+    scheduler = LLMScheduler(max_concurrency=1, min_concurrency=1, initial_concurrency=1)
+    order = []
+
+    def call(priority):
+        scheduler.run(lambda: order.append(priority), priority=priority)
+
+    def wait_for_queue(depth):
+        deadline = time.monotonic() + 5
+        while scheduler.queue_depth() < depth and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    blocker = scheduler.slot()
+    blocker.__enter__()
+    threads = []
+    for depth, priority in enumerate([BULK, BULK, INTERACTIVE], start=1):
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        wait_for_queue(depth)
+    blocker.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == [INTERACTIVE, BULK, BULK]
+
+def test_router_sends_simple_inquiries_to_the_fast_tier():
+    router = ModelRouter(STRONG_MODEL, FAST_MODEL, max_words=20, keywords="refund,urgent")
+
+    assert router.route("When does the weekend batch start?") == (FAST, 'simple')
+    assert router.route("I would like a refund for my course") == (STRONG, 'keyword')
+    assert router.route("word " * 21) == (STRONG, 'long')
+    assert ModelRouter(STRONG_MODEL, "").route("Hi") == (STRONG, 'single_tier')
+
+def _agent(client):
+    return RAGAgent(file_path=nexa_file_path, model_name=STRONG_MODEL, backend=FakeFileSearchBackend(),
+                    background=False, retrieval="file_search", client=client,
+                    scheduler=LLMScheduler(max_retries=0), router=ModelRouter(STRONG_MODEL, FAST_MODEL))
+
+def _ask(agent, text):
+    usage = {}
+    agent.call([{"role": "system", "content": "Answer from the knowledge base."},
+                {"role": "user", "content": text}], query=text, usage=usage)
+    return usage
+
+@pytest.mark.parametrize("text, tier, model", [
+    ("When does the weekend batch start?", FAST, FAST_MODEL),
+    ("This is urgent, please escalate my refund request.", STRONG, STRONG_MODEL),
+])
+def test_agent_calls_the_model_of_the_routed_tier(text, tier, model):
+    client = FakeGenaiClient(latency=0)
+    usage = _ask(_agent(client), text)
+
+    assert (usage['tier'], usage['model'], usage['escalated']) == (tier, model, False)
+    assert client.calls == {model: 1}
+
+def test_ungrounded_fast_answer_escalates_to_the_main_model():
+    client = FakeGenaiClient(latency=0, grounded_rate={STRONG_MODEL: 1.0, FAST_MODEL: 0.0})
+    usage = _ask(_agent(client), "When does the weekend batch start?")
+
+    assert (usage['tier'], usage['model'], usage['escalated']) == (STRONG, STRONG_MODEL, True)
+    assert client.calls == {FAST_MODEL: 1, STRONG_MODEL: 1}
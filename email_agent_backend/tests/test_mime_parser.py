@@ -0,0 +1,112 @@
+import base64
+
+import pytest
+
+from mime_parser import BodyMemo, extract_body, html_to_text, strip_quoted_reply
+
+def b64(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+
+def part(mime_type, text=None, parts=None, filename='', headers=()):
+    p = {'mimeType': mime_type, 'filename': filename, 'headers': list(headers), 'body': {}}
+    if text is not None:
+        p['body'] = {'data': b64(text), 'size': len(text)}
+    if parts is not None:
+        p['parts'] = parts
+    return p
+
+GMAIL_REPLY = (
+    "Thanks, that helps!\r\n\r\n"
+    "On Mon, Jan 6, 2025 at 10:15 AM Nexa Support <support@nexalearn.com> wrote:\r\n\r\n"
+    "> Hello, resume reviews are included.\r\n> Regards\r\n"
+)
+OUTLOOK_REPLY = (
+    "Could you share the fee schedule?\n\n"
+    "________________________________\n"
+    "From: Nexa Support <support@nexalearn.com>\n"
+    "Sent: Monday, January 6, 2025 10:15 AM\n"
+    "To: Student <student@example.com>\n"
+    "Subject: RE: Fees\n\n"
+    "Fees vary by program.\n"
+)
+OUTLOOK_ORIGINAL = "Yes please.\n\n-----Original Message-----\nFrom: Support\nSent: Monday\n\nEarlier text\n"
+APPLE_REPLY = (
+    "Perfect, see you then.\n\n"
+    "Sent from my iPhone\n\n"
+    "> On Jan 6, 2025, at 10:15, Nexa Support <support@nexalearn.com> wrote:\n>\n> Your interview is booked.\n"
+)
+SIGNATURE = "When does the next batch start?\n\n-- \nAli Khan\nSoftware Engineer\n"
+WRAPPED_HEADER = (
+    "I will enroll next week.\n\n"
+    "On Mon, Jan 6, 2025 at 10:15 AM Nexa Support Team From Lahore <support@nexalearn.com>\nwrote:\n\n> Old text\n"
+)
+HTML_ONLY = (
+    "<html><head><style>p{color:red}</style></head><body>"
+    "<p>Hello,</p><p>Do you offer <b>placement&nbsp;support</b>?</p><ul><li>Data Science</li><li>UI/UX</li></ul>"
+    "<div class=\"gmail_quote\"><div>On Mon wrote:</div><blockquote>old</blockquote></div></body></html>"
+)
+
+CORPUS = [
+    ("plain single part", part('text/plain', "Hello there,\nI need help.\n"), "Hello there,\nI need help."),
+    ("multipart/alternative",
+     part('multipart/alternative', parts=[part('text/plain', "Plain version"), part('text/html', "<p>HTML version</p>")]),
+     "Plain version"),
+    ("mixed > alternative + attachment",
+     part('multipart/mixed', parts=[
+         part('multipart/alternative', parts=[part('text/plain', "Nested plain"), part('text/html', "<p>Nested</p>")]),
+         part('text/plain', "attachment text", filename='notes.txt'),
+     ]),
+     "Nested plain"),
+    ("related > alternative (html only)",
+     part('multipart/related', parts=[
+         part('multipart/alternative', parts=[part('text/html', "<div>Only <i>html</i> here</div>")]),
+         part('image/png', filename='logo.png'),
+     ]),
+     "Only html here"),
+    ("html only with gmail quote", part('text/html', HTML_ONLY),
+     "Hello,\n\nDo you offer placement support?\n\n- Data Science\n- UI/UX"),
+    ("attachment disposition header",
+     part('multipart/mixed', parts=[
+         part('text/plain', "invoice body", headers=[{'name': 'Content-Disposition', 'value': 'attachment; filename=a.txt'}]),
+         part('text/plain', "Real body"),
+     ]),
+     "Real body"),
+    ("gmail quoted reply", part('text/plain', GMAIL_REPLY), "Thanks, that helps!"),
+    ("gmail wrapped header", part('text/plain', WRAPPED_HEADER), "I will enroll next week."),
+    ("outlook header block", part('text/plain', OUTLOOK_REPLY), "Could you share the fee schedule?"),
+    ("outlook original message", part('text/plain', OUTLOOK_ORIGINAL), "Yes please."),
+    ("apple mail + mobile footer", part('text/plain', APPLE_REPLY), "Perfect, see you then."),
+    ("signature delimiter", part('text/plain', SIGNATURE), "When does the next batch start?"),
+    ("no text part", part('multipart/mixed', parts=[part('application/pdf', filename='a.pdf')]), None),
+]
+
+@pytest.mark.parametrize('payload, expected', [case[1:] for case in CORPUS], ids=[case[0] for case in CORPUS])
+def test_extract_body(payload, expected):
+    assert extract_body(payload) == expected
+
+def test_plain_blockquote_in_html_is_kept():
+    markup = "<p>Please see the policy:</p><blockquote>Refunds within 14 days.</blockquote><p>Thanks</p>"
+    assert html_to_text(markup) == "Please see the policy:\n\nRefunds within 14 days.\nThanks"
+
+def test_cited_blockquote_in_html_is_cut():
+    markup = "<div>Sounds good.</div><blockquote type=\"cite\">On Jan 6 you wrote: old</blockquote>"
+    assert html_to_text(markup) == "Sounds good."
+    markup = "<div>Sounds good.</div><blockquote class=\"gmail_quote\" style=\"margin:0\">old</blockquote>"
+    assert html_to_text(markup) == "Sounds good."
+
+def test_from_and_date_lines_in_the_message_are_kept():
+    text = "Two questions.\n\nFrom: the brochure, is the course online?\nDate: when does it start?\n"
+    assert strip_quoted_reply(text) == text.strip()
+
+def test_outlook_header_block_must_start_a_line():
+    text = "Forwarded below. From: Support Sent: Monday To: me\nThanks"
+    assert strip_quoted_reply(text) == text
+
+def test_body_memo_evicts_least_recently_used():
+    memo = BodyMemo(capacity=2)
+    memo.put('a', 'A')
+    memo.put('b', 'B')
+    memo.get('a')
+    memo.put('c', 'C')
+    assert memo.get('b') is BodyMemo.MISSING
+    assert (memo.get('a'), memo.get('c')) == ('A', 'C')
@@ -0,0 +1,19 @@
+from prompt_builder import HISTORY_SEPARATOR, PromptBuilder
+
+def _history(count, words=60):
+    return HISTORY_SEPARATOR.join(
+        f"Message {i}: " + " ".join(f"word{i}x{j}" for j in range(words)) for i in range(count)
+    )
+
+def test_prompt_with_omitted_messages_stays_within_budget():
+    for budget in range(300, 1200, 7):
+        builder = PromptBuilder("Answer the customer.", budget=budget, recent_messages=2, trimmed_message_tokens=40)
+        prompt = builder.build("Fees", "student@example.com", _history(40))
+        assert prompt['usage']['omitted_messages'] > 0
+        assert prompt['usage']['estimated_prompt_tokens'] <= budget
+
+def test_history_that_fits_is_kept_verbatim():
+    history = _history(3, words=5)
+    prompt = PromptBuilder("Answer the customer.", budget=2000).build("Fees", "student@example.com", history)
+    assert prompt['history'] == history
+    assert prompt['usage']['omitted_messages'] == 0
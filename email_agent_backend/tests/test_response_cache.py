@@ -0,0 +1,20 @@
+from response_cache import ResponseCache
+
+QUESTION = "Hi, could you tell me how long the resume review takes and whether it includes a LinkedIn profile check?"
+
+def _cache():
+    return ResponseCache(capacity=10, ttl=60, similarity_threshold=0.5)
+
+def test_near_duplicates_match_within_the_same_context():
+    cache = _cache()
+    cache.put("prompt a", QUESTION, "reply for alice", context="alice@example.com\x1fResume review")
+
+    assert cache.get("prompt b", QUESTION + " Thanks", context="alice@example.com\x1fResume review") == "reply for alice"
+    assert cache.get("prompt c", QUESTION + " Thanks", context="bob@example.com\x1fResume review") is None
+
+def test_short_messages_are_never_near_matched():
+    cache = _cache()
+    cache.put("prompt a", "Thanks!", "reply to thanks", context="alice@example.com\x1fRe: Order")
+
+    assert cache.get("prompt b", "Thanks!", context="alice@example.com\x1fRe: Order") is None
+    assert cache.get("prompt a", "Thanks!", context="alice@example.com\x1fRe: Order") == "reply to thanks"
@@ -0,0 +1,96 @@
+import pytest
+
+import email_sender
+import send_queue
+from benchmarks.fake_gmail import _http_error
+from send_queue import SendQueue, Step, retryable
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(send_queue.time, 'time', clock)
+    return clock
+
+def _queue(tmp_path, **kwargs):
+    return SendQueue({'message': [Step(lambda payload: None, idempotent=False),
+                                  Step(lambda payload: None, idempotent=True)]},
+                     path=str(tmp_path / "outbox.db"), **kwargs)
+
+def test_same_idempotency_key_returns_the_existing_job(tmp_path):
+    queue = _queue(tmp_path)
+    first = queue.enqueue('message', {'n': 1}, 'key')
+    assert queue.enqueue('message', {'n': 2}, 'key')['id'] == first['id']
+    assert queue.enqueue('message', {'n': 3}, 'other')['id'] != first['id']
+
+def test_dedupe_window_slides_with_each_request(tmp_path, clock):
+    queue = _queue(tmp_path)
+    first = queue.enqueue('message', {}, 'a', dedupe_key='content', dedupe_seconds=600)
+    # A retry 599s later matches wherever the request falls relative to any fixed bucket.
+    clock.now += 599
+    assert queue.enqueue('message', {}, 'b', dedupe_key='content', dedupe_seconds=600)['id'] == first['id']
+    clock.now += 2
+    later = queue.enqueue('message', {}, 'c', dedupe_key='content', dedupe_seconds=600)
+    assert later['id'] != first['id']
+    assert queue.enqueue('message', {}, 'd', dedupe_key='other', dedupe_seconds=600)['id'] not in (first['id'], later['id'])
+
+def test_queue_message_dedupes_retries_but_not_later_repeats(tmp_path, clock, monkeypatch):
+    queue = _queue(tmp_path)
+    monkeypatch.setattr(queue, 'start', lambda: None)
+    monkeypatch.setattr(email_sender, 'outbox', queue)
+    send = lambda: email_sender.queue_message('t1', "Thanks, resolved.", 'c@example.com', 'Re: Help')
+    first = send()
+    clock.now += email_sender.MESSAGE_DEDUPE_SECONDS - 1
+    assert send()['id'] == first['id']
+    clock.now += email_sender.MESSAGE_DEDUPE_SECONDS
+    assert send()['id'] != first['id']
+
+SEND = Step(lambda payload: None, idempotent=False)
+MARK_READ = Step(lambda payload: None, idempotent=True)
+
+@pytest.mark.parametrize("error, step, expected", [
+    (_http_error(429, 'Too Many Requests'), SEND, True),
+    (_http_error(403, 'rateLimitExceeded'), SEND, True),
+    (ConnectionRefusedError(), SEND, True),
+    (_http_error(503, 'Backend Error'), SEND, False),
+    (_http_error(503, 'Backend Error'), MARK_READ, True),
+    (ConnectionResetError(), MARK_READ, False),
+    (_http_error(403, 'Forbidden'), MARK_READ, False),
+    (_http_error(400, 'Bad Request'), MARK_READ, False),
+])
+def test_retryable(error, step, expected):
+    assert retryable(error, step) is expected
+
+def test_expired_lease_is_recovered_by_the_next_poll(tmp_path, clock):
+    queue = _queue(tmp_path, lease_seconds=60)
+    interrupted_send = queue.enqueue('message', {}, 'send')
+    interrupted_mark_read = queue.enqueue('message', {}, 'mark-read')
+    assert queue._claim()['id'] == interrupted_send['id']
+    assert queue._claim()['id'] == interrupted_mark_read['id']
+    queue._update(interrupted_mark_read['id'], steps_done=1)
+
+    clock.now += 30
+    assert queue._claim() is None
+
+    clock.now += 61
+    # Repeating a send could deliver it twice, so that job fails; marking as read is repeated.
+    assert queue._claim()['id'] == interrupted_mark_read['id']
+    assert queue.get(interrupted_send['id'])['status'] == 'failed'
+    assert queue.get(interrupted_mark_read['id'])['status'] == 'in_progress'
+
+def test_running_job_keeps_its_lease(tmp_path, clock):
+    queue = _queue(tmp_path, lease_seconds=60)
+    job = queue.enqueue('message', {}, 'send')
+    queue._claim()
+    # What the lease renewal thread does while a step runs.
+    for _ in range(3):
+        clock.now += 40
+        queue._update(job['id'])
+        assert queue._claim() is None
+    assert queue.get(job['id'])['status'] == 'in_progress'
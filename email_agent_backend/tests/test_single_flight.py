@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from shared_state import MemoryState
+from single_flight import SingleFlight
+
+def _flights(state, **kwargs):
+    return SingleFlight('test', state=state, poll_interval=0.01, **kwargs)
+
+def test_concurrent_callers_share_one_call():
+    flights = _flights(MemoryState())
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return 'draft'
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do('key', work))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flights.in_flight() == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('draft', False)] + [('draft', True)] * 3
+    assert flights.in_flight() == 0
+
+def test_follower_in_another_worker_gets_the_published_result():
+    state = MemoryState()
+    leader = _flights(state).begin('key')
+    assert leader.leader
+    follower = {}
+    thread = threading.Thread(target=lambda: follower.update(result=_flights(state).do('key', lambda: 'again')))
+    thread.start()
+    time.sleep(0.05)
+    leader.finish('draft')
+    thread.join(5)
+
+    assert follower['result'] == ('draft', True)
+
+def test_failed_leader_hands_over_to_a_waiting_worker():
+    state = MemoryState()
+    leader = _flights(state).begin('key')
+    follower = {}
+    thread = threading.Thread(target=lambda: follower.update(result=_flights(state).do('key', lambda: 'retried')))
+    thread.start()
+    time.sleep(0.05)
+    leader.fail(RuntimeError("LLM call failed"))
+    thread.join(5)
+
+    assert follower['result'] == ('retried', False)
+
+def test_lock_of_a_crashed_leader_expires():
+    state = MemoryState()
+    # A leader that died without releasing its lock or refreshing it.
+    state.add('flight:test:key', 'dead-worker', ttl=0.2)
+
+    started = time.monotonic()
+    assert _flights(state).do('key', lambda: 'draft') == ('draft', False)
+    assert time.monotonic() - started >= 0.2
+
+def test_live_leader_keeps_its_lock_past_the_ttl():
+    state = MemoryState()
+    leader = _flights(state, lock_ttl=0.15).begin('key')
+    follower = {}
+    thread = threading.Thread(target=lambda: follower.update(result=_flights(state).do('key', lambda: 'duplicate')))
+    thread.start()
+    # Three lock TTLs, e.g. waiting in the LLM scheduler queue.
+    time.sleep(0.45)
+    leader.finish('draft')
+    thread.join(5)
+
+    assert follower['result'] == ('draft', True)
+
+def test_waiting_for_another_worker_times_out():
+    state = MemoryState()
+    leader = _flights(state).begin('key')
+    try:
+        with pytest.raises(TimeoutError):
+            _flights(state, wait_timeout=0.1).do('key', lambda: 'draft')
+    finally:
+        leader.fail(RuntimeError("cancelled"))
+
+def test_waiting_for_a_local_leader_times_out():
+    flights = _flights(MemoryState(), wait_timeout=0.1)
+    leader = flights.begin('key')
+    follower = flights.begin('key')
+    try:
+        assert not follower.leader
+        with pytest.raises(TimeoutError):
+            follower.wait()
+    finally:
+        leader.fail(RuntimeError("cancelled"))
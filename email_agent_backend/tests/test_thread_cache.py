@@ -0,0 +1,38 @@
+from thread_cache import ThreadCache
+
+def _thread(thread_id, sender, history_id='5'):
+    return {'thread_id': thread_id, 'subject': f"Question from {sender}", 'sender': sender,
+            'history': 'Hello', 'history_id': history_id}
+
+def test_accounts_do_not_share_entries():
+    cache = ThreadCache(path=':memory:')
+    cache.put_thread(_thread('t1', 'a@example.com'), ['m1'], account_id='a')
+    cache.put_message('m1', 't1', [{'name': 'From', 'value': 'a@example.com'}], 'body of a', account_id='a')
+
+    assert cache.get_thread('t1', history_id='5', account_id='a')['sender'] == 'a@example.com'
+    assert cache.get_thread('t1', history_id='5', account_id='b') is None
+    assert cache.get_thread('t1') is None
+    assert cache.get_message('m1', account_id='b') is None
+
+    cache.put_thread(_thread('t1', 'b@example.com'), ['m1'], account_id='b')
+    assert cache.get_thread('t1', account_id='a')['sender'] == 'a@example.com'
+    assert cache.get_thread('t1', account_id='b')['sender'] == 'b@example.com'
+
+def test_newer_history_id_is_a_miss():
+    cache = ThreadCache(path=':memory:')
+    cache.put_thread(_thread('t1', 'a@example.com', history_id='5'), [], account_id='a')
+    assert cache.get_thread('t1', history_id='6', account_id='a') is None
+
+def test_hits_do_not_write_but_still_protect_from_eviction():
+    cache = ThreadCache(path=':memory:', max_threads=2)
+    cache.put_thread(_thread('t1', 'a@example.com'), [], account_id='a')
+    cache.put_thread(_thread('t2', 'a@example.com'), [], account_id='a')
+    writes = cache._conn.total_changes
+
+    assert cache.get_thread('t1', account_id='a') is not None
+    assert cache._conn.total_changes == writes
+
+    cache.put_thread(_thread('t3', 'a@example.com'), [], account_id='a')
+    assert cache.get_thread('t1', account_id='a') is not None
+    assert cache.get_thread('t2', account_id='a') is None
+    assert cache.get_thread('t3', account_id='a') is not None
@@ -0,0 +1,263 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from accounts import DEFAULT_ACCOUNT
+from storage import data_path
+
+# Headers kept for each cached message; everything else in the payload is discarded.
+CACHED_HEADERS = ('From', 'To', 'Subject', 'Date', 'Message-ID', 'References')
+# The running size totals are recounted from the tables after this many writes, to pick up
+# entries written or evicted by other processes sharing the file.
+THREAD_CACHE_RECOUNT_WRITES = int(os.getenv("THREAD_CACHE_RECOUNT_WRITES", "1000"))
+# Cache hits update recency in memory; it is written to the file once this many threads are
+# pending, and always before an eviction.
+THREAD_CACHE_ACCESS_FLUSH = int(os.getenv("THREAD_CACHE_ACCESS_FLUSH", "256"))
+
+class ThreadCache:
+    """
+    A persistent SQLite cache of parsed Gmail threads and messages.
+
+    Threads are keyed by account and thread ID and stored with the historyId they were
+    parsed at, so a lookup with a newer historyId is treated as a miss. Messages are keyed by
+    account and message ID and hold the cached headers and cleaned body; a message never
+    changes once sent, so its entry stays valid until evicted. Gmail IDs are only unique
+    within a mailbox, and an account never sees another account's entries.
+
+    Least recently used threads (and their messages) are evicted when the cache exceeds
+    `max_threads` entries or `max_bytes` of stored text. The entry count and size are kept
+    as running totals, so writes do not scan the tables. Hits record recency in memory
+    rather than writing to the file, so concurrent reads do not queue behind a commit.
+    """
+
+    def __init__(self, path=None, max_threads=None, max_bytes=None):
+        self.path = path or os.getenv("THREAD_CACHE_PATH") or data_path("thread_cache.db")
+        self.max_threads = max_threads or int(os.getenv("THREAD_CACHE_MAX_THREADS", "5000"))
+        self.max_bytes = max_bytes or int(os.getenv("THREAD_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (account_id, thread_id) -> time of the latest hit not yet written to accessed_at.
+        self._accessed = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(threads)")]
+        if columns and 'account_id' not in columns:
+            # Entries from before accounts were keyed by thread ID alone; it is only a cache.
+            self._conn.executescript("DROP TABLE threads; DROP TABLE IF EXISTS messages;")
+        elif columns and 'customer_message' not in columns:
+            self._conn.execute("ALTER TABLE threads ADD COLUMN customer_message TEXT")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS threads (
+                account_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                history_id TEXT,
+                subject TEXT,
+                sender TEXT,
+                history TEXT,
+                message_ids TEXT,
+                size INTEGER,
+                accessed_at REAL,
+                customer_message TEXT,
+                PRIMARY KEY (account_id, thread_id)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                account_id TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                thread_id TEXT,
+                headers TEXT,
+                body TEXT,
+                size INTEGER,
+                PRIMARY KEY (account_id, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_threads_accessed ON threads (accessed_at);
+            CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (account_id, thread_id);
+        """)
+        self._conn.commit()
+        self._recount()
+
+    def get_thread(self, thread_id, history_id=None, account_id=DEFAULT_ACCOUNT):
+        """
+        Returns the cached thread dictionary ('thread_id', 'subject', 'sender', 'history',
+        'history_id', 'customer_message', 'message_ids'), or None if it is missing or older than `history_id`.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT history_id, subject, sender, history, message_ids, customer_message FROM threads "
+                "WHERE account_id = ? AND thread_id = ?",
+                (account_id, thread_id)
+            ).fetchone()
+            if row is None or (history_id is not None and row[0] != str(history_id)):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._accessed[(account_id, thread_id)] = time.time()
+            if len(self._accessed) >= THREAD_CACHE_ACCESS_FLUSH:
+                self._flush_accessed()
+                self._conn.commit()
+
+        return {
+            'thread_id': thread_id,
+            'subject': row[1],
+            'sender': row[2],
+            'history': row[3],
+            'history_id': row[0],
+            'customer_message': row[5],
+            'message_ids': json.loads(row[4] or '[]'),
+        }
+
+    def put_thread(self, thread_data, message_ids, account_id=DEFAULT_ACCOUNT, messages=()):
+        """
+        Stores a parsed thread (as produced by parse_thread) of an account along with its
+        message IDs, and the newly parsed `messages` of the thread in the same transaction.
+
+        Args:
+            messages: (message_id, headers, body) tuples to store as in put_message.
+        """
+        size = len(thread_data.get('history') or '') + len(thread_data.get('subject') or '')
+        with self._lock:
+            for message_id, headers, body in messages:
+                self._store_message(message_id, thread_data['thread_id'], headers, body, account_id)
+            if self._replaced_size("threads", "thread_id", thread_data['thread_id'], account_id) is None:
+                self._count += 1
+            self._accessed.pop((account_id, thread_data['thread_id']), None)
+            self._bytes += size
+            self._conn.execute(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    account_id,
+                    thread_data['thread_id'],
+                    None if thread_data.get('history_id') is None else str(thread_data['history_id']),
+                    thread_data.get('subject'),
+                    thread_data.get('sender'),
+                    thread_data.get('history'),
+                    json.dumps(list(message_ids)),
+                    size,
+                    time.time(),
+                    thread_data.get('customer_message'),
+                )
+            )
+            self._writes += 1
+            if self._writes % THREAD_CACHE_RECOUNT_WRITES == 0:
+                self._recount()
+            self._evict()
+            self._conn.commit()
+
+    def get_message(self, message_id, account_id=DEFAULT_ACCOUNT):
+        """
+        Returns {'headers': {...}, 'body': str or None} for a cached message, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT headers, body FROM messages WHERE account_id = ? AND message_id = ?", (account_id, message_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'headers': json.loads(row[0]), 'body': row[1]}
+
+    def put_message(self, message_id, thread_id, headers, body, account_id=DEFAULT_ACCOUNT):
+        """
+        Stores the cached headers and cleaned body of a message.
+
+        Args:
+            headers: The Gmail payload header list [{'name': ..., 'value': ...}, ...].
+        """
+        with self._lock:
+            self._store_message(message_id, thread_id, headers, body, account_id)
+            self._conn.commit()
+
+    def _store_message(self, message_id, thread_id, headers, body, account_id):
+        # Caller holds the lock and commits.
+        kept = {h['name']: h['value'] for h in headers if h['name'] in CACHED_HEADERS}
+        self._replaced_size("messages", "message_id", message_id, account_id)
+        self._bytes += len(body or '')
+        self._conn.execute(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+            (account_id, message_id, thread_id, json.dumps(kept), body, len(body or ''))
+        )
+
+    def _replaced_size(self, table, key, value, account_id):
+        # Caller holds the lock. Takes an entry about to be replaced out of the running
+        # byte total and returns its size, or None if there is no entry.
+        row = self._conn.execute(
+            f"SELECT size FROM {table} WHERE account_id = ? AND {key} = ?", (account_id, value)
+        ).fetchone()
+        if row is None:
+            return None
+        self._bytes -= row[0] or 0
+        return row[0] or 0
+
+    def invalidate(self, thread_id, account_id=DEFAULT_ACCOUNT):
+        """Removes a thread and its messages from the cache."""
+        with self._lock:
+            if self._replaced_size("threads", "thread_id", thread_id, account_id) is not None:
+                self._count -= 1
+            self._accessed.pop((account_id, thread_id), None)
+            self._bytes -= self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM messages WHERE account_id = ? AND thread_id = ?",
+                (account_id, thread_id)
+            ).fetchone()[0]
+            self._conn.execute("DELETE FROM threads WHERE account_id = ? AND thread_id = ?", (account_id, thread_id))
+            self._conn.execute("DELETE FROM messages WHERE account_id = ? AND thread_id = ?", (account_id, thread_id))
+            self._conn.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and current cache size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'threads': self._count,
+            'bytes': self._bytes,
+        }
+
+    def _recount(self):
+        # Caller holds the lock (or is the constructor).
+        self._count, thread_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM threads").fetchone()
+        self._bytes = thread_bytes + self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        self._writes = 0
+
+    def _flush_accessed(self):
+        # Caller holds the lock and commits. A newer accessed_at (a rewrite of the thread,
+        # or a hit in another process) is kept.
+        self._conn.executemany(
+            "UPDATE threads SET accessed_at = ? WHERE account_id = ? AND thread_id = ? AND accessed_at < ?",
+            [(accessed_at, account_id, thread_id, accessed_at)
+             for (account_id, thread_id), accessed_at in self._accessed.items()]
+        )
+        self._accessed.clear()
+
+    def _evict(self):
+        # Caller holds the lock.
+        if self._count <= self.max_threads and self._bytes <= self.max_bytes:
+            return
+        # Over a limit: evict against exact totals, in case other processes changed the file.
+        self._recount()
+        count, total_bytes = self._count, self._bytes
+        if count <= self.max_threads and total_bytes <= self.max_bytes:
+            return
+
+        self._flush_accessed()
+        rows = self._conn.execute(
+            "SELECT t.account_id, t.thread_id, t.size + COALESCE((SELECT SUM(m.size) FROM messages m "
+            "WHERE m.account_id = t.account_id AND m.thread_id = t.thread_id), 0) "
+            "FROM threads t ORDER BY t.accessed_at ASC"
+        ).fetchall()
+        evicted = []
+        for account_id, thread_id, size in rows:
+            if count <= self.max_threads and total_bytes <= self.max_bytes:
+                break
+            evicted.append((account_id, thread_id))
+            count -= 1
+            total_bytes -= size
+
+        self._conn.executemany("DELETE FROM threads WHERE account_id = ? AND thread_id = ?", evicted)
+        self._conn.executemany("DELETE FROM messages WHERE account_id = ? AND thread_id = ?", evicted)
+        self._count, self._bytes = count, total_bytes
+
+thread_cache = ThreadCache()
+metrics.register_cache('thread', lambda: (thread_cache.hits, thread_cache.misses))
@@ -7,7 +7,9 @@ interface Email {
   thread_id: string;
   subject: string;
   sender: string;
-  history: string;
+  history?: string; // loaded on demand from /emails/{thread_id}
+  snippet?: string;
+  history_id?: string | null;
 }
 
 const API_BASE = ''; // Use relative path for unified port deployment
@@ -74,8 +76,31 @@ const App: React.FC = () => {
   const fetchEmails = async () => {
     setLoading(true);
     try {
-      const res = await axios.get(`${API_BASE}/emails`);
-      setEmails(res.data);
+      // Stream thread summaries as NDJSON so the first ones render before the whole inbox is loaded;
+      // the conversation history is fetched when a thread is opened
+      const res = await fetch(`${API_BASE}/emails/stream?view=summary`);
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      const received: Email[] = [];
+      let buffer = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+        const batch = lines.filter(line => line.trim()).map(line => JSON.parse(line));
+        const errors = batch.filter(item => item.error);
+        if (errors.length) console.error("Error fetching emails", errors[0].error);
+
+        received.push(...batch.filter(item => !item.error));
+        setEmails([...received]);
+        setLoading(false);
+      }
     } catch (err) {
       console.error("Error fetching emails", err);
     } finally {
@@ -95,11 +120,55 @@ const App: React.FC = () => {
     if (contentContainer) contentContainer.scrollTo(0, 0);
 
     try {
-      const res = await axios.post(`${API_BASE}/generate_draft`, email);
-      setDraft(res.data.draft);
+      let thread = email;
+      if (thread.history === undefined) {
+        const threadRes = await axios.get(`${API_BASE}/emails/${thread.thread_id}`, {
+          params: { history_id: thread.history_id ?? undefined },
+        });
+        thread = { ...email, ...threadRes.data };
+        setSelectedEmail(thread);
+        setEmails(prev => prev.map(e => e.thread_id === thread.thread_id ? thread : e));
+      }
+
+      // Stream the draft as server-sent events so text appears while it is generated
+      const res = await fetch(`${API_BASE}/generate_draft/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(thread),
+      });
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let text = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const raw of events) {
+          const eventLine = raw.split('\n').find(line => line.startsWith('event: '));
+          const dataLine = raw.split('\n').find(line => line.startsWith('data: '));
+          if (!dataLine) continue;
+          const data = JSON.parse(dataLine.slice(6));
+
+          if (eventLine === 'event: error') throw new Error(data.error);
+          if (eventLine === 'event: done') {
+            text = data.draft;
+          } else {
+            text += data.delta;
+          }
+          setDraft(text);
+          setIsGenerating(false);
+        }
+      }
     } catch (err: any) {
       console.error("Error generating draft", err);
-      setError(err.response?.data?.detail || "Failed to generate draft.");
+      setError(err.message || "Failed to generate draft.");
     } finally {
       setIsGenerating(false);
     }
@@ -164,7 +233,7 @@ const App: React.FC = () => {
                 key={email.thread_id}
                 sender={getSenderName(email.sender)}
                 subject={email.subject}
-                preview={email.history.split('\n')[0]}
+                preview={email.snippet ?? email.history?.split('\n')[0] ?? ''}
                 isActive={selectedEmail?.thread_id === email.thread_id}
                 onClick={() => selectEmail(email)}
               />
@@ -198,7 +267,7 @@ const App: React.FC = () => {
 
                 {/* History */}
                 <div className="mb-4 animate-fade-in space-y-3" style={{ animationDelay: '0.1s' }}>
-                  {selectedEmail.history.split('---').map((msg, i, arr) => {
+                  {(selectedEmail.history ?? '').split('---').map((msg, i, arr) => {
                     if (i % 2 === 0) {
                       const { text: cleanQuestion, time: questionTime } = parseMessage(msg);
                       // Look ahead for response